@@ -1,23 +1,113 @@
-from flask import Flask, render_template, request, send_from_directory, jsonify
+from flask import (Flask, Request, Response, render_template, request, send_from_directory, jsonify,
+                   stream_with_context)
+import json
 import os
+import re
+import tempfile
+from functools import lru_cache
+from itertools import chain, islice
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-from OCC.Core.STEPControl import STEPControl_Reader
-from OCC.Core.TopExp import TopExp_Explorer
-from OCC.Core.TopAbs import TopAbs_SOLID
-from OCC.Core.Bnd import Bnd_Box
-from OCC.Core.BRepBndLib import brepbndlib
+from stepscan import prescan_step_file, scan_step_file
+from topology import BBOX_MODES, walk_shape
+from assembly import analyse_incremental, analyse_roots_parallel, diff_roots
+from cache import ResultCache, hash_file, make_cache_key
+from shapestore import ShapeStore, load_shape
+from readers import STEP_FORMATS, input_extensions, sniff_format, strip_input_extension
+from formats import OUTPUT_FORMATS, save_solids, write_json
+from mesh import MESH_LODS, MeshCache, build_mesh, cached_mesh, load_mesh
+from results import SolidsResult
+from pmi import PMI_KINDS, PMIIndex, document_pmi, document_shape, read_step_document, save_pmi_report
+from solid import save_inspection_to_file
+from spatial import SolidIndex
+from surface import SURFACE_TYPES, FaceIndex, iter_surfaces, save_surface_report
+from metrics import (METRICS_ENABLED, extend_trace, instrumented, registry, server_timing, stage, trace_start,
+                     trace_stop)
+from jobs import (ERROR_EXCEPTION, JOB_DONE, JOB_FAILED, LARGE_JOB_MAX_RSS, LARGE_JOB_QUEUE_DEPTH, LARGE_JOB_TIMEOUT,
+                  LARGE_JOB_WORKERS, PARALLEL_JOB_MAX_RSS, PARALLEL_JOB_QUEUE_DEPTH, PARALLEL_JOB_WORKERS, JobQueue,
+                  QueueFullError)
+from storage import (DOWNLOAD_MAX_BYTES, MAX_UPLOAD_BYTES, SPOOL_MAX_AGE, SPOOL_PREFIX, Janitor, SpoolFile,
+                     UploadTooLarge, remove_file, spool_upload)
+
+
+class SpoolingRequest(Request):
+    """
+    Request whose multipart file parts are parsed straight into spool files
+    in the upload folder and hashed on the way, instead of into temporary
+    files that save_uploaded_file would copy again.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.spools = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = SpoolFile(app.config['UPLOAD_FOLDER'], suffix=upload_extension(filename or '') or '',
+                          max_bytes=app.config['MAX_CONTENT_LENGTH'])
+        self.spools.append(spool)
+        return spool
+
 
 app = Flask(__name__)
+app.request_class = SpoolingRequest
 
 # Path to store uploaded files and temporary converted files
 UPLOAD_FOLDER = 'uploads'
 USER_DOWNLOAD_FOLDER = 'downloads'  # Folder to save converted .txt files
+PARTS_FOLDER = 'parts'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(USER_DOWNLOAD_FOLDER, exist_ok=True)
+os.makedirs(PARTS_FOLDER, exist_ok=True)
+
+# Analyses one upload can request; those that need the shape share one transfer
+ANALYSES = ('solids', 'surfaces', 'pmi', 'metadata', 'mesh')
+# Analyses that read the STEP structure itself rather than the shape
+STEP_ANALYSES = ('pmi', 'metadata')
+
+# Parts kept for paging through their surfaces, addressed by content hash
+PARTS_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB
+PARTS_MAX_AGE = 24 * 60 * 60  # parts not paged for a day are dropped
+PART_SHAPE_CACHE_SIZE = 4  # transferred shapes kept in memory between pages
+PART_ID_PATTERN = re.compile(r'[0-9a-f]{64}')
+SURFACE_PAGE_MAX = 1000
+LISTING_POLL_INTERVAL = 0.1  # seconds between reads of a listing a worker is writing
+PMI_INDEX_CACHE_SIZE = 16  # PMI indexes kept in memory for repeated queries
+SOLID_INDEX_CACHE_SIZE = 16  # spatial indexes kept in memory for repeated queries
+NEAREST_MAX = 1000
+
+# Pre-scan thresholds: inputs above a LARGE one are converted in the large job
+# queue, inputs with more than MAX_ENTITY_COUNT entities are refused outright
+LARGE_FILE_BYTES = 64 * 1024 * 1024  # 64 MB
+LARGE_ENTITY_COUNT = 1000000
+MAX_ENTITY_COUNT = 20000000
+# Decompressed size beyond which a (gzip-compressed) STEP file is refused
+MAX_STEP_BYTES = int(os.environ.get('STEP_MAX_DECOMPRESSED_MB', 4096)) * 1024 * 1024
+# Run synchronous /upload conversions and every other OCC call of a request
+# (surface listings, PMI, meshes) in a job worker too, so a file that exhausts
+# memory or hangs OCC only takes that worker down
+ISOLATE_UPLOADS = os.environ.get('STEP_ISOLATE_UPLOADS', '1') != '0'
 
 # Configure the app
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['USER_DOWNLOAD_FOLDER'] = USER_DOWNLOAD_FOLDER
+app.config['PARTS_FOLDER'] = PARTS_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+app.config['SERVER_TIMING'] = os.environ.get('STEP_SERVER_TIMING', '1') != '0'
+
+# Persistent cache of extraction results keyed by upload content and options
+result_cache = ResultCache()
+
+# Transferred shapes in binary BRep form, so later analyses skip STEP parsing
+shape_store = ShapeStore()
+
+# Tessellated shapes as GLB, per content hash and level of detail
+mesh_cache = MeshCache()
+
+# Worker pools for conversions by queue name, 'default', 'large' or 'parallel', started on first use
+job_queues = {}
+
+# Background cleanup of uploads/, downloads/ and parts/, started on first upload
+janitor = None
 
 
 @app.route('/')
@@ -28,153 +118,1070 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    if 'file' not in request.files:
-        return jsonify({'success': False, 'error': 'No file part'})
+    safe_filename, file_path, content_hash, error = save_uploaded_file()
+    if error:
+        return jsonify({'success': False, 'error': error})
+
+    # Metadata-only requests are answered by the streaming scanner without OCC
+    if request.values.get('mode') == 'inspect':
+        try:
+            if sniff_format(file_path) not in STEP_FORMATS:
+                return jsonify(error_result('unsupported_analysis', 'Inspection needs a STEP file.')), 422
+            with stage('inspect', 'scan') as timer:
+                inspection = scan_step_file(file_path)
+                timer.add('entities', inspection['entity_count'])
+            return jsonify({'success': True, 'inspection': inspection})
+        finally:
+            remove_file(file_path)
+
+    options, error = get_conversion_options()
+    if error:
+        remove_file(file_path)
+        return jsonify({'success': False, 'error': error})
+
+    # Repeat uploads are rendered from the result cache here, without OCC or a job
+    if ISOLATE_UPLOADS and is_cached_upload(content_hash, **options):
+        return jsonify(convert_upload(file_path, safe_filename, content_hash=content_hash, **options))
+
+    queue_name, rejection, status = admit_upload(file_path, options)
+    if rejection:
+        remove_file(file_path)
+        return jsonify(rejection), status
+
+    if not ISOLATE_UPLOADS:
+        return jsonify(convert_upload(file_path, safe_filename, content_hash=content_hash, **options))
+    if queue_name == 'large':
+        # Too large to convert while the client waits; answer with a job to poll
+        return submit_conversion(queue_name, file_path, safe_filename, content_hash, options)
+
+    try:
+        job = get_job_queue(queue_name).run(convert_upload, file_path, safe_filename, content_hash=content_hash,
+                                            owned_files=(file_path,), **options)
+    except QueueFullError as e:
+        remove_file(file_path)
+        return jsonify(error_result('queue_full', str(e))), 503
+    extend_trace(job['trace'])
+    if job['status'] == JOB_FAILED:
+        return jsonify(error_result(job['error_code'], f"The conversion was stopped. {job['error']}"))
+    return jsonify(job['result'])
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue the uploaded .stp file for conversion in the worker pool and return
+    the job id immediately. Inputs the pre-scan flags as large go to the
+    large job queue.
+    """
+    safe_filename, file_path, content_hash, error = save_uploaded_file()
+    if error:
+        return jsonify({'success': False, 'error': error})
+
+    options, error = get_conversion_options()
+    if error:
+        remove_file(file_path)
+        return jsonify({'success': False, 'error': error})
+
+    queue_name, rejection, status = admit_upload(file_path, options)
+    if rejection:
+        remove_file(file_path)
+        return jsonify(rejection), status
+    return submit_conversion(queue_name, file_path, safe_filename, content_hash, options)
+
+
+def submit_conversion(queue_name, file_path, safe_filename, content_hash, options):
+    try:
+        job_id = get_job_queue(queue_name).submit(convert_upload, file_path, safe_filename,
+                                                  content_hash=content_hash, owned_files=(file_path,), **options)
+    except QueueFullError as e:
+        remove_file(file_path)
+        return jsonify(error_result('queue_full', str(e))), 503
+
+    return jsonify({'success': True, 'job_id': job_id, 'queue': queue_name}), 202
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Returns the status of a conversion job, including its result once done.
+    """
+    _, job = find_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, **job})
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Streams status changes of a conversion job as server-sent events.
+    """
+    job_queue, job = find_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return Response(stream_with_context(job_queue.events(job_id)), mimetype='text/event-stream')
+
+
+@app.route('/surfaces', methods=['POST'])
+def upload_surfaces():
+    """
+    Stores the uploaded .stp file as a part and lists its surfaces like
+    GET /surfaces/<part_id>, which serves any later pages.
+    """
+    safe_filename, file_path, content_hash, error = save_uploaded_file()
+    if error:
+        return jsonify({'success': False, 'error': error})
+    queue_name, rejection, status = admit_upload(file_path)
+    if rejection:
+        remove_file(file_path)
+        return jsonify(rejection), status
+
+    # Keep the part under its content hash so later pages can be served from it
+    os.replace(file_path, part_path(content_hash))
+    return list_surfaces(content_hash, queue_name)
+
+
+@app.route('/surfaces/<part_id>')
+def list_surfaces(part_id, queue_name='default'):
+    """
+    Streams the surfaces of a stored part as NDJSON, or returns one page of
+    them when 'limit' is given. 'type' filters by a comma-separated list of
+    SURFACE_TYPES and 'cursor' resumes after the given surface number.
+    The part is measured in a job worker.
+    """
+    if not PART_ID_PATTERN.fullmatch(part_id) or not os.path.exists(part_path(part_id)):
+        return jsonify({'success': False, 'error': 'Part not found'}), 404
+
+    types = [name for name in request.args.get('type', '').split(',') if name]
+    unknown = [name for name in types if name not in SURFACE_TYPES]
+    if unknown:
+        return jsonify({'success': False, 'error': f"Unknown surface type: {', '.join(unknown)}"}), 400
+    try:
+        cursor = int(request.args.get('cursor', 0))
+        limit = request.args.get('limit')
+        limit = min(int(limit), SURFACE_PAGE_MAX) if limit is not None else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'cursor and limit must be integers'}), 400
+    if cursor < 0 or (limit is not None and limit < 1):
+        return jsonify({'success': False, 'error': 'cursor must be >= 0 and limit >= 1'}), 400
+
+    # Touch the part so the janitor evicts the least recently paged ones first
+    os.utime(part_path(part_id), None)
+
+    if limit is not None:
+        page, failure = run_job('Failed to read the STEP file.', surface_page, part_id, types, cursor, limit,
+                                queue_name=queue_name, affinity=part_id)
+        if failure:
+            return failure
+        if page is None:
+            return jsonify({'success': False, 'error': 'Failed to read the STEP file'}), 422
+        return jsonify({'success': True, 'part': part_id, **page})
+
+    if not ISOLATE_UPLOADS:
+        lines = surface_listing(part_id, types, cursor)
+        if lines is None:
+            return jsonify({'success': False, 'error': 'Failed to read the STEP file'}), 422
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+    # The worker appends rows to a spool file as it measures them, and they
+    # are streamed from here as they arrive; the file is removed afterwards
+    fd, listing_path = tempfile.mkstemp(prefix=SPOOL_PREFIX, suffix='.ndjson', dir=app.config['UPLOAD_FOLDER'])
+    os.close(fd)
+    job_queue = get_job_queue(queue_name)
+    try:
+        job_id = job_queue.submit(write_surface_listing, part_id, types, cursor, listing_path, affinity=part_id)
+    except QueueFullError as e:
+        remove_file(listing_path)
+        return jsonify(error_result('queue_full', str(e))), 503
+
+    listing = open(listing_path)
+    lines = follow_job_output(job_queue, job_id, listing)
+    # The summary line comes first, once the worker has read the part
+    summary = next(lines, None)
+    if summary is None:
+        listing.close()
+        remove_file(listing_path)
+        job = job_queue.get(job_id)
+        if job is not None and job['status'] == JOB_FAILED:
+            print(f"Error in write_surface_listing: {job['error']}")
+            return jsonify(error_result(job['error_code'], 'Failed to read the STEP file.')), 422
+        return jsonify({'success': False, 'error': 'Failed to read the STEP file'}), 422
+
+    def generate():
+        try:
+            yield summary
+            job = yield from lines
+            if job is not None and job['status'] == JOB_FAILED:
+                print(f"Error in write_surface_listing: {job['error']}")
+                yield json.dumps(dict(error_result(job['error_code'], 'Failed to read the STEP file.'),
+                                      record='error')) + '\n'
+        finally:
+            listing.close()
+            remove_file(listing_path)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def follow_job_output(job_queue, job_id, f):
+    """
+    Yield each complete line a job appends to the open file f while it runs,
+    and the rest once it finishes. Returns the job's final snapshot.
+    """
+    job = job_queue.get(job_id)
+    buffer = ''
+    while True:
+        finished = job is None or job['status'] in (JOB_DONE, JOB_FAILED)
+        # Read after checking, so nothing written before the job finished is missed
+        buffer += f.read()
+        *complete, buffer = buffer.split('\n')
+        for line in complete:
+            yield line + '\n'
+        if finished:
+            return job
+        job = job_queue.wait(job_id, job['status'], timeout=LISTING_POLL_INTERVAL)
+
+
+def surface_page(part_id, types, cursor, limit):
+    """
+    One page of the surfaces of a stored part, or None when it cannot be read.
+    Runs in a job worker.
+    """
+    faces = load_part_faces(part_id)
+    if faces is None:
+        return None
+    # Measure one face past the page to know whether another page follows
+    page = list(islice(iter_surfaces(faces, types, cursor), limit + 1))
+    next_cursor = page[limit - 1]['surface'] if len(page) > limit else None
+    return {'surfaces': page[:limit], 'next_cursor': next_cursor}
+
+
+def surface_listing(part_id, types, cursor):
+    """
+    NDJSON lines listing the surfaces of a stored part, a summary record
+    first, measured lazily; None when the part cannot be read.
+    """
+    faces = load_part_faces(part_id)
+    if faces is None:
+        return None
+    summary = json.dumps({'record': 'summary', 'part': part_id, 'types': types, 'cursor': cursor}) + '\n'
+    rows = (json.dumps(dict(row, record='row')) + '\n' for row in iter_surfaces(faces, types, cursor))
+    return chain([summary], rows)
+
+
+def write_surface_listing(part_id, types, cursor, listing_path):
+    """
+    Append the listing of a stored part to listing_path line by line, so the
+    request can stream rows while later ones are still being measured.
+    Returns the number of rows, or None when the part cannot be read.
+    Runs in a job worker.
+    """
+    lines = surface_listing(part_id, types, cursor)
+    if lines is None:
+        return None
+    count = -1  # the summary line
+    # Line buffered: every row is visible to the request as soon as it is written
+    with open(listing_path, 'w', buffering=1) as f:
+        for line in lines:
+            f.write(line)
+            count += 1
+    return count
+
+
+def part_path(part_id):
+    return os.path.join(app.config['PARTS_FOLDER'], f"{part_id}.stp")
+
+
+@lru_cache(maxsize=PART_SHAPE_CACHE_SIZE)
+def load_part(part_id):
+    """
+    Load a stored part's shape; recent shapes stay cached for the following pages.
+    """
+    try:
+        return load_shape(part_path(part_id), part_id, shape_store, 'surfaces')
+    except Exception as e:
+        print(f"Error loading part {part_id}: {e}")
+        return None
+
+
+@lru_cache(maxsize=PART_SHAPE_CACHE_SIZE)
+def load_part_faces(part_id):
+    """
+    Index the faces of a stored part once, so every page seeks straight to its cursor.
+    """
+    shape = load_part(part_id)
+    if shape is None:
+        return None
+    with stage('surfaces', 'index') as timer:
+        faces = FaceIndex(shape)
+        timer.add('faces', len(faces))
+    return faces
+
+
+@app.route('/pmi', methods=['POST'])
+def upload_pmi():
+    """
+    Extracts the dimensions, geometric tolerances and datums of the uploaded
+    .stp file and answers like GET /pmi/<part_id>, which serves later queries.
+    """
+    safe_filename, file_path, content_hash, error = save_uploaded_file()
+    if error:
+        return jsonify({'success': False, 'error': error})
+    queue_name, rejection, status = admit_upload(file_path)
+    if not rejection and sniff_format(file_path) not in STEP_FORMATS:
+        rejection, status = error_result('unsupported_analysis', 'PMI needs a STEP file.'), 422
+    if rejection:
+        remove_file(file_path)
+        return jsonify(rejection), status
+
+    try:
+        _, failure = run_job('Failed to read PMI from the STEP file.', extract_pmi, file_path, content_hash,
+                             queue_name=queue_name, owned_files=(file_path,))
+    finally:
+        remove_file(file_path)
+    if failure:
+        return failure
+    return query_pmi(content_hash)
+
+
+def extract_pmi(file_path, content_hash):
+    # Runs in a job worker; the PMIIndex reaches the request through the result cache
+    get_pmi_index(file_path, content_hash)
+
+
+@app.route('/pmi/<part_id>')
+def query_pmi(part_id):
+    """
+    Returns the PMI items of a part filtered by 'kind' (one of PMI_KINDS),
+    'type' (e.g. Flatness) and 'shape' (the label entry of an annotated shape).
+    """
+    if not PART_ID_PATTERN.fullmatch(part_id):
+        return jsonify({'success': False, 'error': 'Part not found'}), 404
+    try:
+        pmi_index = load_pmi_index(part_id)
+    except KeyError:
+        return jsonify({'success': False, 'error': 'No PMI for this part. Please upload it again.'}), 404
+
+    kind = request.args.get('kind')
+    if kind is not None and kind not in PMI_KINDS:
+        return jsonify({'success': False, 'error': f"Unknown PMI kind: {kind}"}), 400
+    items = pmi_index.query(kind=kind, type_name=request.args.get('type'), shape=request.args.get('shape'))
+    return jsonify({'success': True, 'part': part_id, 'summary': pmi_index.summary(), 'items': items})
+
+
+@app.route('/solids/<part_id>/<query>')
+def query_solids(part_id, query):
+    """
+    Spatial queries over the solid boxes of a part analysed through /upload
+    or /jobs with the same 'bbox' and 'tolerance' options:
+      intersect - solids whose boxes overlap 'box' (x_min,y_min,z_min,x_max,y_max,z_max)
+      nearest   - the 'k' solids closest to 'point' (x,y,z) or 'box'
+      pairs     - every pair of solids whose boxes overlap
+    Solids are numbered from 1 as in the reports.
+    """
+    if query not in ('intersect', 'nearest', 'pairs'):
+        return jsonify({'success': False, 'error': f"Unknown query: {query}"}), 404
+    if not PART_ID_PATTERN.fullmatch(part_id):
+        return jsonify({'success': False, 'error': 'Part not found'}), 404
+    bbox_mode, tolerance, error = get_bbox_options()
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    try:
+        index = load_solid_index(part_id, bbox_mode, tolerance)
+    except KeyError:
+        return jsonify({'success': False, 'error': 'No solids analysis for this part with these options.'}), 404
+
+    if query == 'pairs':
+        with stage('solids', 'pairs') as timer:
+            pairs = index.overlapping_pairs() + 1
+            timer.add('pairs', len(pairs))
+        return jsonify({'success': True, 'part': part_id, 'pair_count': len(pairs), 'pairs': pairs.tolist()})
+
+    box, error = get_query_box(required=query == 'intersect')
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+
+    if query == 'intersect':
+        solids = index.intersecting(box) + 1
+        return jsonify({'success': True, 'part': part_id, 'solids': solids.tolist()})
+
+    try:
+        k = min(int(request.args.get('k', 1)), NEAREST_MAX)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'k must be an integer'}), 400
+    positions, distances = index.nearest(box, k)
+    return jsonify({'success': True, 'part': part_id,
+                    'solids': [{'solid': int(position) + 1, 'distance': float(distance)}
+                               for position, distance in zip(positions, distances)]})
+
+
+@app.route('/mesh/<part_id>')
+def part_mesh(part_id):
+    """
+    Serves the tessellated shape of a part as GLB, at 'lod' (one of
+    MESH_LODS, coarse by default) or at an absolute linear 'deflection',
+    which is rounded and kept within the range of the levels of detail.
+    Levels are meshed on first request in a job worker and cached, so a
+    viewer can show the coarse mesh at once and fetch finer ones on demand.
+    """
+    if not PART_ID_PATTERN.fullmatch(part_id):
+        return jsonify({'success': False, 'error': 'Part not found'}), 404
+    lod = request.args.get('lod', 'coarse')
+    if lod not in MESH_LODS:
+        return jsonify({'success': False, 'error': f"Unknown level of detail: {lod}"}), 400
+    try:
+        deflection = request.args.get('deflection')
+        deflection = float(deflection) if deflection is not None else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'deflection must be a number'}), 400
+    if deflection is not None and not deflection > 0:
+        return jsonify({'success': False, 'error': 'deflection must be positive'}), 400
+
+    glb = cached_mesh(part_id, mesh_cache, lod, deflection)
+    if glb is None:
+        glb, failure = run_job('Failed to tessellate the part.', mesh_part, part_id, lod, deflection,
+                               affinity=part_id)
+        if failure:
+            return failure
+        if glb is None:
+            return jsonify({'success': False, 'error': 'Part not found. Please upload it again.'}), 404
+    return Response(glb, mimetype='model/gltf-binary')
+
+
+def mesh_part(part_id, lod, deflection):
+    """
+    Tessellate a stored shape or part and return the GLB, or None when neither
+    is stored. Runs in a job worker.
+    """
+    shape = shape_store.get(part_id)
+    if shape is None and os.path.exists(part_path(part_id)):
+        shape = load_part(part_id)
+    if shape is None:
+        return None
+    return build_mesh(part_id, shape, mesh_cache, lod, deflection)
+
+
+def get_query_box(required=True):
+    """
+    Read the query region from 'box' (six numbers) or 'point' (three numbers).
+    Returns (box, error).
+    """
+    for name, count in (('box', 6), ('point', 3)):
+        if name == 'point' and required:
+            break
+        value = request.args.get(name)
+        if value is None:
+            continue
+        try:
+            numbers = [float(part) for part in value.split(',')]
+        except ValueError:
+            numbers = []
+        if len(numbers) != count:
+            return None, f"'{name}' takes {count} comma-separated numbers"
+        return (numbers if count == 6 else numbers * 2), None
+    return None, "'box' is required" if required else "'point' or 'box' is required"
+
+
+def get_job_queue(name='default'):
+    # Start the worker pools lazily so importing this module in workers is cheap
+    if name not in job_queues:
+        if name == 'large':
+            job_queues[name] = JobQueue(workers=LARGE_JOB_WORKERS, max_queue=LARGE_JOB_QUEUE_DEPTH,
+                                        timeout=LARGE_JOB_TIMEOUT, max_rss=LARGE_JOB_MAX_RSS)
+        elif name == 'parallel':
+            job_queues[name] = JobQueue(workers=PARALLEL_JOB_WORKERS, max_queue=PARALLEL_JOB_QUEUE_DEPTH,
+                                        max_rss=PARALLEL_JOB_MAX_RSS)
+        else:
+            job_queues[name] = JobQueue()
+    return job_queues[name]
+
+
+def run_job(failure, func, *args, queue_name='default', owned_files=(), affinity=None, **kwargs):
+    """
+    Run func(*args, **kwargs) in a worker of the named job queue and wait for
+    it, or in the request thread when ISOLATE_UPLOADS is off, so OCC does not
+    run in the request thread by default. failure is the message of the
+    error response of a failed job. Jobs for one part pass its id as
+    affinity so they reach the worker that has it loaded.
+    Returns (result, error response or None).
+    """
+    if not ISOLATE_UPLOADS:
+        try:
+            return func(*args, **kwargs), None
+        except Exception as e:
+            print(f"Error in {func.__name__}: {e}")
+            return None, (jsonify(error_result(ERROR_EXCEPTION, failure)), 422)
+    try:
+        job = get_job_queue(queue_name).run(func, *args, owned_files=owned_files, affinity=affinity, **kwargs)
+    except QueueFullError as e:
+        return None, (jsonify(error_result('queue_full', str(e))), 503)
+    # The worker's stages show up in this request's Server-Timing
+    extend_trace(job['trace'])
+    if job['status'] == JOB_FAILED:
+        print(f"Error in {func.__name__}: {job['error']}")
+        return None, (jsonify(error_result(job['error_code'], failure)), 422)
+    return job['result'], None
+
+
+def active_job_files():
+    # Spool files of queued and running jobs, which the janitor must leave alone
+    return set().union(*(job_queue.active_files() for job_queue in list(job_queues.values())))
+
+
+def shutdown_job_queues():
+    # Fail queued jobs and stop every job worker; also runs at interpreter exit
+    for job_queue in list(job_queues.values()):
+        job_queue.shutdown()
+
+
+def find_job(job_id):
+    # Return (queue, job snapshot) of a job in any started queue, or (None, None)
+    for job_queue in list(job_queues.values()):
+        job = job_queue.get(job_id)
+        if job is not None:
+            return job_queue, job
+    return None, None
+
+
+def error_result(error_code, error):
+    # Failed result with a machine-readable code next to the message
+    return {'success': False, 'error': error, 'error_code': error_code}
+
+
+def admit_upload(file_path, options=None):
+    """
+    Pre-scan a spooled upload before any OCC work: refuse files of no known
+    input format or with too many entities, and route large ones to the
+    large queue. Other conversions with the parallel option go to the
+    single-slot parallel queue, since each forks a pool of its own.
+    STEP files are measured decompressed; other formats by size.
+    Returns (queue name, rejection result or None, HTTP status).
+    """
+    input_format = sniff_format(file_path)
+    if input_format is None:
+        return None, error_result('unsupported_format', 'The file is not a STEP, IGES or BREP file.'), 422
+
+    size, entities = os.path.getsize(file_path), 0
+    if input_format in STEP_FORMATS:
+        with stage('inspect', 'prescan') as timer:
+            # Stops reading as soon as the outcome below is decided
+            prescan = prescan_step_file(file_path, size_limit=LARGE_FILE_BYTES, entity_limit=MAX_ENTITY_COUNT,
+                                        max_size=MAX_STEP_BYTES)
+            timer.add('entities', prescan['entity_estimate'])
+        size, entities = prescan['size'], prescan['entity_estimate']
+        if size > MAX_STEP_BYTES:
+            return None, error_result('too_large',
+                                      f"The file decompresses to more than {MAX_STEP_BYTES} bytes."), 413
+    if entities > MAX_ENTITY_COUNT:
+        return None, error_result('too_many_entities',
+                                  f"The file has more than {MAX_ENTITY_COUNT} entities and cannot be converted."), 413
+    if size > LARGE_FILE_BYTES or entities > LARGE_ENTITY_COUNT:
+        return 'large', None, 200
+    if options and options.get('parallel'):
+        return 'parallel', None, 200
+    return 'default', None, 200
+
+
+def start_janitor():
+    # Sweep stale spool files and keep generated reports, parts and cached results within their quota
+    global janitor
+    if janitor is None:
+        janitor = Janitor({
+            UPLOAD_FOLDER: {'max_age': SPOOL_MAX_AGE, 'prefix': SPOOL_PREFIX, 'keep': active_job_files},
+            USER_DOWNLOAD_FOLDER: {'max_bytes': DOWNLOAD_MAX_BYTES},
+            PARTS_FOLDER: {'max_bytes': PARTS_MAX_BYTES, 'max_age': PARTS_MAX_AGE, 'suffix': '.stp'},
+            result_cache.folder: {'max_bytes': result_cache.max_bytes, 'max_age': result_cache.max_age,
+                                  'suffix': '.json'},
+            # Job workers are recycled before their own batched eviction comes round
+            shape_store.folder: {'max_bytes': shape_store.max_bytes, 'max_age': shape_store.max_age,
+                                 'suffix': '.brep'},
+            mesh_cache.folder: {'max_bytes': mesh_cache.max_bytes, 'max_age': mesh_cache.max_age, 'suffix': '.glb'},
+        })
+    return janitor
+
 
-    file = request.files['file']
-    filename = file.filename
+def save_uploaded_file():
+    """
+    Validate the uploaded file's extension against the readers' input formats
+    and stream it into a spool file in the upload folder, hashing it on the
+    way. The content decides which reader is used later.
+    Accepts a multipart form field 'file', which SpoolingRequest already
+    parsed into its spool file, or a raw request body with the name in the
+    'filename' query parameter, spooled here; neither is copied twice.
+    Returns (safe_filename, spool_path, content_hash, error).
+    """
+    start_janitor()
+
+    if request.mimetype == 'multipart/form-data':
+        if 'file' not in request.files:
+            return None, None, None, 'No file part'
+        file = request.files['file']
+        filename, stream = file.filename, file.stream
+    else:
+        filename, stream = request.args.get('filename'), request.stream
 
     if not filename:
-        return jsonify({'success': False, 'error': 'No selected file'})
+        return None, None, None, 'No selected file'
 
     # Validate file extension
-    if not filename.lower().endswith('.stp'):
-        return jsonify({'success': False, 'error': 'Invalid file extension. Please upload a .stp file.'})
+    extension = upload_extension(filename)
+    if extension is None:
+        return None, None, None, f"Invalid file extension. Please upload one of: {', '.join(input_extensions())}."
 
-    # Save the uploaded file
     safe_filename = secure_filename(filename)
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], safe_filename)
-    file.save(file_path)
+    if isinstance(stream, SpoolFile):
+        # The spool file is kept for conversion; it is removed once converted
+        file_path, content_hash, _ = stream.claim()
+    else:
+        # Stream the upload into a spool file; it is removed once converted
+        file_path, content_hash, _ = spool_upload(stream, app.config['UPLOAD_FOLDER'], suffix=extension,
+                                                  max_bytes=app.config['MAX_CONTENT_LENGTH'])
+    return safe_filename, file_path, content_hash, None
+
+
+def upload_extension(filename):
+    # The input extension the file name ends with, or None
+    return next((extension for extension in input_extensions() if filename.lower().endswith(extension)), None)
+
+
+@app.teardown_request
+def discard_spools(exc=None):
+    # Remove the multipart spool files the request did not take as its upload
+    for spool in getattr(request, 'spools', ()):
+        spool.discard()
 
-    # Process the .stp file and get bounding box and solid count info
-    solids_info, shape = process_step_file(file_path)
-    if solids_info:
-        # Save the results as a .txt file in the download folder
-        txt_filename = f"{os.path.splitext(safe_filename)[0]}.txt"
-        txt_file_path = os.path.join(USER_DOWNLOAD_FOLDER, txt_filename)
-        save_as_txt(solids_info, txt_file_path, shape)
 
-        # Return success and the filename for the frontend
-        return jsonify({'success': True, 'filename': txt_filename})
+@app.errorhandler(UploadTooLarge)
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({'success': False, 'error': f"Upload exceeds the limit of {app.config['MAX_CONTENT_LENGTH']} bytes."}), 413
 
-    return jsonify({'success': False, 'error': 'Processing failed. Please try again.'})
 
+def is_parallel_request():
+    # Opt-in per request, since parallel transfer only pays off for assemblies with several roots or components
+    return request.values.get('parallel', '').lower() in ('1', 'true', 'yes')
 
-def process_step_file(stp_path):
+
+def get_bbox_options():
     """
-    Process the STEP file to extract solid bounding boxes and solid count.
+    Read the bounding box mode and tolerance of the request.
+    Returns (bbox_mode, tolerance, error).
     """
+    bbox_mode = request.values.get('bbox', 'fast').lower()
+    if bbox_mode not in BBOX_MODES:
+        return None, None, f"Unsupported bounding box mode: {bbox_mode}"
     try:
-        # Initialize STEP reader
-        step_reader = STEPControl_Reader()
-        status = step_reader.ReadFile(stp_path)
-        if status != 1:
-            raise Exception(f"Error reading STEP file: {stp_path}")
+        tolerance = float(request.values.get('tolerance', 0.0))
+    except ValueError:
+        return None, None, 'Tolerance must be a number.'
+    if tolerance < 0:
+        return None, None, 'Tolerance must not be negative.'
+    return bbox_mode, tolerance, None
 
-        # Transfer the contents to a shape
-        step_reader.TransferRoots()
-        shape = step_reader.Shape()
 
-        # Get the bounding boxes for each solid
-        solid_boxes = calculate_individual_solid_bounding_boxes(shape)
+def get_analyses():
+    """
+    Read the comma-separated ANALYSES of the request, solids by default.
+    Returns (analyses, error).
+    """
+    analyses = [name.strip().lower() for name in request.values.get('analyses', 'solids').split(',') if name.strip()]
+    unknown = [name for name in analyses if name not in ANALYSES]
+    if unknown:
+        return None, f"Unsupported analysis: {', '.join(unknown)}"
+    if not analyses:
+        return None, 'No analysis selected.'
+    # Drop repeats but keep the requested order
+    return list(dict.fromkeys(analyses)), None
 
-        # Get the solid count
-        solid_count = count_solids(shape)
 
-        # Combine the results into one output
-        result = {
-            "solid_count": solid_count,
-            "solids": solid_boxes
-        }
+def get_conversion_options():
+    """
+    Read and validate every conversion option of the request.
+    Returns (options, error) with options as convert_upload keyword arguments.
+    """
+    analyses, error = get_analyses()
+    if error:
+        return None, error
 
-        return result, shape
+    fmt = request.values.get('format', 'txt').lower()
+    if fmt not in OUTPUT_FORMATS:
+        return None, f"Unsupported output format: {fmt}"
 
-    except Exception as e:
-        print(f"Error during processing: {e}")
-        return None, None
+    bbox_mode, tolerance, error = get_bbox_options()
+    if error:
+        return None, error
 
+    # Diffing against a previous revision needs the per-component fingerprints of the incremental mode
+    previous = request.values.get('previous') or None
+    if previous is not None and not PART_ID_PATTERN.fullmatch(previous):
+        return None, 'previous must be the part id of an earlier upload.'
+    if previous is not None and 'solids' not in analyses:
+        analyses = ['solids'] + analyses
+    incremental = previous is not None or request.values.get('incremental', '').lower() in ('1', 'true', 'yes')
 
-def calculate_individual_solid_bounding_boxes(shape):
-    # Initialize a list to hold bounding boxes for each solid
-    solid_boxes = []
-    explorer = TopExp_Explorer(shape, TopAbs_SOLID)
-
-    while explorer.More():
-        solid = explorer.Current()  # Get the current solid
-        bbox = Bnd_Box()
-        brepbndlib.Add(solid, bbox)  # Calculate bounding box for this solid
-        x_min, y_min, z_min, x_max, y_max, z_max = bbox.Get()
-        solid_boxes.append({
-            "BoundingBox": {
-                "X_min": x_min, "Y_min": y_min, "Z_min": z_min,
-                "X_max": x_max, "Y_max": y_max, "Z_max": z_max
-            },
-            "Width": x_max - x_min,
-            "Height": y_max - y_min,
-            "Depth": z_max - z_min
-        })
-        explorer.Next()
+    return {'analyses': analyses, 'parallel': is_parallel_request(), 'fmt': fmt,
+            'bbox_mode': bbox_mode, 'tolerance': tolerance, 'incremental': incremental, 'previous': previous}, None
+
+
+def convert_upload(file_path, safe_filename, analyses=('solids',), parallel=False, fmt='txt', content_hash=None,
+                   cleanup=True, bbox_mode='fast', tolerance=0.0, incremental=False, previous=None):
+    """
+    Run the requested ANALYSES on a spooled upload and write one report
+    per analysis to the download folder, as .txt or one of the machine-readable
+    OUTPUT_FORMATS, then remove the spool file unless cleanup is False.
+    Analyses that need the shape share a single transfer or shape store load;
+    with PMI requested too, the XCAF transfer of the PMI provides that shape.
+    With incremental=True the solids analysis only transfers components it
+    has not seen before, and previous (the part id of an earlier revision)
+    adds a report of the components that changed since. Inputs other than STEP support
+    every analysis that only needs the shape.
+    Runs either in the request thread or in a job worker process.
+    """
+    try:
+        stem = strip_input_extension(safe_filename)
+        content_hash = content_hash or hash_file(file_path)
 
-    return solid_boxes
+        if sniff_format(file_path) not in STEP_FORMATS:
+            unsupported = [analysis for analysis in analyses if analysis in STEP_ANALYSES]
+            if incremental:
+                unsupported.append('incremental')
+            if unsupported:
+                return error_result('unsupported_analysis', f"{', '.join(unsupported)} needs a STEP file.")
+            # Roots can only be transferred in parallel from STEP files
+            parallel = False
+        shapes = []
+        documents = []
 
+        def get_document():
+            if not documents:
+                documents.append(read_step_document(file_path))
+            return documents[0]
 
-def count_solids(shape):
-    # Count the number of solids in the shape
-    solid_count = 0
-    explorer = TopExp_Explorer(shape, TopAbs_SOLID)
-    while explorer.More():
-        solid_count += 1
-        explorer.Next()
-    return solid_count
+        def get_shape():
+            if not shapes:
+                # With PMI requested too, one XCAF transfer serves both instead of a second plain one
+                read = (lambda: document_shape(get_document())) if 'pmi' in analyses else None
+                shapes.append(load_shape(file_path, content_hash, shape_store, 'shape', read))
+            return shapes[0]
 
+        files = {}
+        cached = False
+        for analysis in analyses:
+            files[analysis] = report_filename(stem, analysis, fmt)
+            report_path = os.path.join(USER_DOWNLOAD_FOLDER, files[analysis])
+            try:
+                if analysis == 'solids':
+                    cached = report_solids(file_path, report_path, fmt, safe_filename, content_hash, get_shape,
+                                           parallel, bbox_mode, tolerance, incremental)
+                elif analysis == 'surfaces':
+                    save_surface_report(get_shape(), report_path, fmt)
+                elif analysis == 'pmi':
+                    save_pmi_report(get_pmi_index(file_path, content_hash, get_document), report_path, fmt)
+                elif analysis == 'metadata':
+                    report_metadata(file_path, report_path, fmt)
+                elif analysis == 'mesh':
+                    # The coarsest level only; finer ones are meshed when /mesh asks for them
+                    with open(report_path, 'wb') as f:
+                        f.write(load_mesh(content_hash, get_shape, mesh_cache))
+            except Exception as e:
+                print(f"Error during {analysis} analysis: {e}")
+                return dict(error_result('analysis_failed', f"The {analysis} analysis failed. Please try again."),
+                            analysis=analysis)
 
-def calculate_overall_bounding_box(shape):
+        if previous:
+            files['diff'] = report_filename(stem, 'diff', fmt)
+            error = report_diff(previous, content_hash, os.path.join(USER_DOWNLOAD_FOLDER, files['diff']), fmt)
+            if error:
+                return error_result('diff_unavailable', error)
+
+        # 'filename' keeps pointing at the first report for existing clients
+        result = {'success': True, 'filename': files[analyses[0]], 'files': files, 'part': content_hash}
+        if cached:
+            result['cached'] = True
+        return result
+    finally:
+        if cleanup:
+            remove_file(file_path)
+
+
+def is_cached_upload(content_hash, analyses=('solids',), bbox_mode='fast', tolerance=0.0, incremental=False,
+                     previous=None, **_):
     """
-    Calculate the bounding box for the entire shape (not just individual solids).
+    True when every requested analysis of an upload can be answered from the
+    result and mesh caches, so convert_upload needs no OCC and can run in the
+    request thread. Metadata and diffs never need OCC.
     """
-    # Create a bounding box for the entire shape
-    bbox = Bnd_Box()
-    brepbndlib.Add(shape, bbox)
+    for analysis in analyses:
+        if analysis == 'solids':
+            if result_cache.get(solids_cache_key(content_hash, bbox_mode, tolerance)) is None:
+                return False
+            if incremental and get_component_manifest(content_hash) is None:
+                return False
+        elif analysis == 'pmi':
+            if result_cache.get(make_cache_key(content_hash, {'analysis': 'pmi'})) is None:
+                return False
+        elif analysis == 'mesh':
+            if cached_mesh(content_hash, mesh_cache) is None:
+                return False
+        elif analysis != 'metadata':
+            return False
+    return True
+
 
-    # Get bounding box dimensions and coordinates
-    x_min, y_min, z_min, x_max, y_max, z_max = bbox.Get()
-    return {
-        "Width": x_max - x_min,
-        "Height": y_max - y_min,
-        "Depth": z_max - z_min,
-        "BoundingBox": {
-            "X_min": x_min, "Y_min": y_min, "Z_min": z_min,
-            "X_max": x_max, "Y_max": y_max, "Z_max": z_max
-        }
-    }
+def report_filename(stem, analysis, fmt):
+    # The solids report keeps the plain name; PMI, metadata and diffs only come as .txt or .json
+    if analysis in ('pmi', 'metadata', 'diff') and fmt != 'txt':
+        fmt = 'json'
+    if analysis == 'mesh':
+        fmt = 'glb'
+    if analysis == 'solids':
+        return f"{stem}.{fmt}"
+    return f"{stem}_{analysis}.{fmt}"
 
 
-def save_as_txt(solids_info, file_path, shape):
+def report_solids(file_path, report_path, fmt, source, content_hash, get_shape, parallel=False,
+                  bbox_mode='fast', tolerance=0.0, incremental=False):
+    """
+    Write the solids report, serving repeat uploads from the result cache.
+    Returns True when the result came from the cache.
+    """
+    # Serve repeat uploads from the result cache without touching OCC
+    cache_key = solids_cache_key(content_hash, bbox_mode, tolerance)
+    with stage('solids', 'cache_lookup') as timer:
+        cached = result_cache.get(cache_key)
+        timer.add('cache_hits' if cached else 'cache_misses', 1)
+    # An incremental run also needs the component manifest, which plain runs do not record
+    if cached and not (incremental and get_component_manifest(content_hash) is None):
+        save_report(SolidsResult.from_dict(cached['solids_info']), report_path, fmt, source)
+        return True
+
+    # Process the .stp file and get bounding box and solid count info
+    solids_info, _ = process_step_file(file_path, parallel=parallel, bbox_mode=bbox_mode, tolerance=tolerance,
+                                       shape=None if parallel or incremental else get_shape(),
+                                       incremental=incremental)
+    if not solids_info:
+        raise Exception("Processing failed")
+
+    manifest, solids_info.roots = solids_info.roots, None
+    if manifest is not None:
+        result_cache.put(make_cache_key(content_hash, {'analysis': 'components'}), {'components': manifest})
+    result_cache.put(cache_key, {'solids_info': solids_info.to_dict(), 'overall_bbox': solids_info.overall_bbox})
+    save_report(solids_info, report_path, fmt, source)
+    return False
+
+
+def get_component_manifest(content_hash):
+    cached = result_cache.get(make_cache_key(content_hash, {'analysis': 'components'}))
+    return cached['components'] if cached else None
+
+
+def report_diff(previous, content_hash, report_path, fmt):
+    """
+    Write the component-by-component diff between an earlier revision and this one.
+    Returns an error message, or None on success.
+    """
+    previous_components = get_component_manifest(previous)
+    if previous_components is None:
+        return 'The previous revision was not analysed incrementally or has expired.'
+    diff = diff_roots(previous_components, get_component_manifest(content_hash))
+    summary = {name: len(components) for name, components in diff.items()}
+
+    if fmt != 'txt':
+        write_json(report_path, dict(diff, previous=previous, current=content_hash, summary=summary))
+        return None
+
+    lines = [f"Previous Revision: {previous}\n", f"Current Revision: {content_hash}\n", "\n"]
+    lines.extend(f"{name.capitalize()} Components: {count}\n" for name, count in summary.items())
+    for name in ('changed', 'added', 'removed'):
+        for component in diff[name]:
+            lines.append(f"\n{name.capitalize()}: root {component['root']} (#{component['entity']}) "
+                         f"{component['product'] or ''}\n"
+                         f"  Fingerprint: {component['fingerprint']}\n")
+    with open(report_path, 'w') as f:
+        f.write("".join(lines))
+    return None
+
+
+def solids_cache_key(content_hash, bbox_mode='fast', tolerance=0.0):
+    return make_cache_key(content_hash, {'analysis': 'solids', 'bbox_mode': bbox_mode, 'tolerance': tolerance})
+
+
+@lru_cache(maxsize=SOLID_INDEX_CACHE_SIZE)
+def load_solid_index(part_id, bbox_mode='fast', tolerance=0.0):
+    """
+    Build the SolidIndex over the cached solid boxes of a part; recent indexes stay in memory.
+    Raises KeyError when the part was not analysed with these box options or has expired.
+    """
+    cached = result_cache.get(solids_cache_key(part_id, bbox_mode, tolerance))
+    if cached is None:
+        raise KeyError(part_id)
+    with stage('solids', 'index'):
+        return SolidIndex.from_solids(SolidsResult.from_dict(cached['solids_info']).solids)
+
+
+def get_pmi_index(file_path, content_hash, get_document=None):
+    """
+    Return the PMIIndex of a STEP file, read through XCAF only once per content.
+    get_document, when given, returns the XCAF document already transferred
+    for the shape instead of reading the file again.
+    """
+    cache_key = make_cache_key(content_hash, {'analysis': 'pmi'})
+    with stage('pmi', 'cache_lookup') as timer:
+        cached = result_cache.get(cache_key)
+        timer.add('cache_hits' if cached else 'cache_misses', 1)
+    if cached:
+        return PMIIndex.from_dict(cached)
+
+    pmi_index = document_pmi(get_document() if get_document is not None else read_step_document(file_path))
+    result_cache.put(cache_key, pmi_index.to_dict())
+    return pmi_index
+
+
+@lru_cache(maxsize=PMI_INDEX_CACHE_SIZE)
+def load_pmi_index(part_id):
+    """
+    Load the cached PMIIndex of a part; recent indexes stay in memory for repeated queries.
+    Raises KeyError when the part's PMI was never extracted or has expired.
+    """
+    cached = result_cache.get(make_cache_key(part_id, {'analysis': 'pmi'}))
+    if cached is None:
+        raise KeyError(part_id)
+    return PMIIndex.from_dict(cached)
+
+
+def report_metadata(file_path, report_path, fmt):
+    """
+    Write the header and entity statistics of the streaming scanner; needs no OCC.
+    """
+    with stage('inspect', 'scan') as timer:
+        inspection = scan_step_file(file_path)
+        timer.add('entities', inspection['entity_count'])
+    if fmt == 'txt':
+        save_inspection_to_file(file_path, inspection, report_path)
+    else:
+        write_json(report_path, inspection)
+
+
+def process_step_file(stp_path, parallel=False, bbox_mode='fast', tolerance=0.0, content_hash=None, shape=None,
+                      incremental=False):
+    """
+    Process the STEP file to extract solid bounding boxes and solid count.
+    An already loaded shape is reused; otherwise it comes from the shape
+    store when this content was seen before.
+    With parallel=True the assembly components are transferred across worker
+    processes and no single shape is returned. With incremental=True only
+    components whose fingerprint is not cached are transferred, no single
+    shape is returned and the result carries the component manifest in roots.
+    Returns (SolidsResult, shape).
+    """
+    try:
+        if incremental:
+            with stage('solids', 'incremental') as timer:
+                walk, manifest, reused = analyse_incremental(stp_path, result_cache, bbox_mode=bbox_mode,
+                                                             tolerance=tolerance)
+                timer.add('components_reused', reused)
+                timer.add('components_transferred', len(manifest) - reused)
+                timer.add('solids', walk.solid_count)
+            walk.roots = manifest
+            return walk, None
+
+        if parallel:
+            with stage('solids', 'parallel_transfer') as timer:
+                walk = analyse_roots_parallel(stp_path, bbox_mode=bbox_mode, tolerance=tolerance)
+                timer.add('solids', walk.solid_count)
+            return walk, None
+
+        # Load the transferred shape, reading the STEP file only on a store miss
+        if shape is None:
+            shape = load_shape(stp_path, content_hash or hash_file(stp_path), shape_store, 'solids')
+
+        # Walk the shape once for per-solid boxes, solid count and overall box
+        with stage('solids', 'walk') as timer:
+            walk = walk_shape(shape, bbox_mode=bbox_mode, tolerance=tolerance)
+            timer.add('solids', walk.solid_count)
+
+        return walk, shape
+
+    except Exception as e:
+        print(f"Error during processing: {e}")
+        return None, None
+
+
+@instrumented('solids', 'write')
+def save_report(solids_info, file_path, fmt, source=None):
+    """
+    Save the results as a .txt report or in a machine-readable format.
+    """
+    if fmt == 'txt':
+        save_as_txt(solids_info, file_path, solids_info.overall_bbox)
+        return
+    # Errors reach convert_upload, which reports the analysis as failed
+    save_solids(solids_info, file_path, fmt, source)
+
+
+def save_as_txt(solids_info, file_path, overall_bbox):
     """
     Save the bounding box and solid count information as a .txt file,
     including the overall bounding box of the entire shape.
     """
     try:
+        # First, write the overall bounding box information
+        lines = [
+            "Overall Dimensions:\n",
+            f"Width: {overall_bbox['Width']},\nHeight: {overall_bbox['Height']},\nDepth: {overall_bbox['Depth']}\n",
+            "\n",
+            f"Bounding Box Mode: {solids_info.bbox_mode}\n",
+            f"Solid Count: {solids_info.solid_count}\n\n"
+        ]
+
+        # Now write the solid-specific bounding boxes, straight from the solid table
+        for idx, (box, dims, obb) in enumerate(solids_info.solids.records(), 1):
+            x_min, y_min, z_min, x_max, y_max, z_max = box
+            width, height, depth = dims
+            lines.append(
+                f"Solid {idx} Bounding Box:\n"
+                f"  X_min: {x_min}, X_max: {x_max}\n"
+                f"  Y_min: {y_min}, Y_max: {y_max}\n"
+                f"  Z_min: {z_min}, Z_max: {z_max}\n"
+                f"  Width: {width}, Height: {height}, Depth: {depth}\n"
+            )
+            if obb:
+                lines.append(
+                    f"  Oriented Center: {obb['Center']}\n"
+                    f"  Oriented Axes: {obb['Axes']}\n"
+                    f"  Oriented Half Sizes: {obb['HalfSizes']}\n"
+                )
+            lines.append("\n")
+
+        # Write the report in a single call instead of one per line
         with open(file_path, 'w') as f:
-            # First, write the overall bounding box information
-            overall_bbox = calculate_overall_bounding_box(shape)
-            f.write(f"Overall Dimensions:\n")
-            f.write(f"Width: {overall_bbox['Width']},\nHeight: {overall_bbox['Height']},\nDepth: {overall_bbox['Depth']}\n")
-            f.write("\n")
-
-            # Now write the solid-specific bounding boxes
-            f.write(f"Solid Count: {solids_info['solid_count']}\n\n")
-            for idx, solid in enumerate(solids_info['solids'], 1):
-                f.write(f"Solid {idx} Bounding Box:\n")
-                f.write(f"  X_min: {solid['BoundingBox']['X_min']}, X_max: {solid['BoundingBox']['X_max']}\n")
-                f.write(f"  Y_min: {solid['BoundingBox']['Y_min']}, Y_max: {solid['BoundingBox']['Y_max']}\n")
-                f.write(f"  Z_min: {solid['BoundingBox']['Z_min']}, Z_max: {solid['BoundingBox']['Z_max']}\n")
-                f.write(f"  Width: {solid['Width']}, Height: {solid['Height']}, Depth: {solid['Depth']}\n")
-                f.write("\n")
+            f.write("".join(lines))
     except Exception as e:
         print(f"Error saving .txt file: {e}")
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Exposes stage durations, memory deltas and item counts for Prometheus.
+    """
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.before_request
+def start_request_trace():
+    if METRICS_ENABLED:
+        trace_start()
+
+
+@app.after_request
+def add_server_timing(response):
+    # Per-request stage timings, visible in the browser's network panel
+    trace = trace_stop()
+    if trace and app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = server_timing(trace)
+    return response
+
+
 @app.route('/download/<filename>')
 def download_file(filename):
     """
@@ -187,4 +1194,5 @@ def download_file(filename):
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Development server only; production runs under gunicorn with gunicorn.conf.py
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1')
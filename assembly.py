@@ -0,0 +1,195 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from OCC.Core.STEPControl import STEPControl_Reader
+from cache import make_cache_key
+from readers import step_source
+from results import SolidsResult
+from stepscan import fingerprint_components, product_name, read_entity_graph, split_components
+from topology import walk_shape, merge_walk_results
+
+# Default number of processes used to transfer assembly components in parallel
+TRANSFER_WORKERS = os.cpu_count() or 1
+
+# STEP reader and transfer targets the worker processes inherit from the
+# parent when the pool forks, and the bounding box options set by _init_worker
+_worker_reader = None
+_worker_targets = []
+_worker_bbox = {}
+
+
+def read_step_file(file_path):
+    step_reader = STEPControl_Reader()
+    with step_source(file_path) as source:
+        status = step_reader.ReadFile(source)
+    if status != 1:
+        raise Exception(f"Error reading STEP file: {file_path}")
+    return step_reader
+
+
+def _transfer_and_walk(step_reader, target, bbox_mode='fast', tolerance=0.0):
+    # Transfer a single root, numbered from 1, or a single model entity and analyse it
+    step_reader.ClearShapes()
+    if isinstance(target, int):
+        step_reader.TransferRoot(target)
+    else:
+        step_reader.TransferEntity(target)
+    walks = [walk_shape(step_reader.Shape(i), bbox_mode=bbox_mode, tolerance=tolerance)
+             for i in range(1, step_reader.NbShapes() + 1)]
+    return merge_walk_results(walks, bbox_mode)
+
+
+def _model_entities(model, graph, entity_ids):
+    """
+    Look up model entities by their STEP entity id. The model numbers its
+    entities in file order, so the position in the entity graph is tried
+    before searching the model by label.
+    """
+    wanted = set(entity_ids)
+    positions = {entity: number for number, entity in enumerate(graph, 1) if entity in wanted}
+    entities = {}
+    for entity in entity_ids:
+        number = positions.get(entity, 0)
+        if not 0 < number <= model.NbEntities() or model.IdentLabel(model.Value(number)) != entity:
+            number = model.NextNumberForLabel(f"#{entity}", 0, True)
+        if number <= 0:
+            raise Exception(f"Entity #{entity} not found in the STEP model")
+        entities[entity] = model.Value(number)
+    return entities
+
+
+def _init_worker(bbox_mode, tolerance):
+    global _worker_bbox
+    _worker_bbox = {'bbox_mode': bbox_mode, 'tolerance': tolerance}
+
+
+def _analyse_target(position):
+    return position, _transfer_and_walk(_worker_reader, _worker_targets[position], **_worker_bbox)
+
+
+def _component_targets(step_reader, file_path):
+    # Transfer targets of every component, roots split into their assembly children, in root order
+    graph = read_entity_graph(file_path)
+    model = step_reader.Model()
+    root_ids = [model.IdentLabel(step_reader.RootForTransfer(index))
+                for index in range(1, step_reader.NbRootsForTransfer() + 1)]
+    components = split_components(graph, root_ids)
+    entity_ids = [entity for root in root_ids for entity, _, _ in components[root]]
+    entities = _model_entities(model, graph, entity_ids)
+    return [entities[entity] for entity in entity_ids]
+
+
+def analyse_roots_parallel(file_path, workers=TRANSFER_WORKERS, bbox_mode='fast', tolerance=0.0):
+    """
+    Transfer and analyse every root of a STEP file across worker processes.
+
+    The parent reads the file once and the pool is forked after that, so
+    the workers share the read model copy-on-write instead of reading the
+    file again. When there are fewer roots than workers, assembly roots are
+    split into their components (see stepscan.split_components) so a single
+    large assembly still spreads over the pool. Workers take one root or
+    component at a time and the results are merged in root order.
+    """
+    global _worker_reader, _worker_targets
+    step_reader = read_step_file(file_path)
+    root_count = step_reader.NbRootsForTransfer()
+
+    # Daemonic processes may not start child processes; job workers are not daemonic
+    if workers > 1 and multiprocessing.current_process().daemon:
+        print(f"Parallel transfer is not possible in daemonic process {multiprocessing.current_process().name}; "
+              f"transferring {file_path} serially")
+        workers = 1
+    targets = list(range(1, root_count + 1))
+    if 1 < workers and root_count < workers:
+        targets = _component_targets(step_reader, file_path)
+    workers = min(workers, len(targets))
+
+    if workers <= 1:
+        walks = [_transfer_and_walk(step_reader, target, bbox_mode, tolerance) for target in targets]
+        return merge_walk_results(walks, bbox_mode)
+
+    _worker_reader, _worker_targets = step_reader, targets
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_init_worker, initargs=(bbox_mode, tolerance)) as executor:
+            results = dict(executor.map(_analyse_target, range(len(targets))))
+    finally:
+        _worker_reader, _worker_targets = None, []
+    return merge_walk_results((results[position] for position in range(len(targets))), bbox_mode)
+
+
+def component_manifest(step_reader, graph):
+    """
+    Describe every component the roots of a read STEP file are transferred
+    as: its root index, entity id (the root itself or, for an assembly root,
+    the NEXT_ASSEMBLY_USAGE_OCCURRENCE of a child), product name and the
+    fingerprint of the entities that hold it.
+    """
+    model = step_reader.Model()
+    root_ids = [model.IdentLabel(step_reader.RootForTransfer(index))
+                for index in range(1, step_reader.NbRootsForTransfer() + 1)]
+    components = fingerprint_components(graph, root_ids)
+    return [{"root": index, "entity": entity, "product": product_name(graph, product or entity),
+             "fingerprint": fingerprint}
+            for index, root in enumerate(root_ids, 1) for entity, product, fingerprint in components[root]]
+
+
+def analyse_incremental(file_path, cache, bbox_mode='fast', tolerance=0.0):
+    """
+    Analyse every component of a STEP file, reusing the cached walk of any
+    component whose fingerprint was analysed before with the same box
+    options, so only new or changed components are transferred. The
+    children of an assembly root are transferred one by one.
+    Returns (merged walk, component manifest, number of reused components).
+    """
+    step_reader = read_step_file(file_path)
+    graph = read_entity_graph(file_path)
+    manifest = component_manifest(step_reader, graph)
+
+    keys = [make_cache_key(component["fingerprint"], {'analysis': 'component', 'bbox_mode': bbox_mode,
+                                                      'tolerance': tolerance})
+            for component in manifest]
+    cached = [cache.get(key) for key in keys]
+    entities = _model_entities(step_reader.Model(), graph,
+                               [component["entity"] for component, walk in zip(manifest, cached) if walk is None])
+    del graph
+
+    walks = []
+    reused = 0
+    for component, key, walk in zip(manifest, keys, cached):
+        if walk is None:
+            walk = _transfer_and_walk(step_reader, entities[component["entity"]], bbox_mode, tolerance)
+            cache.put(key, walk.to_dict())
+        else:
+            walk = SolidsResult.from_dict(walk)
+            reused += 1
+        component["solid_count"] = walk.solid_count
+        walks.append(walk)
+    return merge_walk_results(walks, bbox_mode), manifest, reused
+
+
+def diff_roots(previous, current):
+    """
+    Compare the component manifests of two revisions. Components with a
+    fingerprint seen in the previous revision are unchanged; otherwise a
+    component is changed when the previous revision had one for the same
+    product, else added. Previous components matched by neither are removed.
+    """
+    previous_fingerprints = {root["fingerprint"] for root in previous}
+    current_fingerprints = {root["fingerprint"] for root in current}
+    previous_products = {root["product"] for root in previous
+                         if root["product"] and root["fingerprint"] not in current_fingerprints}
+
+    diff = {"unchanged": [], "changed": [], "added": [], "removed": []}
+    matched_products = set()
+    for root in current:
+        if root["fingerprint"] in previous_fingerprints:
+            diff["unchanged"].append(root)
+        elif root["product"] in previous_products:
+            diff["changed"].append(root)
+            matched_products.add(root["product"])
+        else:
+            diff["added"].append(root)
+    diff["removed"] = [root for root in previous
+                       if root["fingerprint"] not in current_fingerprints and root["product"] not in matched_products]
+    return diff
@@ -0,0 +1,240 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+# Sample files shipped with the repository
+SAMPLE_FILES = ("uploads/stepfile.stp", "uploads/eMG12-95-G60.stp")
+
+# Default number of copies of the first sample in the synthetic assemblies
+DEFAULT_SCALES = (4, 16)
+
+# A stage counts as a regression once it is this much slower than the baseline
+DEFAULT_THRESHOLD = 0.10
+# ... and slower by at least this many seconds, so timer noise on stages of a
+# few milliseconds is not reported
+DEFAULT_MIN_DELTA = 0.05
+# Peak RSS growth below this many KB is not reported either
+DEFAULT_MIN_RSS_DELTA_KB = 16 * 1024
+
+
+def make_scaled_assembly(source_file, copies, output_file):
+    """
+    Write a synthetic multi-root file made of copies of source_file laid out
+    side by side along X, each copy its own root product, so read and
+    transfer costs scale with the copy count and the parallel root transfer
+    has roots to spread over its workers.
+    """
+    from OCC.Core.STEPControl import STEPControl_Writer, STEPControl_AsIs
+    from OCC.Core.TopLoc import TopLoc_Location
+    from OCC.Core.gp import gp_Trsf, gp_Vec
+    from solid import load_step_file
+    from topology import calculate_overall_bounding_box
+
+    shape = load_step_file(source_file)
+    pitch = calculate_overall_bounding_box(shape)["Width"] * 1.1
+
+    # Every Transfer call adds one more root product to the written file
+    writer = STEPControl_Writer()
+    for index in range(copies):
+        trsf = gp_Trsf()
+        trsf.SetTranslation(gp_Vec(index * pitch, 0, 0))
+        writer.Transfer(shape.Moved(TopLoc_Location(trsf)), STEPControl_AsIs)
+    if writer.Write(output_file) != 1:
+        raise Exception(f"Error writing STEP file: {output_file}")
+
+
+def run_case(file_path, bbox_mode="fast"):
+    """
+    Time every stage of the pipeline once on file_path. Runs in a fresh
+    process so the reported peak RSS belongs to this case alone.
+    """
+    from OCC.Core.STEPControl import STEPControl_Reader
+    from assembly import analyse_roots_parallel
+    from formats import save_solids
+    from pmi import load_step_with_pmi
+    from solid import save_to_single_file
+    from surface import SurfaceCollector
+    from topology import walk_shape
+
+    timings = {}
+
+    def timed(stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    step_reader = STEPControl_Reader()
+    status = timed("read", step_reader.ReadFile, file_path)
+    if status != 1:
+        raise Exception(f"Error reading STEP file: {file_path}")
+
+    timed("transfer", step_reader.TransferRoots)
+    shape = step_reader.Shape()
+
+    timed("topology_walk", walk_shape, shape, solid_boxes=False)
+    walk = timed("bbox", walk_shape, shape, bbox_mode=bbox_mode)
+    surfaces = timed("surfaces", walk_shape, shape, solid_boxes=False, face_visitor=SurfaceCollector())
+    timed("pmi", load_step_with_pmi, file_path)
+    timed("parallel_transfer", analyse_roots_parallel, file_path, bbox_mode=bbox_mode)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        timed("write_txt", save_to_single_file, file_path, walk.overall_bbox, walk.solids,
+              walk.solid_count, os.path.join(tmp_dir, "report.txt"), bbox_mode)
+        timed("write_json", save_solids, walk, os.path.join(tmp_dir, "report.json"), "json")
+
+    return {
+        "timings": timings,
+        "solid_count": walk.solid_count,
+        "face_count": surfaces.face_count,
+        # The largest of this process and the transfer pool's workers
+        "peak_rss_kb": max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                           resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    }
+
+
+def _case_process(conn, file_path, bbox_mode):
+    # Entry point of the process of one run; sends (result, error) back
+    try:
+        conn.send((run_case(file_path, bbox_mode), None))
+    except Exception as e:
+        conn.send((None, f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+def run_case_in_process(file_path, bbox_mode):
+    """
+    Run one case in a fresh non-daemonic process, which unlike a pool worker
+    may fork the parallel transfer pool of its own.
+    """
+    context = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_case_process, args=(child_conn, file_path, bbox_mode))
+    process.start()
+    child_conn.close()
+    try:
+        result, error = parent_conn.recv()
+    except EOFError:
+        result, error = None, f"Benchmark process exited with code {process.exitcode}"
+    process.join()
+    if error:
+        raise Exception(f"Benchmark of {file_path} failed: {error}")
+    return result
+
+
+def benchmark_file(file_path, repeat, bbox_mode):
+    """
+    Run a case repeat times, each in its own process, and keep the median
+    time per stage and the largest peak RSS.
+    """
+    runs = [run_case_in_process(file_path, bbox_mode) for _ in range(repeat)]
+
+    stages = runs[0]["timings"].keys()
+    timings = {stage: statistics.median(run["timings"][stage] for run in runs) for stage in stages}
+    timings["total"] = sum(timings.values())
+    return {
+        "file": file_path,
+        "size": os.path.getsize(file_path),
+        "solid_count": runs[0]["solid_count"],
+        "face_count": runs[0]["face_count"],
+        "timings": timings,
+        "peak_rss_kb": max(run["peak_rss_kb"] for run in runs)
+    }
+
+
+def environment_info():
+    try:
+        from OCC import VERSION as occ_version
+    except ImportError:
+        occ_version = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "pythonocc": occ_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, min_delta=DEFAULT_MIN_DELTA,
+            min_rss_delta_kb=DEFAULT_MIN_RSS_DELTA_KB):
+    """
+    Compare stage timings and peak RSS with a baseline result set.
+    Returns a list of regressions that exceed the relative threshold and
+    also the absolute floor: min_delta seconds for timings, min_rss_delta_kb
+    for peak RSS.
+    """
+    regressions = []
+    for name, case in results["cases"].items():
+        base_case = baseline.get("cases", {}).get(name)
+        if base_case is None:
+            continue
+        metrics = dict(case["timings"], peak_rss_kb=case["peak_rss_kb"])
+        base_metrics = dict(base_case["timings"], peak_rss_kb=base_case["peak_rss_kb"])
+        for metric, value in metrics.items():
+            base_value = base_metrics.get(metric)
+            if not base_value:
+                continue
+            floor = min_rss_delta_kb if metric == "peak_rss_kb" else min_delta
+            change = value / base_value - 1
+            if change > threshold and value - base_value >= floor:
+                regressions.append({"case": name, "metric": metric, "baseline": base_value,
+                                    "current": value, "change": change})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the STEP processing pipeline stage by stage.")
+    parser.add_argument("files", nargs="*", default=list(SAMPLE_FILES), help="STEP files to benchmark")
+    parser.add_argument("--scale", type=int, action="append",
+                        help=f"also benchmark a synthetic assembly of N copies (default: {DEFAULT_SCALES})")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the median is kept")
+    parser.add_argument("--bbox-mode", default="fast", help="bounding box mode for the bbox stage")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="where to store the results")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown that counts as a regression (0.10 = 10%%)")
+    parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA,
+                        help="smallest slowdown in seconds that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = {"environment": environment_info(), "cases": {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = [(os.path.basename(path), path) for path in args.files]
+        for copies in args.scale or DEFAULT_SCALES:
+            path = os.path.join(tmp_dir, f"scaled_x{copies}.stp")
+            make_scaled_assembly(args.files[0], copies, path)
+            cases.append((f"scaled_x{copies}", path))
+
+        for name, path in cases:
+            results["cases"][name] = case = benchmark_file(path, args.repeat, args.bbox_mode)
+            stages = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in case["timings"].items())
+            print(f"{name}: {stages}, peak RSS {case['peak_rss_kb'] / 1024:.1f} MB")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results saved to {args.output}")
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold, args.min_delta)
+    for regression in regressions:
+        print(f"REGRESSION {regression['case']} {regression['metric']}: "
+              f"{regression['baseline']:.4g} -> {regression['current']:.4g} (+{regression['change']:.0%})")
+    if not regressions:
+        print(f"No regressions above {args.threshold:.0%} against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import time
+from storage import enforce_quota
+
+# Default location and limits for the persistent result cache
+CACHE_FOLDER = 'cache'
+CACHE_MAX_BYTES = 256 * 1024 * 1024  # 256 MB
+CACHE_MAX_AGE = 30 * 24 * 60 * 60  # 30 days
+# Eviction lists the whole folder, so it only runs after this many puts or
+# once this fraction of max_bytes has been written since the last one
+CACHE_EVICT_EVERY = 64
+CACHE_EVICT_FRACTION = 1 / 16
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path):
+    """
+    Compute the SHA-256 hex digest of a file, reading it in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(content_hash, options=None):
+    """
+    Combine the content hash of an uploaded file with the extraction options
+    into a single cache key, so different options never share an entry.
+    """
+    options_blob = json.dumps(options or {}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f"{content_hash}:{options_blob}".encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent, content-addressed cache of extraction results.
+
+    Each entry is a small JSON file named after its cache key. Entries older
+    than max_age seconds are dropped on lookup, and the oldest entries are
+    evicted once the folder grows beyond max_bytes. Eviction runs every
+    evict_every puts or after max_bytes * CACHE_EVICT_FRACTION bytes were
+    written, not on every put.
+    """
+
+    def __init__(self, folder=CACHE_FOLDER, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE,
+                 evict_every=CACHE_EVICT_EVERY):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self._puts = 0
+        self._written = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    def get(self, key):
+        """
+        Return the stored result for key, or None on a miss or expired entry.
+        """
+        path = self._entry_path(key)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        if self.max_age is not None and time.time() - mtime > self.max_age:
+            self._remove(path)
+            return None
+
+        try:
+            with open(path, 'r') as f:
+                result = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading cache entry {path}: {e}")
+            self._remove(path)
+            return None
+
+        # Touch the entry so eviction keeps recently used results
+        os.utime(path, None)
+        return result
+
+    def put(self, key, result):
+        """
+        Store a JSON-serialisable result under key, evicting old entries
+        when enough has been written since the last eviction.
+        """
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(result, f)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error writing cache entry {path}: {e}")
+            self._remove(tmp_path)
+            return
+
+        self._puts += 1
+        self._written += size
+        if self._puts >= self.evict_every or (self.max_bytes is not None and
+                                               self._written >= self.max_bytes * CACHE_EVICT_FRACTION):
+            self.evict()
+
+    def evict(self):
+        """
+        Remove expired entries, then the least recently used ones until the
+        cache folder fits within max_bytes.
+        """
+        self._puts = self._written = 0
+        enforce_quota(self.folder, self.max_bytes, self.max_age, suffix='.json')
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
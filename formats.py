@@ -0,0 +1,115 @@
+import csv
+import importlib.util
+import json
+import math
+import numpy as np
+
+# Parquet output needs the optional pyarrow package
+PARQUET_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+# Machine-readable formats offered next to the .txt reports
+OUTPUT_FORMATS = ('txt', 'json', 'ndjson', 'csv') + (('parquet',) if PARQUET_AVAILABLE else ())
+
+def table_rows(columns):
+    """
+    Yield one dict of plain Python values per row of a column dict.
+    NaN becomes None so rows stay valid JSON.
+    """
+    names = list(columns)
+    for values in zip(*(columns[name].tolist() for name in names)):
+        yield {name: None if isinstance(value, float) and math.isnan(value) else value
+               for name, value in zip(names, values)}
+
+
+def concat_columns(tables):
+    """
+    Concatenate column dicts with the same columns into one table.
+    """
+    tables = [table for table in tables if table]
+    if not tables:
+        return {}
+    return {name: np.concatenate([table[name] for table in tables]) for name in tables[0]}
+
+
+def _json_default(value):
+    # NumPy scalars and arrays sneak into results; emit them as plain JSON
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def write_json(file_path, document):
+    with open(file_path, 'w') as f:
+        json.dump(document, f, default=_json_default)
+
+
+def write_ndjson(file_path, summary, rows):
+    """
+    Write a summary record followed by one JSON object per row.
+    """
+    with open(file_path, 'w') as f:
+        lines = [json.dumps(dict(summary, record="summary"), default=_json_default)]
+        lines.extend(json.dumps(dict(row, record="row"), default=_json_default) for row in rows)
+        f.write("\n".join(lines) + "\n")
+
+
+def write_csv(file_path, columns):
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns.keys())
+        writer.writerows(zip(*(column.tolist() for column in columns.values())))
+
+
+def write_parquet(file_path, columns):
+    # pyarrow is optional; it is only needed for Parquet output
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet output requires the pyarrow package")
+    pq.write_table(pa.table(columns), file_path)
+
+
+def save_solids(result, file_path, fmt, source=None):
+    """
+    Save a SolidsResult in a machine-readable format. CSV and Parquet are
+    written straight from the columns of its solid table, with the bounding
+    box mode on every row.
+    """
+    summary = {
+        "source": source,
+        "bbox_mode": result.bbox_mode,
+        "solid_count": result.solid_count,
+        "overall_bbox": result.overall_bbox
+    }
+    if fmt == 'json':
+        write_json(file_path, dict(summary, solids=result.solids.to_dicts()))
+    elif fmt == 'ndjson':
+        write_ndjson(file_path, summary, (dict(solid, solid=idx) for idx, solid in enumerate(result.solids.to_dicts(), 1)))
+    elif fmt == 'csv':
+        write_csv(file_path, result.solids.columns(source, result.bbox_mode))
+    elif fmt == 'parquet':
+        write_parquet(file_path, result.solids.columns(source, result.bbox_mode))
+    else:
+        raise ValueError(f"Unsupported output format: {fmt}")
+
+
+def save_surfaces(dimensions, table, stats, file_path, fmt):
+    """
+    Save the overall dimensions, the surface table and the per-solid surface
+    statistics in a machine-readable format. CSV and Parquet hold the surface
+    table only.
+    """
+    summary = {"dimensions": dimensions, "surface_count": len(table["surface"])}
+    if fmt == 'json':
+        write_json(file_path, dict(summary, solids=list(table_rows(stats)), surfaces=list(table_rows(table))))
+    elif fmt == 'ndjson':
+        write_ndjson(file_path, dict(summary, solids=list(table_rows(stats))), table_rows(table))
+    elif fmt == 'csv':
+        write_csv(file_path, table)
+    elif fmt == 'parquet':
+        write_parquet(file_path, table)
+    else:
+        raise ValueError(f"Unsupported output format: {fmt}")
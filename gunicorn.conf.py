@@ -0,0 +1,42 @@
+import os
+
+# Production settings for the STEP service: gunicorn -c gunicorn.conf.py app:app
+bind = os.environ.get('STEP_BIND', '0.0.0.0:8000')
+
+# Job state and the worker pool live inside the web worker, so one worker
+# process serves every request; threads keep uploads, polling and SSE
+# streams concurrent while OCC work runs in the job worker processes.
+workers = int(os.environ.get('STEP_WEB_WORKERS', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('STEP_WEB_THREADS', 8))
+
+# Import the app, and with it every OCC module, once in the master before
+# forking, so workers start warm and share those pages copy-on-write
+preload_app = True
+
+# Synchronous /upload conversions may run as long as a queued job
+timeout = int(os.environ.get('STEP_WEB_TIMEOUT', 600))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    # Runs in the master once preload_app has imported the service
+    from warmup import warm_up
+    server.log.info(f"OCC warm-up took {warm_up():.3f}s")
+
+
+def post_fork(server, worker):
+    # Start the job pool right away; its worker processes fork from this warm
+    # web worker and wait for jobs instead of starting on the first request
+    import app as service
+    service.get_job_queue()
+
+
+def worker_exit(server, worker):
+    # Stop the job pools with the web worker; their processes are not daemonic
+    import app as service
+    service.shutdown_job_queues()
@@ -0,0 +1,437 @@
+import atexit
+import collections
+import json
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+import zlib
+import metrics
+from storage import remove_file
+
+# Default limits for the conversion worker pool
+JOB_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+JOB_QUEUE_DEPTH = 32
+JOB_TIMEOUT = 600  # seconds per job
+JOB_MAX_TASKS_PER_WORKER = 20  # recycle workers to contain OCC memory growth
+JOB_RETENTION = 60 * 60  # keep finished jobs around for polling
+# Resident memory one worker process may use before its job is killed; 0 disables
+JOB_MAX_RSS = int(os.environ.get('STEP_JOB_MAX_RSS_MB', 4096)) * 1024 * 1024
+JOB_POLL_INTERVAL = 0.5  # seconds between memory checks of a running job
+
+# Limits of the separate queue for inputs the pre-scan flags as large, so
+# they never hold up the slots of ordinary conversions
+LARGE_JOB_WORKERS = 1
+LARGE_JOB_QUEUE_DEPTH = 4
+LARGE_JOB_TIMEOUT = int(os.environ.get('STEP_LARGE_JOB_TIMEOUT', 3600))
+LARGE_JOB_MAX_RSS = int(os.environ.get('STEP_LARGE_JOB_MAX_RSS_MB', 16384)) * 1024 * 1024
+
+# Limits of the queue for parallel conversions: each one forks a transfer pool
+# as large as the machine (assembly.TRANSFER_WORKERS), so they run one at a
+# time instead of one pool per slot of the default queue
+PARALLEL_JOB_WORKERS = 1
+PARALLEL_JOB_QUEUE_DEPTH = 8
+PARALLEL_JOB_MAX_RSS = int(os.environ.get('STEP_PARALLEL_JOB_MAX_RSS_MB', 16384)) * 1024 * 1024
+
+# Fork workers where possible so they inherit the OCC modules already
+# imported by the service instead of importing them again on spawn
+JOB_START_METHOD = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+# Start each worker process ahead of its first job, and again after recycling
+JOB_PRESTART = os.environ.get('STEP_JOB_PRESTART', '1') != '0'
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Error codes of failed jobs
+ERROR_EXCEPTION = 'exception'
+ERROR_TIMEOUT = 'timeout'
+ERROR_MEMORY = 'memory_limit'
+ERROR_CRASHED = 'worker_crashed'
+ERROR_SHUTDOWN = 'shutdown'
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def process_rss(pid):
+    """
+    Resident set size of a process in bytes, or None where /proc is unavailable.
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_descendants(pid):
+    """
+    Ids of every child process below pid, found through /proc; empty where
+    /proc is unavailable.
+    """
+    descendants = []
+    pending = [pid]
+    while pending:
+        parent = pending.pop()
+        try:
+            threads = os.listdir(f'/proc/{parent}/task')
+        except OSError:
+            continue
+        for thread in threads:
+            try:
+                with open(f'/proc/{parent}/task/{thread}/children') as f:
+                    children = [int(child) for child in f.read().split()]
+            except (OSError, ValueError):
+                continue
+            descendants.extend(children)
+            pending.extend(children)
+    return descendants
+
+
+def process_tree_rss(pid):
+    """
+    Resident set size of a process and all its descendants in bytes, or None
+    where /proc is unavailable.
+    """
+    rss = process_rss(pid)
+    if rss is None:
+        return None
+    return rss + sum(process_rss(child) or 0 for child in process_descendants(pid))
+
+
+class Job:
+    def __init__(self, func, args, kwargs, files=(), slot=None):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        # Files the job owns, removed by the dispatcher however the job ends
+        self.files = tuple(files)
+        # Worker slot the job is pinned to, or None for the first free one
+        self.slot = slot
+        self.status = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.error_code = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # Stages the worker recorded, as metrics records
+        self.trace = []
+
+    @property
+    def is_finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def to_dict(self, trace=False):
+        snapshot = {
+            'job_id': self.id,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'error_code': self.error_code,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+        if trace:
+            snapshot['trace'] = list(self.trace)
+        return snapshot
+
+
+def _worker_main(conn):
+    """
+    Worker process loop: run (func, args, kwargs) messages until told to stop.
+    """
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        func, args, kwargs = message
+        # Stage metrics recorded here are replayed into the parent's registry
+        metrics.trace_start()
+        try:
+            status, payload = JOB_DONE, func(*args, **kwargs)
+        except Exception as e:
+            status, payload = JOB_FAILED, f"{type(e).__name__}: {e}"
+        conn.send((status, payload, metrics.trace_stop()))
+
+
+class JobQueue:
+    """
+    Bounded job queue backed by a pool of worker processes.
+
+    Conversion runs in separate processes because OCC holds the GIL while
+    transferring shapes. Each worker slot is driven by a dispatcher thread
+    that enforces the per-job timeout and resident memory limit, killing a
+    worker that exceeds either, and recycles its process after
+    max_tasks_per_worker jobs or after a crash. With prestart the next
+    process is forked while the slot is idle, so jobs never wait for one.
+    Failed jobs carry an error message and one of the ERROR_* codes.
+
+    Workers are not daemonic, so a job may start processes of its own (the
+    parallel root transfer does); the memory limit covers them and a killed
+    worker takes them down with it. The queue shuts down at interpreter
+    exit, failing queued and running jobs, and the dispatcher removes the
+    files a job owns once it ends.
+
+    Jobs submitted with the same affinity run on the same worker slot, so
+    whatever that worker process keeps in memory between jobs (a loaded
+    part, its face index) is there for the next one.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_queue=JOB_QUEUE_DEPTH, timeout=JOB_TIMEOUT,
+                 max_tasks_per_worker=JOB_MAX_TASKS_PER_WORKER, retention=JOB_RETENTION,
+                 prestart=JOB_PRESTART, start_method=JOB_START_METHOD, max_rss=JOB_MAX_RSS):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_rss = max_rss
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.retention = retention
+        self.prestart = prestart
+        self.max_queue = max_queue
+        self._pending = collections.deque()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._context = multiprocessing.get_context(start_method)
+        self._closing = threading.Event()
+        self._threads = []
+        # Dispatcher threads are daemonic so interpreter exit reaches the
+        # atexit shutdown below, which stops them and their workers
+        for slot in range(workers):
+            thread = threading.Thread(target=self._run_slot, args=(slot,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.shutdown)
+
+    def submit(self, func, *args, owned_files=(), affinity=None, **kwargs):
+        """
+        Queue func(*args, **kwargs) for execution in a worker process and
+        return the job id. func must be a picklable module-level function.
+        owned_files are removed once the job ends, however it ends; until
+        then active_files() reports them. Jobs with the same affinity (any
+        string, such as a part id) always run on the same worker slot.
+        """
+        slot = None if affinity is None else zlib.crc32(str(affinity).encode()) % self.workers
+        job = Job(func, args, kwargs, owned_files, slot)
+        with self._changed:
+            if self._closing.is_set():
+                raise QueueFullError("Job queue is shutting down.")
+            if len(self._pending) >= self.max_queue:
+                raise QueueFullError("Job queue is full. Please try again later.")
+            self._prune()
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._changed.notify_all()
+        return job.id
+
+    def get(self, job_id, trace=False):
+        """
+        Return a snapshot of the job as a dict, or None if it is unknown.
+        With trace=True it includes the stages the worker recorded.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict(trace) if job else None
+
+    def wait(self, job_id, last_status=None, timeout=None):
+        """
+        Block until the job's status differs from last_status (or timeout)
+        and return its snapshot.
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id].status != last_status,
+                timeout=timeout,
+            )
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def events(self, job_id, keepalive=15):
+        """
+        Yield server-sent event lines for each status change of a job until it
+        finishes.
+        """
+        last_status = None
+        while True:
+            snapshot = self.wait(job_id, last_status, timeout=keepalive)
+            if snapshot is None:
+                yield f"data: {json.dumps({'job_id': job_id, 'status': 'unknown'})}\n\n"
+                return
+            if snapshot['status'] == last_status:
+                yield ": keepalive\n\n"
+                continue
+            last_status = snapshot['status']
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            if last_status in (JOB_DONE, JOB_FAILED):
+                return
+
+    def run(self, func, *args, owned_files=(), affinity=None, **kwargs):
+        """
+        Run func(*args, **kwargs) in a worker process like submit, block until
+        it finishes and return the job's final snapshot, including its trace.
+        """
+        job_id = self.submit(func, *args, owned_files=owned_files, affinity=affinity, **kwargs)
+        snapshot = self.get(job_id)
+        while snapshot is not None and snapshot['status'] not in (JOB_DONE, JOB_FAILED):
+            snapshot = self.wait(job_id, snapshot['status'])
+        return self.get(job_id, trace=True) if snapshot is not None else None
+
+    def depth(self):
+        with self._lock:
+            return len(self._pending)
+
+    def active_files(self):
+        """
+        Files owned by jobs that have not finished yet, queued or running.
+        """
+        with self._lock:
+            return {path for job in self._jobs.values() if not job.is_finished for path in job.files}
+
+    def shutdown(self, timeout=10):
+        """
+        Stop accepting jobs, fail the queued ones, stop any running job and
+        its worker and wait up to timeout seconds for the dispatchers.
+        Safe to call more than once.
+        """
+        with self._changed:
+            if self._closing.is_set():
+                return
+            self._closing.set()
+            pending = list(self._pending)
+            self._pending.clear()
+            self._changed.notify_all()
+        for job in pending:
+            self._finish(job, JOB_FAILED, "The job queue shut down before the job started", ERROR_SHUTDOWN)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _take(self, slot):
+        # Block until a job this slot may run is queued, or the queue closes
+        with self._changed:
+            while not self._closing.is_set():
+                for index, job in enumerate(self._pending):
+                    if job.slot is None or job.slot == slot:
+                        del self._pending[index]
+                        return job
+                self._changed.wait()
+            return None
+
+    def _prune(self):
+        # Drop finished jobs that nobody has polled within the retention window
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.is_finished and job.finished < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _update(self, job, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            self._changed.notify_all()
+
+    def _finish(self, job, status, payload, error_code=None, trace=()):
+        # Drop the files the job owned, then record the outcome
+        for path in job.files:
+            remove_file(path)
+        if status == JOB_DONE:
+            self._update(job, status=JOB_DONE, result=payload, trace=list(trace), finished=time.time())
+        else:
+            self._update(job, status=JOB_FAILED, error=payload, error_code=error_code, trace=list(trace),
+                         finished=time.time())
+
+    def _spawn(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn,), daemon=False)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    @staticmethod
+    def _stop(process, conn, graceful=True):
+        if graceful:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(5)
+        if process.is_alive():
+            # Processes the job started would otherwise outlive the worker
+            for child in process_descendants(process.pid):
+                try:
+                    os.kill(child, signal.SIGKILL)
+                except OSError:
+                    pass
+            process.terminate()
+            process.join()
+        conn.close()
+
+    def _wait_result(self, process, conn):
+        # Wait for the job's reply while watching the deadline and the worker's memory
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if conn.poll(max(0.0, min(JOB_POLL_INTERVAL, remaining))):
+                status, payload, trace = conn.recv()
+                metrics.replay(trace)
+                return status, payload, ERROR_EXCEPTION if status == JOB_FAILED else None, trace
+            if remaining <= 0:
+                return JOB_FAILED, f"Timed out after {self.timeout} seconds", ERROR_TIMEOUT, ()
+            if self._closing.is_set():
+                return JOB_FAILED, "The job queue shut down while the job was running", ERROR_SHUTDOWN, ()
+            rss = process_tree_rss(process.pid) if self.max_rss else None
+            if rss is not None and rss > self.max_rss:
+                return (JOB_FAILED, f"Exceeded the memory limit of {self.max_rss // (1024 * 1024)} MB",
+                        ERROR_MEMORY, ())
+
+    def _run_slot(self, slot):
+        process, conn, tasks = None, None, 0
+        while True:
+            if self.prestart and process is None and not self._closing.is_set():
+                process, conn = self._spawn()
+                tasks = 0
+
+            job = self._take(slot)
+            if job is None:
+                break
+
+            if process is None or not process.is_alive():
+                if process is not None:
+                    self._stop(process, conn, graceful=False)
+                process, conn = self._spawn()
+                tasks = 0
+
+            self._update(job, status=JOB_RUNNING, started=time.time())
+            try:
+                conn.send((job.func, job.args, job.kwargs))
+                status, payload, error_code, trace = self._wait_result(process, conn)
+                if error_code in (ERROR_TIMEOUT, ERROR_MEMORY, ERROR_SHUTDOWN):
+                    self._stop(process, conn, graceful=False)
+                    process = None
+            except (EOFError, OSError) as e:
+                status, payload, error_code, trace = JOB_FAILED, f"Worker exited unexpectedly: {e}", ERROR_CRASHED, ()
+                self._stop(process, conn, graceful=False)
+                process = None
+
+            self._finish(job, status, payload, error_code, trace)
+
+            tasks += 1
+            if process is not None and tasks >= self.max_tasks_per_worker:
+                self._stop(process, conn)
+                process = None
+
+        if process is not None:
+            self._stop(process, conn)
@@ -0,0 +1,287 @@
+import json
+import math
+import os
+import struct
+import threading
+import time
+import numpy as np
+from OCC.Core.BRepTools import breptools
+from OCC.Core.Tesselator import ShapeTesselator
+from cache import CACHE_EVICT_EVERY, CACHE_EVICT_FRACTION, make_cache_key
+from metrics import stage
+from storage import enforce_quota
+from topology import calculate_overall_bounding_box
+
+# Default location and limits for the mesh cache
+MESH_FOLDER = 'meshes'
+MESH_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB
+MESH_MAX_AGE = 30 * 24 * 60 * 60  # 30 days
+
+# Linear deflection of each level of detail, relative to the bounding box
+# diagonal, from the quickest preview to the most precise mesh
+MESH_LODS = {'coarse': 0.01, 'medium': 0.002, 'fine': 0.0005}
+# Requested deflections are rounded to this many significant digits, so
+# near-identical requests share one cache entry
+MESH_DEFLECTION_DIGITS = 2
+
+# glTF constants
+_GLTF_FLOAT = 5126
+_GLTF_UNSIGNED_INT = 5125
+_GLTF_ARRAY_BUFFER = 34962
+_GLTF_ELEMENT_ARRAY_BUFFER = 34963
+_GLTF_TRIANGLES = 4
+
+# BRepMesh already meshes in parallel; one tessellation at a time also keeps
+# threads from cleaning a shared shape while another meshes it
+_tessellate_lock = threading.Lock()
+
+
+def _reset_tessellate_lock():
+    # A worker forked while a request thread was meshing must not inherit the held lock
+    global _tessellate_lock
+    _tessellate_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_tessellate_lock)
+
+
+class MeshCache:
+    """
+    Persistent cache of tessellated shapes as GLB files, keyed by the shape's
+    content hash and the level of detail or deflection. Expiry and eviction
+    work like the ResultCache.
+    """
+
+    def __init__(self, folder=MESH_FOLDER, max_bytes=MESH_MAX_BYTES, max_age=MESH_MAX_AGE,
+                 evict_every=CACHE_EVICT_EVERY):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self._puts = 0
+        self._written = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.folder, f"{key}.glb")
+
+    def get(self, key):
+        """
+        Return the stored GLB bytes for key, or None on a miss or expired entry.
+        """
+        path = self._entry_path(key)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        if self.max_age is not None and time.time() - mtime > self.max_age:
+            self._remove(path)
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                glb = f.read()
+        except OSError as e:
+            print(f"Error reading mesh cache entry {path}: {e}")
+            return None
+
+        # Touch the entry so eviction keeps recently used meshes
+        os.utime(path, None)
+        return glb
+
+    def put(self, key, glb):
+        """
+        Store GLB bytes under key, evicting old entries when enough has been
+        written since the last eviction.
+        """
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(glb)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing mesh cache entry {path}: {e}")
+            self._remove(tmp_path)
+            return
+
+        self._puts += 1
+        self._written += len(glb)
+        if self._puts >= self.evict_every or (self.max_bytes is not None and
+                                               self._written >= self.max_bytes * CACHE_EVICT_FRACTION):
+            self.evict()
+
+    def evict(self):
+        self._puts = self._written = 0
+        enforce_quota(self.folder, self.max_bytes, self.max_age, suffix='.glb')
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def shape_diagonal(shape):
+    box = calculate_overall_bounding_box(shape)
+    return max(math.sqrt(box["Width"] ** 2 + box["Height"] ** 2 + box["Depth"] ** 2), 1e-6)
+
+
+def lod_deflection(shape, lod):
+    """
+    Absolute linear deflection of a level of detail for this shape.
+    """
+    return shape_diagonal(shape) * MESH_LODS[lod]
+
+
+def round_deflection(deflection):
+    return float(f"{deflection:.{MESH_DEFLECTION_DIGITS}g}")
+
+
+def clamp_deflection(shape, deflection):
+    """
+    Round a requested absolute deflection and keep it between the finest
+    and the coarsest level of detail of this shape, so a request can
+    neither force a runaway tessellation nor add cache entries without end.
+    """
+    diagonal = shape_diagonal(shape)
+    return min(max(round_deflection(deflection), diagonal * min(MESH_LODS.values())),
+               diagonal * max(MESH_LODS.values()))
+
+
+def tessellate(shape, deflection):
+    """
+    Mesh a shape with ShapeTesselator, which runs BRepMesh in parallel mode
+    and gathers every face's triangles in C++, and weld the per-triangle
+    vertices it returns into one vertex buffer and one index buffer.
+    Vertices are only welded where their normals agree too, so faces meeting
+    at an edge keep their own vertices as before.
+    Returns (positions, indices) as (n, 3) float32 and (m, 3) uint32 arrays.
+    """
+    tesselator = ShapeTesselator(shape)
+    tesselator.SetDeviation(deflection)
+    # mesh_quality scales the deviation and the angular deflection of 0.5 radians
+    tesselator.Compute(compute_edges=False, mesh_quality=1.0, parallel=True)
+
+    corners = np.asarray(tesselator.GetVerticesPositionAsTuple(), dtype=np.float32).reshape(-1, 3)
+    if not len(corners):
+        return np.empty((0, 3), dtype=np.float32), np.empty((0, 3), dtype=np.uint32)
+    normals = np.asarray(tesselator.GetNormalsAsTuple(), dtype=np.float32).reshape(-1, 3)
+    vertices, indices = np.unique(np.hstack((corners, normals)), axis=0, return_inverse=True)
+    return np.ascontiguousarray(vertices[:, :3]), indices.astype(np.uint32).reshape(-1, 3)
+
+
+def mesh_stats(positions, indices):
+    """
+    Triangle count, surface area and enclosed volume of a mesh.
+    """
+    corners = positions.astype(np.float64)[indices]
+    a, b, c = corners[:, 0], corners[:, 1], corners[:, 2]
+    cross = np.cross(b - a, c - a)
+    return {
+        "vertex_count": len(positions),
+        "triangle_count": len(indices),
+        "area": float(0.5 * np.linalg.norm(cross, axis=1).sum()),
+        "volume": float(abs(np.einsum('ij,ij->i', a, np.cross(b, c)).sum()) / 6)
+    }
+
+
+def to_glb(positions, indices, extras=None):
+    """
+    Encode a triangle mesh as a binary glTF 2.0 (GLB) file with one mesh.
+    """
+    position_bytes = positions.astype('<f4').tobytes()
+    index_bytes = indices.astype('<u4').tobytes()
+    bounds = (positions.min(axis=0).tolist(), positions.max(axis=0).tolist()) if len(positions) else ([0] * 3, [0] * 3)
+    gltf = {
+        "asset": {"version": "2.0", "generator": "pythonstpparser"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0}, "indices": 1, "mode": _GLTF_TRIANGLES}],
+                    "extras": extras or {}}],
+        "buffers": [{"byteLength": len(position_bytes) + len(index_bytes)}],
+        "bufferViews": [
+            {"buffer": 0, "byteOffset": 0, "byteLength": len(position_bytes), "target": _GLTF_ARRAY_BUFFER},
+            {"buffer": 0, "byteOffset": len(position_bytes), "byteLength": len(index_bytes),
+             "target": _GLTF_ELEMENT_ARRAY_BUFFER}
+        ],
+        "accessors": [
+            {"bufferView": 0, "componentType": _GLTF_FLOAT, "count": len(positions), "type": "VEC3",
+             "min": bounds[0], "max": bounds[1]},
+            {"bufferView": 1, "componentType": _GLTF_UNSIGNED_INT, "count": int(indices.size), "type": "SCALAR"}
+        ]
+    }
+
+    # Chunks are padded to 4 bytes: JSON with spaces, binary data with zeros
+    json_chunk = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    json_chunk += b' ' * (-len(json_chunk) % 4)
+    bin_chunk = position_bytes + index_bytes
+    bin_chunk += b'\0' * (-len(bin_chunk) % 4)
+    length = 12 + 8 + len(json_chunk) + 8 + len(bin_chunk)
+    return b''.join((
+        struct.pack('<4sII', b'glTF', 2, length),
+        struct.pack('<I4s', len(json_chunk), b'JSON'), json_chunk,
+        struct.pack('<I4s', len(bin_chunk), b'BIN\0'), bin_chunk
+    ))
+
+
+def mesh_cache_key(content_hash, lod='coarse', deflection=None):
+    return make_cache_key(content_hash, {'lod': lod} if deflection is None
+                          else {'deflection': round_deflection(deflection)})
+
+
+def cached_mesh(content_hash, cache, lod='coarse', deflection=None):
+    """
+    Return the cached GLB of a shape at a level of detail or deflection, or
+    None when it was not meshed yet. Needs no OCC.
+    """
+    with stage('mesh', 'cache_lookup') as timer:
+        glb = cache.get(mesh_cache_key(content_hash, lod, deflection))
+        timer.add('cache_hits' if glb is not None else 'cache_misses', 1)
+    return glb
+
+
+def build_mesh(content_hash, shape, cache, lod='coarse', deflection=None):
+    """
+    Tessellate a shape at a level of detail, or at an absolute linear
+    deflection when one is given, and cache the GLB. A deflection is first
+    clamped with clamp_deflection. Returns the GLB.
+    """
+    if deflection is None:
+        key = mesh_cache_key(content_hash, lod)
+        deflection = lod_deflection(shape, lod)
+    else:
+        deflection = clamp_deflection(shape, deflection)
+        # A clamped request may match a mesh made before
+        glb = cached_mesh(content_hash, cache, lod, deflection)
+        if glb is not None:
+            return glb
+        key = mesh_cache_key(content_hash, lod, deflection)
+    with _tessellate_lock, stage('mesh', 'tessellate') as timer:
+        # Shapes are cached between requests and BRepMesh keeps any finer
+        # triangulation it finds, so drop it before meshing at this deflection
+        breptools.Clean(shape)
+        positions, indices = tessellate(shape, deflection)
+        timer.add('triangles', len(indices))
+
+    with stage('mesh', 'encode'):
+        extras = dict(mesh_stats(positions, indices), lod=lod, deflection=deflection)
+        glb = to_glb(positions, indices, extras)
+    cache.put(key, glb)
+    return glb
+
+
+def load_mesh(content_hash, get_shape, cache, lod='coarse', deflection=None):
+    """
+    Return the GLB of a shape at a level of detail, or at an absolute linear
+    deflection when one is given. Cached meshes are served without loading
+    the shape; get_shape is only called to tessellate a missing one.
+    """
+    glb = cached_mesh(content_hash, cache, lod, deflection)
+    if glb is not None:
+        return glb
+    return build_mesh(content_hash, get_shape(), cache, lod, deflection)
@@ -0,0 +1,212 @@
+import functools
+import os
+import threading
+import time
+
+# Instrumentation is on unless STEP_METRICS=0; when off, stage() is a no-op
+METRICS_ENABLED = os.environ.get('STEP_METRICS', '1') != '0'
+
+# Histogram buckets for stage durations, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, float('inf'))
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss():
+    """
+    Return the resident set size of this process in bytes, or 0 when it
+    cannot be determined on this platform.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class Registry:
+    """
+    In-process store of stage metrics, rendered in the Prometheus text
+    exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = {}  # (pipeline, stage) -> [bucket counts..., sum, count]
+        self._rss = {}  # (pipeline, stage) -> [sum of deltas, count]
+        self._errors = {}  # (pipeline, stage) -> count
+        self._counts = {}  # (pipeline, kind) -> total
+
+    def _after_fork(self):
+        # The forking thread may have left the lock held by a thread the child does not have
+        self._lock = threading.Lock()
+
+    def observe(self, pipeline, stage, seconds, rss_delta=0, error=False, counts=None):
+        key = (pipeline, stage)
+        with self._lock:
+            durations = self._durations.setdefault(key, [0] * len(DURATION_BUCKETS) + [0.0, 0])
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    durations[index] += 1
+            durations[-2] += seconds
+            durations[-1] += 1
+
+            rss = self._rss.setdefault(key, [0, 0])
+            rss[0] += rss_delta
+            rss[1] += 1
+
+            if error:
+                self._errors[key] = self._errors.get(key, 0) + 1
+            for kind, value in (counts or {}).items():
+                self._counts[(pipeline, kind)] = self._counts.get((pipeline, kind), 0) + value
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append('# HELP step_stage_duration_seconds Time spent in each processing stage.')
+            lines.append('# TYPE step_stage_duration_seconds histogram')
+            for (pipeline, stage), values in sorted(self._durations.items()):
+                labels = f'pipeline="{pipeline}",stage="{stage}"'
+                for bound, count in zip(DURATION_BUCKETS, values):
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'step_stage_duration_seconds_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(f'step_stage_duration_seconds_sum{{{labels}}} {values[-2]}')
+                lines.append(f'step_stage_duration_seconds_count{{{labels}}} {values[-1]}')
+
+            lines.append('# HELP step_stage_rss_delta_bytes Change in resident memory across each stage.')
+            lines.append('# TYPE step_stage_rss_delta_bytes summary')
+            for (pipeline, stage), (total, count) in sorted(self._rss.items()):
+                labels = f'pipeline="{pipeline}",stage="{stage}"'
+                lines.append(f'step_stage_rss_delta_bytes_sum{{{labels}}} {total}')
+                lines.append(f'step_stage_rss_delta_bytes_count{{{labels}}} {count}')
+
+            lines.append('# HELP step_stage_errors_total Stages that ended with an exception.')
+            lines.append('# TYPE step_stage_errors_total counter')
+            for (pipeline, stage), count in sorted(self._errors.items()):
+                lines.append(f'step_stage_errors_total{{pipeline="{pipeline}",stage="{stage}"}} {count}')
+
+            lines.append('# HELP step_items_total Entities, solids and faces processed.')
+            lines.append('# TYPE step_items_total counter')
+            for (pipeline, kind), total in sorted(self._counts.items()):
+                lines.append(f'step_items_total{{pipeline="{pipeline}",kind="{kind}"}} {total}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Job workers fork from a process whose request threads observe concurrently
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry._after_fork)
+
+# Stages finished on this thread since trace_start(), for Server-Timing and
+# for handing job worker measurements back to the parent process
+_local = threading.local()
+
+
+class Stage:
+    def __init__(self, pipeline, name):
+        self.pipeline = pipeline
+        self.name = name
+        self.counts = {}
+
+    def add(self, kind, value):
+        """
+        Record how many items of a kind (solids, faces, ...) this stage handled.
+        """
+        self.counts[kind] = self.counts.get(kind, 0) + value
+
+    def __enter__(self):
+        self._rss = current_rss()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        record = (self.pipeline, self.name, seconds, current_rss() - self._rss, exc_type is not None, self.counts)
+        registry.observe(*record)
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.append(record)
+        return False
+
+
+class _NullStage:
+    def add(self, kind, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(pipeline, name):
+    """
+    Context manager timing one processing stage:
+
+        with stage('solids', 'transfer') as s:
+            ...
+            s.add('solids', count)
+    """
+    if not METRICS_ENABLED:
+        return _NULL_STAGE
+    return Stage(pipeline, name)
+
+
+def instrumented(pipeline, name=None):
+    """
+    Decorator form of stage(); the stage name defaults to the function name.
+    """
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Stage(pipeline, name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_start():
+    _local.trace = []
+
+
+def trace_stop():
+    """
+    Return the stages recorded since trace_start() and stop collecting.
+    """
+    trace = getattr(_local, 'trace', None) or []
+    _local.trace = None
+    return trace
+
+
+def replay(trace):
+    """
+    Add stages measured in another process (a job worker) to this registry.
+    """
+    for record in trace:
+        registry.observe(*record)
+
+
+def extend_trace(trace):
+    """
+    Add stages measured in another process to this thread's trace, so they
+    reach Server-Timing; replay() counts them in the registry.
+    """
+    current = getattr(_local, 'trace', None)
+    if current is not None:
+        current.extend(tuple(record) for record in trace)
+
+
+def server_timing(trace):
+    """
+    Format recorded stages as a Server-Timing header value.
+    """
+    return ', '.join(f'{pipeline}-{name};dur={seconds * 1000:.1f}'
+                     for pipeline, name, seconds, _, _, _ in trace)
@@ -1,65 +1,263 @@
-from OCC.Core.STEPControl import STEPControl_Reader
-from OCC.Core.TDocStd import TDocStd_Application, TDocStd_Document
+from OCC.Core import XCAFDimTolObjects
+from OCC.Core.STEPCAFControl import STEPCAFControl_Reader
+from OCC.Core.TDocStd import TDocStd_Document
 from OCC.Core.XCAFApp import XCAFApp_Application
-from OCC.Core.XCAFDoc import XCAFDoc_DocumentTool
+from OCC.Core.XCAFDoc import XCAFDoc_DocumentTool, XCAFDoc_Dimension, XCAFDoc_GeomTolerance, XCAFDoc_Datum
 from OCC.Core.TCollection import TCollection_ExtendedString
 from OCC.Core.TDF import TDF_LabelSequence
-from OCC.Core.TDataStd import TDataStd_Name
+from OCC.Core.BRep import BRep_Builder
+from OCC.Core.TopoDS import TopoDS_Compound
+from formats import write_json
+from metrics import stage
+from readers import step_source
 
-def load_step_with_pmi(file_path):
-    # Initialize the XCAF application
-    app = XCAFApp_Application.GetApplication()
+# Kinds of PMI item collected from the XCAF dimension/tolerance tool
+PMI_KINDS = ('dimension', 'tolerance', 'datum')
+
+_enum_names = {}
+
+
+def enum_name(prefix, value):
+    """
+    Name of an XCAFDimTolObjects enum value without its prefix, e.g.
+    enum_name('XCAFDimTolObjects_GeomToleranceType_', 3) -> 'Flatness'.
+    """
+    names = _enum_names.get(prefix)
+    if names is None:
+        names = _enum_names[prefix] = {int(getattr(XCAFDimTolObjects, name)): name[len(prefix):]
+                                       for name in dir(XCAFDimTolObjects) if name.startswith(prefix)}
+    return names.get(int(value), str(int(value)))
+
+
+def label_entry(label):
+    # The entry of a label, e.g. "0:1:4:2", from the tags up to the root
+    tags = []
+    while not label.IsNull():
+        tags.append(str(label.Tag()))
+        label = label.Father()
+    return ':'.join(reversed(tags))
+
+
+def hstring_text(hstring):
+    # Optional TCollection_HAsciiString to str
+    try:
+        return hstring.ToCString() if hstring is not None and not hstring.IsEmpty() else None
+    except AttributeError:
+        return None
+
+
+class PMIIndex:
+    """
+    PMI items of one document with lookups by kind, by type and by the label
+    of the shapes they annotate, built once so queries never re-walk the
+    XCAF document. Serialises to a plain dict for the result cache.
+    """
 
-    # Create a new document handle for XCAF
-    doc_type = TCollection_ExtendedString("XCAF")  # Specify the document type
-    doc_handle = TDocStd_Document(doc_type)  # Create the document handle with type argument
+    def __init__(self, items):
+        self.items = items
+        self.by_kind = {}
+        self.by_type = {}
+        self.by_shape = {}
+        for position, item in enumerate(items):
+            self.by_kind.setdefault(item["kind"], []).append(position)
+            self.by_type.setdefault(item["type"], []).append(position)
+            for shape in item["shapes"]:
+                self.by_shape.setdefault(shape, []).append(position)
+
+    def __len__(self):
+        return len(self.items)
+
+    def query(self, kind=None, type_name=None, shape=None):
+        """
+        Return the items matching every given filter, in document order.
+        """
+        selected = None
+        for index, key in ((self.by_kind, kind), (self.by_type, type_name), (self.by_shape, shape)):
+            if key is None:
+                continue
+            positions = set(index.get(key, ()))
+            selected = positions if selected is None else selected & positions
+        if selected is None:
+            return list(self.items)
+        return [self.items[position] for position in sorted(selected)]
+
+    def summary(self):
+        return {
+            "count": len(self.items),
+            "kinds": {kind: len(positions) for kind, positions in self.by_kind.items()},
+            "types": {name: len(positions) for name, positions in self.by_type.items()}
+        }
+
+    def to_dict(self):
+        return {"items": self.items}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["items"])
+
+
+def read_step_document(file_path):
+    """
+    Read a STEP file with the XCAF-aware reader and transfer its shapes,
+    names and GD&T into a new XCAF document, which is returned.
+    """
+    # Initialize the XCAF application and an XCAF document for the reader
+    app = XCAFApp_Application.GetApplication()
+    doc_handle = TDocStd_Document(TCollection_ExtendedString("XCAF"))
     if doc_handle.IsNull():
         raise Exception("Failed to create a new XCAF document.")
+    app.InitDocument(doc_handle)
 
     # Load the STEP file
-    step_reader = STEPControl_Reader()
-    status = step_reader.ReadFile(file_path)
+    with stage("pmi", "read"):
+        step_reader = STEPCAFControl_Reader()
+        step_reader.SetNameMode(True)
+        step_reader.SetGDTMode(True)
+        with step_source(file_path) as source:
+            status = step_reader.ReadFile(source)
+
+        if status != 1:
+            raise Exception(f"Error reading STEP file: {file_path}")
+
+    # Transfer contents, shapes and GD&T, to the XCAF document
+    with stage("pmi", "transfer"):
+        if not step_reader.Transfer(doc_handle):
+            raise Exception(f"Error transferring STEP file: {file_path}")
+    return doc_handle
 
-    if status != 1:
-        raise Exception(f"Error reading STEP file: {file_path}")
 
-    # Transfer contents to XCAF document
-    step_reader.Transfer(doc_handle)
+def document_pmi(doc_handle):
+    """
+    Return the PMIIndex of the dimensions, geometric tolerances and datums
+    of an XCAF document.
+    """
+    with stage("pmi", "extract") as timer:
+        index = extract_pmi_annotations(doc_handle)
+        timer.add("annotations", len(index))
+    return index
+
+
+def document_shape(doc_handle):
+    """
+    Return the shape of an XCAF document: its free shape, or a compound of
+    them when there are several, as a plain STEP transfer would give.
+    """
+    shape_tool = XCAFDoc_DocumentTool.ShapeTool(doc_handle.Main())
+    labels = TDF_LabelSequence()
+    shape_tool.GetFreeShapes(labels)
+    shapes = [shape_tool.GetShape(labels.Value(i)) for i in range(1, labels.Length() + 1)]
+    if len(shapes) == 1:
+        return shapes[0]
+    compound = TopoDS_Compound()
+    builder = BRep_Builder()
+    builder.MakeCompound(compound)
+    for shape in shapes:
+        builder.Add(compound, shape)
+    return compound
+
+
+def load_step_with_pmi(file_path):
+    """
+    Read a STEP file with the XCAF-aware reader, GD&T included, and return
+    the PMIIndex of its dimensions, geometric tolerances and datums.
+    """
+    return document_pmi(read_step_document(file_path))
 
-    # Extract PMI annotations
-    return extract_pmi_annotations(doc_handle)
 
 def extract_pmi_annotations(doc_handle):
-    label_tool = XCAFDoc_DocumentTool.LabelShapeTool(doc_handle.Main())
-    annotations = []
+    """
+    Walk the XCAFDoc_DimTolTool of a document once and index every
+    dimension, geometric tolerance and datum it holds.
+    """
+    dimtol_tool = XCAFDoc_DocumentTool.DimTolTool(doc_handle.Main())
+    items = []
+
+    def add_item(kind, label, obj_type, fields):
+        first, second = TDF_LabelSequence(), TDF_LabelSequence()
+        dimtol_tool.GetRefShapeLabel(label, first, second)
+        shapes = [label_entry(sequence.Value(i + 1))
+                  for sequence in (first, second) for i in range(sequence.Length())]
+        items.append(dict({"id": len(items) + 1, "kind": kind, "label": label_entry(label),
+                           "type": obj_type, "shapes": shapes}, **fields))
 
     labels = TDF_LabelSequence()
-    label_tool.GetFreeShapes(labels)
+    dimtol_tool.GetDatumLabels(labels)
+    datum_names = {}
+    for i in range(labels.Length()):
+        label = labels.Value(i + 1)
+        attribute = XCAFDoc_Datum()
+        if not label.FindAttribute(XCAFDoc_Datum.GetID(), attribute):
+            continue
+        datum = attribute.GetObject()
+        datum_names[label_entry(label)] = name = hstring_text(datum.GetName())
+        add_item("datum", label, "Datum", {"name": name})
 
-    print(f"Total labels found: {labels.Length()}")  # Debug: Print number of labels
+    labels = TDF_LabelSequence()
+    dimtol_tool.GetDimensionLabels(labels)
+    for i in range(labels.Length()):
+        label = labels.Value(i + 1)
+        attribute = XCAFDoc_Dimension()
+        if not label.FindAttribute(XCAFDoc_Dimension.GetID(), attribute):
+            continue
+        dimension = attribute.GetObject()
+        fields = {
+            "name": hstring_text(dimension.GetSemanticName()),
+            "value": dimension.GetValue(),
+            "lower_tolerance": None,
+            "upper_tolerance": None
+        }
+        if dimension.IsDimWithPlusMinusTolerance():
+            fields["lower_tolerance"] = dimension.GetLowerTolValue()
+            fields["upper_tolerance"] = dimension.GetUpperTolValue()
+        add_item("dimension", label, enum_name("XCAFDimTolObjects_DimensionType_", dimension.GetType()), fields)
 
+    labels = TDF_LabelSequence()
+    dimtol_tool.GetGeomToleranceLabels(labels)
     for i in range(labels.Length()):
         label = labels.Value(i + 1)
-        name = TDataStd_Name().Get(label)
-        if name:
-            annotations.append(name)
+        attribute = XCAFDoc_GeomTolerance()
+        if not label.FindAttribute(XCAFDoc_GeomTolerance.GetID(), attribute):
+            continue
+        tolerance = attribute.GetObject()
+        datums = TDF_LabelSequence()
+        dimtol_tool.GetDatumOfTolerLabels(label, datums)
+        datum_entries = [label_entry(datums.Value(j + 1)) for j in range(datums.Length())]
+        fields = {
+            "name": hstring_text(tolerance.GetSemanticName()),
+            "value": tolerance.GetValue(),
+            "material_modifier": enum_name("XCAFDimTolObjects_GeomToleranceMatReqModif_",
+                                           tolerance.GetMaterialRequirementModifier()),
+            "datums": [datum_names.get(entry) or entry for entry in datum_entries]
+        }
+        add_item("tolerance", label, enum_name("XCAFDimTolObjects_GeomToleranceType_", tolerance.GetType()), fields)
+
+    return PMIIndex(items)
+
+
+def save_pmi_report(pmi_index, output_file, fmt='txt'):
+    # Output PMI annotations to a text file, or to JSON for any other format
+    if fmt != 'txt':
+        write_json(output_file, dict(pmi_index.to_dict(), summary=pmi_index.summary()))
+        return
+
+    with open(output_file, 'w') as file:
+        if not len(pmi_index):
+            file.write("No PMI annotations found.\n")
+            return
+        file.write("PMI Annotations:\n")
+        for kind in PMI_KINDS:
+            for item in pmi_index.query(kind=kind):
+                details = ", ".join(f"{key}: {value}" for key, value in item.items()
+                                    if key not in ("id", "kind", "type") and value not in (None, []))
+                file.write(f"- {kind} {item['id']} ({item['type']}): {details}\n")
 
-    print(f"PMI annotations extracted: {annotations}")  # Debug: Print extracted annotations
-    return annotations
 
 def main():
     input_file = "stepfile.stp"  # Replace with your STEP file path
     pmi_annotations = load_step_with_pmi(input_file)
 
-    # Output PMI annotations to a text file
     output_file = "pmi_annotations.txt"
-    with open(output_file, 'w') as file:
-        if pmi_annotations:
-            file.write("PMI Annotations:\n")
-            for annotation in pmi_annotations:
-                file.write(f"- {annotation}\n")
-        else:
-            file.write("No PMI annotations found.\n")
+    save_pmi_report(pmi_annotations, output_file)
 
     print(f"PMI annotations have been saved to {output_file}.")
 
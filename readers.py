@@ -0,0 +1,189 @@
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from OCC.Core.BinTools import binTools
+from OCC.Core.BRep import BRep_Builder
+from OCC.Core.BRepTools import breptools
+from OCC.Core.IGESControl import IGESControl_Reader
+from OCC.Core.STEPControl import STEPControl_Reader
+from OCC.Core.TopoDS import TopoDS_Shape
+from metrics import stage
+from stepscan import SCAN_CHUNK_SIZE, GZIP_MAGIC, is_step_head
+from storage import remove_file
+
+# Bytes read from the start of a file to recognise its format
+SNIFF_BYTES = 256
+
+# Decompress gzip STEP into a named pipe for OCC, or into a temporary copy
+# where named pipes are unavailable or this is disabled
+GZIP_PIPE = hasattr(os, 'mkfifo') and os.environ.get('STEP_GZIP_PIPE', '1') != '0'
+
+# Input formats by name, in sniffing order: upload extensions, a test on the
+# first SNIFF_BYTES of the file and a reader returning the file's shape.
+# Formats in STEP_FORMATS also support the STEP-only analyses.
+INPUT_FORMATS = {}
+STEP_FORMATS = ('step', 'step_gzip')
+
+
+def register_format(name, extensions, sniff, read):
+    """
+    Add an input format. sniff(head) gets the first SNIFF_BYTES of the file,
+    decompressed for gzip files; read(file_path, pipeline) returns its shape.
+    """
+    INPUT_FORMATS[name] = {'extensions': extensions, 'sniff': sniff, 'read': read}
+
+
+def input_extensions():
+    return tuple(extension for spec in INPUT_FORMATS.values() for extension in spec['extensions'])
+
+
+def strip_input_extension(filename):
+    # Drop a known input extension, including double ones like .stp.gz
+    for extension in sorted(input_extensions(), key=len, reverse=True):
+        if filename.lower().endswith(extension):
+            return filename[:-len(extension)]
+    return os.path.splitext(filename)[0]
+
+
+def sniff_format(file_path):
+    """
+    Name of the input format of a file judged by its content, not its
+    extension, or None when no registered format matches.
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    compressed = head.startswith(GZIP_MAGIC)
+    if compressed:
+        try:
+            with gzip.open(file_path, 'rb') as f:
+                head = f.read(SNIFF_BYTES)
+        except (OSError, EOFError):
+            return None
+    for name, spec in INPUT_FORMATS.items():
+        if (name == 'step_gzip') == compressed and spec['sniff'](head):
+            return name
+    return None
+
+
+def read_shape(file_path, pipeline, input_format=None):
+    """
+    Read the shape of a file of any INPUT_FORMATS, sniffing the format when
+    it is not given. Stages are recorded under the given metrics pipeline.
+    """
+    input_format = input_format or sniff_format(file_path)
+    if input_format is None:
+        raise Exception(f"Unsupported input format: {file_path}")
+    return INPUT_FORMATS[input_format]['read'](file_path, pipeline)
+
+
+def _feed_pipe(file_path, fifo):
+    # Runs in a thread: stream the decompressed file into the pipe until the reader is done
+    try:
+        with gzip.open(file_path, 'rb') as source, open(fifo, 'wb') as pipe:
+            shutil.copyfileobj(source, pipe, SCAN_CHUNK_SIZE)
+    except (OSError, EOFError) as e:
+        # BrokenPipeError only means the reader stopped early
+        if not isinstance(e, BrokenPipeError):
+            print(f"Error decompressing {file_path}: {e}")
+
+
+@contextmanager
+def step_source(file_path):
+    """
+    Yield a path OCC's STEP readers can open for a STEP file. Plain files
+    are read in place. Gzip-compressed ones are decompressed while OCC reads
+    them from a named pipe, so no decompressed copy is written to disk.
+    """
+    with open(file_path, 'rb') as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    if not compressed:
+        yield file_path
+        return
+
+    folder = tempfile.mkdtemp(prefix='step-')
+    path = os.path.join(folder, 'input.stp')
+    feeder = None
+    try:
+        if GZIP_PIPE:
+            os.mkfifo(path)
+            feeder = threading.Thread(target=_feed_pipe, args=(file_path, path), daemon=True)
+            feeder.start()
+        else:
+            with gzip.open(file_path, 'rb') as source, open(path, 'wb') as target:
+                shutil.copyfileobj(source, target, SCAN_CHUNK_SIZE)
+        yield path
+    finally:
+        while feeder is not None and feeder.is_alive():
+            # The reader never opened the pipe or stopped early; hold the read
+            # end open until the feeder has opened its end, then close it so
+            # the feeder's writes fail and it exits
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            except OSError:
+                break
+            feeder.join(0.05)
+            os.close(fd)
+            feeder.join(0.05)
+        remove_file(path)
+        os.rmdir(folder)
+
+
+def read_step_shape(file_path, pipeline):
+    with stage(pipeline, 'read') as timer:
+        step_reader = STEPControl_Reader()
+        with step_source(file_path) as source:
+            status = step_reader.ReadFile(source)
+        if status != 1:
+            raise Exception(f"Error reading STEP file: {file_path}")
+        timer.add('entities', step_reader.Model().NbEntities())
+
+    with stage(pipeline, 'transfer'):
+        step_reader.TransferRoots()
+        return step_reader.Shape()
+
+
+def read_iges_shape(file_path, pipeline):
+    with stage(pipeline, 'read') as timer:
+        iges_reader = IGESControl_Reader()
+        status = iges_reader.ReadFile(file_path)
+        if status != 1:
+            raise Exception(f"Error reading IGES file: {file_path}")
+        timer.add('entities', iges_reader.NbRootsForTransfer())
+
+    with stage(pipeline, 'transfer'):
+        iges_reader.TransferRoots()
+        return iges_reader.OneShape()
+
+
+def read_brep_shape(file_path, pipeline):
+    # BRep files hold a shape already, so reading is the whole transfer
+    with stage(pipeline, 'read'):
+        shape = TopoDS_Shape()
+        if not breptools.Read(shape, file_path, BRep_Builder()):
+            raise Exception(f"Error reading BRep file: {file_path}")
+        return shape
+
+
+def read_binary_brep_shape(file_path, pipeline):
+    with stage(pipeline, 'read'):
+        shape = TopoDS_Shape()
+        if not binTools.Read(shape, file_path) or shape.IsNull():
+            raise Exception(f"Error reading binary BRep file: {file_path}")
+        return shape
+
+
+def _is_iges_head(head):
+    # IGES files are 80-column records; the first is a Start record, flagged 'S' in column 73
+    line = head.split(b'\n', 1)[0].rstrip(b'\r')
+    return len(line) >= 73 and line[72:73] == b'S'
+
+
+register_format('step', ('.stp', '.step'), is_step_head, read_step_shape)
+register_format('step_gzip', ('.stpz', '.stp.gz', '.step.gz'), is_step_head, read_step_shape)
+register_format('iges', ('.igs', '.iges'), _is_iges_head, read_iges_shape)
+register_format('brep_binary', ('.bbrep',), lambda head: head.startswith(b'Open CASCADE Topology'),
+                read_binary_brep_shape)
+register_format('brep', ('.brep', '.brp'), lambda head: b'CASCADE Topology' in head, read_brep_shape)
@@ -0,0 +1,209 @@
+from array import array
+import numpy as np
+
+BOX_COLUMNS = ("X_min", "Y_min", "Z_min", "X_max", "Y_max", "Z_max")
+DIM_COLUMNS = ("Width", "Height", "Depth")
+
+# An oriented box is stored as 15 floats: center, X/Y/Z axes, half sizes
+ORIENTED_WIDTH = 15
+ORIENTED_COLUMNS = (tuple(f"OBB_Center_{axis}" for axis in "XYZ")
+                    + tuple(f"OBB_Axis{index}_{axis}" for index in (1, 2, 3) for axis in "XYZ")
+                    + tuple(f"OBB_HalfSize{index}" for index in (1, 2, 3)))
+
+
+def extents_to_dict(x_min, y_min, z_min, x_max, y_max, z_max):
+    return {
+        "BoundingBox": {
+            "X_min": x_min, "Y_min": y_min, "Z_min": z_min,
+            "X_max": x_max, "Y_max": y_max, "Z_max": z_max
+        },
+        "Width": x_max - x_min,
+        "Height": y_max - y_min,
+        "Depth": z_max - z_min
+    }
+
+
+def flatten_oriented(oriented):
+    return [*oriented["Center"], *(value for axis in oriented["Axes"] for value in axis), *oriented["HalfSizes"]]
+
+
+def unflatten_oriented(values):
+    return {"Center": values[0:3], "Axes": [values[3:6], values[6:9], values[9:12]], "HalfSizes": values[12:15]}
+
+
+class SolidTable:
+    """
+    Struct-of-arrays table of solid boxes: an (n, 6) float64 array with
+    columns X_min, Y_min, Z_min, X_max, Y_max, Z_max and, for 'oriented'
+    walks, an (n, 15) array of OBB centers, axes and half sizes. Width,
+    Height and Depth are derived from the boxes in one vectorised step.
+    """
+    __slots__ = ("boxes", "oriented")
+
+    def __init__(self, boxes=None, oriented=None):
+        self.boxes = np.asarray(boxes if boxes is not None else (), dtype=np.float64).reshape(-1, 6)
+        self.oriented = None if oriented is None else np.asarray(oriented, dtype=np.float64).reshape(-1, ORIENTED_WIDTH)
+
+    @classmethod
+    def from_dicts(cls, solids):
+        """
+        Build a table from per-solid dicts as found in JSON reports.
+        """
+        boxes = [[solid["BoundingBox"][column] for column in BOX_COLUMNS] for solid in solids]
+        oriented = None
+        if any("OrientedBox" in solid for solid in solids):
+            oriented = [flatten_oriented(solid["OrientedBox"]) if "OrientedBox" in solid else [np.nan] * ORIENTED_WIDTH
+                        for solid in solids]
+        return cls(boxes, oriented)
+
+    @classmethod
+    def concat(cls, tables):
+        """
+        Concatenate tables in order; solids of tables without oriented boxes
+        get NaN ones when any other table has them.
+        """
+        tables = list(tables)
+        if not tables:
+            return cls()
+        boxes = np.concatenate([table.boxes for table in tables])
+        oriented = None
+        if any(table.oriented is not None for table in tables):
+            oriented = np.concatenate([table.oriented if table.oriented is not None
+                                       else np.full((len(table), ORIENTED_WIDTH), np.nan) for table in tables])
+        return cls(boxes, oriented)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @property
+    def dims(self):
+        return self.boxes[:, 3:] - self.boxes[:, :3]
+
+    def columns(self, source=None, bbox_mode=None):
+        """
+        Column dict (name -> NumPy array) of the table, with the bounding box
+        mode as a column when given and the ORIENTED_COLUMNS when the table
+        has oriented boxes. The box columns are views of the box array, not
+        copies.
+        """
+        columns = {}
+        if source is not None:
+            columns["source"] = np.full(len(self), source, dtype=object)
+        if bbox_mode is not None:
+            columns["bbox_mode"] = np.full(len(self), bbox_mode, dtype=object)
+        columns["solid"] = np.arange(1, len(self) + 1, dtype=np.int64)
+        for index, name in enumerate(BOX_COLUMNS):
+            columns[name] = self.boxes[:, index]
+        dims = self.dims
+        for index, name in enumerate(DIM_COLUMNS):
+            columns[name] = dims[:, index]
+        if self.oriented is not None:
+            for index, name in enumerate(ORIENTED_COLUMNS):
+                columns[name] = self.oriented[:, index]
+        return columns
+
+    def to_numpy(self):
+        return self.boxes
+
+    def to_pandas(self, source=None, bbox_mode=None):
+        # pandas is optional; it is only needed for this export
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError("DataFrame export requires the pandas package")
+        return pd.DataFrame(self.columns(source, bbox_mode), copy=False)
+
+    def records(self):
+        """
+        Yield (box, dims, oriented) per solid as plain Python values, with box
+        in BOX_COLUMNS order and oriented as a dict or None.
+        """
+        oriented = self.oriented.tolist() if self.oriented is not None else [None] * len(self)
+        for box, dims, obb in zip(self.boxes.tolist(), self.dims.tolist(), oriented):
+            yield box, dims, unflatten_oriented(obb) if obb is not None and obb[0] == obb[0] else None
+
+    def to_dicts(self):
+        """
+        Per-solid dicts in the layout of the JSON reports.
+        """
+        solids = []
+        for box, dims, oriented in self.records():
+            solid = {"BoundingBox": dict(zip(BOX_COLUMNS, box)), **dict(zip(DIM_COLUMNS, dims))}
+            if oriented:
+                solid["OrientedBox"] = oriented
+            solids.append(solid)
+        return solids
+
+
+class SolidTableBuilder:
+    """
+    Collects solid boxes one at a time into compact arrays; table() wraps
+    them as a SolidTable without copying.
+    """
+    __slots__ = ("_boxes", "_oriented")
+
+    def __init__(self):
+        self._boxes = array('d')
+        self._oriented = array('d')
+
+    def add(self, extents, oriented=None):
+        self._boxes.extend(extents)
+        if oriented is not None:
+            self._oriented.extend(flatten_oriented(oriented))
+
+    def table(self):
+        oriented = np.frombuffer(self._oriented, dtype=np.float64) if self._oriented else None
+        return SolidTable(np.frombuffer(self._boxes, dtype=np.float64), oriented)
+
+
+class SolidsResult:
+    """
+    Result of one solids analysis: the bounding box mode, solid count,
+    overall box extents and the SolidTable, plus the face count and any
+    values a face visitor returned. roots holds the component manifest of an
+    incremental analysis and is not part of to_dict().
+    """
+    __slots__ = ("bbox_mode", "solid_count", "overall", "solids", "face_count", "surfaces", "roots")
+
+    def __init__(self, bbox_mode='fast', solid_count=0, overall=None, solids=None, face_count=0, surfaces=None,
+                 roots=None):
+        self.bbox_mode = bbox_mode
+        self.solid_count = solid_count
+        self.overall = tuple(overall) if overall is not None else None
+        self.solids = solids if solids is not None else SolidTable()
+        self.face_count = face_count
+        self.surfaces = surfaces if surfaces is not None else []
+        self.roots = roots
+
+    @property
+    def overall_bbox(self):
+        # The overall box in the dict layout of the reports
+        return extents_to_dict(*self.overall) if self.overall is not None else None
+
+    def to_dict(self):
+        """
+        Compact, JSON-serialisable form for the result cache.
+        """
+        return {
+            "bbox_mode": self.bbox_mode,
+            "solid_count": self.solid_count,
+            "face_count": self.face_count,
+            "overall": list(self.overall) if self.overall is not None else None,
+            "boxes": self.solids.boxes.tolist(),
+            "oriented": self.solids.oriented.tolist() if self.solids.oriented is not None else None
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild a result from to_dict() or from the per-solid dict layout of
+        the JSON reports and older cache entries.
+        """
+        if "boxes" in data:
+            solids = SolidTable(data["boxes"], data.get("oriented"))
+            overall = data.get("overall")
+        else:
+            solids = SolidTable.from_dicts(data.get("solids", []))
+            box = (data.get("overall_bbox") or {}).get("BoundingBox")
+            overall = [box[column] for column in BOX_COLUMNS] if box else None
+        return cls(data.get("bbox_mode", "fast"), data["solid_count"], overall, solids, data.get("face_count", 0))
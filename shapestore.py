@@ -0,0 +1,124 @@
+import os
+import time
+from OCC.Core.BinTools import binTools
+from OCC.Core.TopoDS import TopoDS_Shape
+from metrics import stage
+from readers import read_shape
+from cache import CACHE_EVICT_EVERY, CACHE_EVICT_FRACTION
+from storage import enforce_quota
+
+# Default location and limits for the persistent shape store
+SHAPE_STORE_FOLDER = 'shapes'
+SHAPE_STORE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB
+SHAPE_STORE_MAX_AGE = 30 * 24 * 60 * 60  # 30 days
+
+
+class ShapeStore:
+    """
+    Persistent, content-addressed store of transferred shapes.
+
+    Each entry is the shape of one STEP file written in OCC's binary BRep
+    format (BinTools) and named after the SHA-256 of that STEP file. Loading
+    an entry skips STEP parsing and transfer, which dominate every analysis.
+    Expiry and eviction work like the ResultCache.
+    """
+
+    def __init__(self, folder=SHAPE_STORE_FOLDER, max_bytes=SHAPE_STORE_MAX_BYTES, max_age=SHAPE_STORE_MAX_AGE,
+                 evict_every=CACHE_EVICT_EVERY):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self._puts = 0
+        self._written = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.folder, f"{key}.brep")
+
+    def get(self, key):
+        """
+        Return the stored shape for key, or None on a miss or expired entry.
+        """
+        path = self._entry_path(key)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        if self.max_age is not None and time.time() - mtime > self.max_age:
+            self._remove(path)
+            return None
+
+        shape = TopoDS_Shape()
+        try:
+            loaded = binTools.Read(shape, path)
+        except Exception as e:
+            print(f"Error reading shape store entry {path}: {e}")
+            loaded = False
+        if not loaded or shape.IsNull():
+            self._remove(path)
+            return None
+
+        # Touch the entry so eviction keeps recently used shapes
+        os.utime(path, None)
+        return shape
+
+    def put(self, key, shape):
+        """
+        Store a shape under key, evicting old entries when enough has been
+        written since the last eviction.
+        """
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            if not binTools.Write(shape, tmp_path):
+                raise OSError("BinTools could not write the shape")
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error writing shape store entry {path}: {e}")
+            self._remove(tmp_path)
+            return
+
+        self._puts += 1
+        self._written += size
+        if self._puts >= self.evict_every or (self.max_bytes is not None and
+                                               self._written >= self.max_bytes * CACHE_EVICT_FRACTION):
+            self.evict()
+
+    def evict(self):
+        """
+        Remove expired entries, then the least recently used ones until the
+        store folder fits within max_bytes.
+        """
+        self._puts = self._written = 0
+        enforce_quota(self.folder, self.max_bytes, self.max_age, suffix='.brep')
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def load_shape(file_path, content_hash, store, pipeline, read=None):
+    """
+    Return the transferred shape of a STEP file, or of any other of the
+    readers' INPUT_FORMATS, loading it from the store when this content was
+    transferred before and storing it otherwise. read, when given, returns
+    the shape on a store miss instead of reading the file again.
+    Stages are recorded under the given metrics pipeline.
+    """
+    with stage(pipeline, 'store_load') as timer:
+        shape = store.get(content_hash)
+        timer.add('store_hits' if shape is not None else 'store_misses', 1)
+    if shape is not None:
+        return shape
+
+    shape = read() if read is not None else read_shape(file_path, pipeline)
+
+    with stage(pipeline, 'store_save'):
+        store.put(content_hash, shape)
+    return shape
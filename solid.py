@@ -1,126 +1,382 @@
-from OCC.Core.STEPControl import STEPControl_Reader
-from OCC.Core.BRepBndLib import brepbndlib
-from OCC.Core.Bnd import Bnd_Box
-from OCC.Core.TopExp import TopExp_Explorer
-from OCC.Core.TopAbs import TopAbs_SOLID
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from assembly import analyse_roots_parallel
+from stepscan import scan_step_file
+from cache import hash_file
+from readers import STEP_FORMATS, input_extensions, read_shape, sniff_format, strip_input_extension
+from formats import OUTPUT_FORMATS, PARQUET_AVAILABLE, concat_columns, save_solids, write_csv, write_json, write_parquet
+from results import SolidTable
+from metrics import registry, replay, stage, trace_start, trace_stop
+from topology import BBOX_MODES, walk_shape
+import argparse
+import glob
+import json
 import os
+import sys
+import time
+
+# File extensions picked up when a directory is given on the command line:
+# STEP, compressed STEP, IGES and BREP
+INPUT_EXTENSIONS = input_extensions()
+
+# Default number of files processed at once in batch mode
+BATCH_WORKERS = os.cpu_count() or 1
 
 def load_step_file(file_path):
-    # Initialize STEP reader
-    step_reader = STEPControl_Reader()
+    # Read and transfer the file with the reader its content calls for
+    return read_shape(file_path, "solids")
 
-    # Read the STEP file
-    status = step_reader.ReadFile(file_path)
+def save_to_single_file(input_file, overall_bbox, solid_boxes, solid_count, txt_file=None, bbox_mode="fast"):
+    # Save both overall and individual bounding boxes to a single text file
+    if txt_file is None:
+        txt_file = f"{strip_input_extension(input_file)}.txt"
 
-    # Check if reading is successful
-    if status != 1:
-        raise Exception(f"Error reading STEP file: {file_path}")
+    # Write overall bounding box details
+    box = overall_bbox['BoundingBox']
+    lines = [
+        f"Number of Solids: {solid_count}\n"
+        f"Bounding Box Mode: {bbox_mode}\n\n"
+        "Overall Bounding Box Dimensions:\n"
+        f"  Width: {overall_bbox['Width']}\n"
+        f"  Height: {overall_bbox['Height']}\n"
+        f"  Depth: {overall_bbox['Depth']}\n\n"
+        "Bounding Box Coordinates:\n"
+        f"  X_min: {box['X_min']}\n"
+        f"  Y_min: {box['Y_min']}\n"
+        f"  Z_min: {box['Z_min']}\n"
+        f"  X_max: {box['X_max']}\n"
+        f"  Y_max: {box['Y_max']}\n"
+        f"  Z_max: {box['Z_max']}\n\n"
+        "Individual Solid Bounding Boxes:\n"
+    ]
 
-    # Transfer the contents to a shape
-    step_reader.TransferRoots()
-    return step_reader.Shape()
+    # Write individual solid bounding boxes, straight from the solid table
+    for idx, (box, dims, obb) in enumerate(solid_boxes.records()):
+        x_min, y_min, z_min, x_max, y_max, z_max = box
+        width, height, depth = dims
+        lines.append(
+            f"Solid {idx + 1}:\n"
+            f"  Width: {width}\n"
+            f"  Height: {height}\n"
+            f"  Depth: {depth}\n"
+            "  Bounding Box Coordinates:\n"
+            f"    X_min: {x_min}\n"
+            f"    Y_min: {y_min}\n"
+            f"    Z_min: {z_min}\n"
+            f"    X_max: {x_max}\n"
+            f"    Y_max: {y_max}\n"
+            f"    Z_max: {z_max}\n"
+        )
+        if obb:
+            lines.append(
+                "  Oriented Bounding Box:\n"
+                f"    Center: {obb['Center']}\n"
+                f"    Axes: {obb['Axes']}\n"
+                f"    Half Sizes: {obb['HalfSizes']}\n"
+            )
+        lines.append("\n")
 
-def calculate_overall_bounding_box(shape):
-    # Create a bounding box for the entire shape
-    bbox = Bnd_Box()
-    brepbndlib.Add(shape, bbox)
+    with open(txt_file, "w") as f:
+        f.write("".join(lines))
+    print(f"All bounding box details saved to {txt_file}")
+
+def save_inspection_to_file(input_file, inspection, txt_file=None):
+    # Save the header metadata and entity tally from the streaming scanner
+    if txt_file is None:
+        txt_file = f"{strip_input_extension(input_file)}_inspect.txt"
 
-    # Get bounding box dimensions and coordinates
-    x_min, y_min, z_min, x_max, y_max, z_max = bbox.Get()
+    file_name = inspection["header"].get("file_name") or {}
+    with open(txt_file, "w") as f:
+        f.write(f"Name: {file_name.get('name')}\n")
+        f.write(f"Originating System: {file_name.get('originating_system')}\n")
+        f.write(f"Schema: {inspection['schema']}\n")
+        f.write(f"Number of Solids: {inspection['solid_count']}\n")
+        f.write(f"Number of Entities: {inspection['entity_count']}\n\n")
+        f.write("Entity Types:\n")
+        for entity_type, count in inspection["entity_types"].items():
+            f.write(f"  {entity_type}: {count}\n")
+    print(f"Inspection details saved to {txt_file}")
+
+def process_file(input_file, txt_file, inspect=False, parallel=False, fmt="txt", bbox_mode="fast", tolerance=0.0):
+    """
+    Analyse one STEP file and write its report; returns a summary record
+    with the input's mtime, size and content hash for the manifest.
+    Runs in a batch worker process, so failures are reported, not raised.
+    """
+    start = time.perf_counter()
+    trace_start()
+    try:
+        # Stat and hash before reading, so the manifest describes the content the report was made from
+        stat = os.stat(input_file)
+        file_info = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": hash_file(input_file)}
+        is_step = sniff_format(input_file) in STEP_FORMATS
+        if inspect and not is_step:
+            raise ValueError("Inspect mode only supports STEP files")
+        if inspect:
+            with stage("inspect", "scan"):
+                inspection = scan_step_file(input_file)
+            if fmt == "txt":
+                save_inspection_to_file(input_file, inspection, txt_file)
+            else:
+                write_json(txt_file, inspection)
+        else:
+            if parallel and is_step:
+                # Transfer and analyse the assembly roots across worker processes
+                with stage("solids", "parallel_transfer") as timer:
+                    walk = analyse_roots_parallel(input_file, bbox_mode=bbox_mode, tolerance=tolerance)
+                    timer.add("solids", walk.solid_count)
+            else:
+                shape = load_step_file(input_file)
+
+                # Walk the shape once for the overall box, per-solid boxes and solid count
+                with stage("solids", "walk") as timer:
+                    walk = walk_shape(shape, bbox_mode=bbox_mode, tolerance=tolerance)
+                    timer.add("solids", walk.solid_count)
+
+            # Save details to a single file
+            with stage("solids", "write"):
+                if fmt == "txt":
+                    save_to_single_file(input_file, walk.overall_bbox, walk.solids, walk.solid_count,
+                                        txt_file, bbox_mode)
+                else:
+                    save_solids(walk, txt_file, fmt, source=input_file)
+        status, error = "done", None
+    except Exception as e:
+        status, error, file_info = "failed", f"{type(e).__name__}: {e}", {}
+        print(f"Error processing {input_file}: {error}")
+
+    trace = trace_stop()
     return {
-        "Width": x_max - x_min,
-        "Height": y_max - y_min,
-        "Depth": z_max - z_min,
-        "BoundingBox": {
-            "X_min": x_min, "Y_min": y_min, "Z_min": z_min,
-            "X_max": x_max, "Y_max": y_max, "Z_max": z_max
-        }
+        "input": input_file,
+        "output": txt_file,
+        "status": status,
+        "error": error,
+        "seconds": time.perf_counter() - start,
+        "stages": {f"{pipeline}.{name}": seconds for pipeline, name, seconds, _, _, _ in trace},
+        "trace": trace,
+        **file_info
     }
 
-def calculate_individual_solid_bounding_boxes(shape):
-    # Initialize a list to hold bounding boxes for each solid
-    solid_boxes = []
-    explorer = TopExp_Explorer(shape, TopAbs_SOLID)
-
-    while explorer.More():
-        solid = explorer.Current()  # Get the current solid
-        bbox = Bnd_Box()
-        brepbndlib.Add(solid, bbox)  # Calculate bounding box for this solid
-        x_min, y_min, z_min, x_max, y_max, z_max = bbox.Get()
-        solid_boxes.append({
-            "BoundingBox": {
-                "X_min": x_min, "Y_min": y_min, "Z_min": z_min,
-                "X_max": x_max, "Y_max": y_max, "Z_max": z_max
-            },
-            "Width": x_max - x_min,
-            "Height": y_max - y_min,
-            "Depth": z_max - z_min
-        })
-        explorer.Next()
-
-    return solid_boxes
-
-def count_solids(shape):
-    # Count the number of solids in the shape
-    solid_count = 0
-    explorer = TopExp_Explorer(shape, TopAbs_SOLID)
-    while explorer.More():
-        solid_count += 1
-        explorer.Next()
-    return solid_count
-
-def save_to_single_file(input_file, overall_bbox, solid_boxes, solid_count):
-    # Save both overall and individual bounding boxes to a single text file
-    base_name = os.path.splitext(input_file)[0]
-    txt_file = f"{base_name}.txt"
+def find_step_files(inputs, extensions=INPUT_EXTENSIONS):
+    """
+    Expand files, directories (searched recursively) and glob patterns into
+    (input_file, relative_name) pairs, without duplicates. Files found in a
+    directory are named relative to it, other files by their base name.
+    """
+    found = {}
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, names in os.walk(item):
+                for name in sorted(names):
+                    if name.lower().endswith(extensions):
+                        path = os.path.join(root, name)
+                        found.setdefault(os.path.abspath(path), os.path.relpath(path, item))
+        else:
+            paths = sorted(glob.glob(item, recursive=True)) if glob.has_magic(item) else [item]
+            for path in paths:
+                if os.path.isfile(path):
+                    found.setdefault(os.path.abspath(path), os.path.basename(path))
+                else:
+                    print(f"Skipping missing input: {path}")
+    return sorted(found.items())
 
-    with open(txt_file, "w") as f:
-        # Write overall bounding box details
-        f.write(f"Number of Solids: {solid_count}\n\n")
-        f.write("Overall Bounding Box Dimensions:\n")
-        f.write(f"  Width: {overall_bbox['Width']}\n")
-        f.write(f"  Height: {overall_bbox['Height']}\n")
-        f.write(f"  Depth: {overall_bbox['Depth']}\n\n")
-        f.write("Bounding Box Coordinates:\n")
-        f.write(f"  X_min: {overall_bbox['BoundingBox']['X_min']}\n")
-        f.write(f"  Y_min: {overall_bbox['BoundingBox']['Y_min']}\n")
-        f.write(f"  Z_min: {overall_bbox['BoundingBox']['Z_min']}\n")
-        f.write(f"  X_max: {overall_bbox['BoundingBox']['X_max']}\n")
-        f.write(f"  Y_max: {overall_bbox['BoundingBox']['Y_max']}\n")
-        f.write(f"  Z_max: {overall_bbox['BoundingBox']['Z_max']}\n\n")
-
-        # Write individual solid bounding boxes
-        f.write("Individual Solid Bounding Boxes:\n")
-        for idx, solid in enumerate(solid_boxes):
-            f.write(f"Solid {idx + 1}:\n")
-            f.write(f"  Width: {solid['Width']}\n")
-            f.write(f"  Height: {solid['Height']}\n")
-            f.write(f"  Depth: {solid['Depth']}\n")
-            f.write("  Bounding Box Coordinates:\n")
-            f.write(f"    X_min: {solid['BoundingBox']['X_min']}\n")
-            f.write(f"    Y_min: {solid['BoundingBox']['Y_min']}\n")
-            f.write(f"    Z_min: {solid['BoundingBox']['Z_min']}\n")
-            f.write(f"    X_max: {solid['BoundingBox']['X_max']}\n")
-            f.write(f"    Y_max: {solid['BoundingBox']['Y_max']}\n")
-            f.write(f"    Z_max: {solid['BoundingBox']['Z_max']}\n")
-            f.write("\n")
-    print(f"All bounding box details saved to {txt_file}")
+def path_name(input_file):
+    # The input's path as a relative name: relative to the working directory, or the absolute path without its root
+    relative = os.path.relpath(input_file)
+    if relative.split(os.sep, 1)[0] != os.pardir:
+        return relative
+    return os.path.splitdrive(os.path.abspath(input_file))[1].lstrip(os.sep)
+
+def report_paths(files, output_dir, suffix):
+    """
+    Report path of every (input_file, relative_name) pair: under output_dir
+    at its relative name, or next to the input. Inputs whose reports would
+    land on the same path, like a/x.stp and b/x.stp from two globs or x.stp
+    next to x.step, keep their directories and then their extensions in the
+    report name. Returns {input_file: report_path}.
+    """
+    def candidates(input_file, relative_name):
+        if output_dir:
+            yield os.path.join(output_dir, strip_input_extension(relative_name) + suffix)
+            yield os.path.join(output_dir, strip_input_extension(path_name(input_file)) + suffix)
+            yield os.path.join(output_dir, path_name(input_file) + suffix)
+        else:
+            yield strip_input_extension(input_file) + suffix
+            yield input_file + suffix
+
+    pending = {input_file: candidates(input_file, relative_name) for input_file, relative_name in files}
+    paths = {}
+    while pending:
+        for input_file, names in pending.items():
+            paths[input_file] = next(names)
+        # Compare case-insensitively, as on the file systems of Windows and macOS;
+        # of the inputs sharing a path, those that moved this round move on
+        taken = {}
+        for input_file, path in paths.items():
+            taken.setdefault(os.path.normcase(path).lower(), []).append(input_file)
+        pending = {input_file: pending[input_file] for inputs in taken.values() if len(inputs) > 1
+                   for input_file in inputs if input_file in pending}
+    return paths
+
+def load_manifest(manifest_file):
+    # The manifest is append-only NDJSON; later records win
+    manifest = {}
+    if not os.path.exists(manifest_file):
+        return manifest
+    with open(manifest_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A crash can leave a partial last line behind
+                continue
+            manifest[record["input"]] = record
+    return manifest
+
+def is_up_to_date(record, input_file, txt_file, options=None):
+    """ Checks the manifest record: options, then mtime/size, content hash on mismatch. """
+    if not record or record.get("status") != "done" or record.get("output") != txt_file:
+        return False
+    if record.get("options") != options:
+        return False
+    if not os.path.exists(txt_file):
+        return False
+    stat = os.stat(input_file)
+    if stat.st_mtime == record.get("mtime") and stat.st_size == record.get("size"):
+        return True
+    return stat.st_size == record.get("size") and hash_file(input_file) == record.get("sha256")
+
+def run_batch(files, output_dir=None, workers=BATCH_WORKERS, manifest_file=None, summary_file=None,
+              force=False, inspect=False, parallel=False, fmt="txt", table_file=None, bbox_mode="fast",
+              tolerance=0.0, metrics_file=None):
+    """
+    Process many STEP files with a pool of worker processes.
 
-def main():
-    input_file = "stepfile.stp"  # Replace with your STEP file path
-    shape = load_step_file(input_file)
+    Finished files are appended to the manifest as soon as they complete, so
+    a rerun after a crash skips everything already done. With table_file,
+    the per-file JSON reports are also combined into one columnar table.
+    """
+    if inspect and fmt not in ("txt", "json"):
+        raise ValueError("Inspect mode only supports txt and json output")
+    if table_file and (inspect or fmt != "json"):
+        raise ValueError("A combined table needs per-file json reports")
+    if table_file and table_file.lower().endswith(".parquet") and not PARQUET_AVAILABLE:
+        raise ValueError("A .parquet table needs the pyarrow package")
+    suffix = f"_inspect.{fmt}" if inspect else f".{fmt}"
+    report_dir = output_dir or "."
+    manifest_file = manifest_file or os.path.join(report_dir, "solid_manifest.ndjson")
+    summary_file = summary_file or os.path.join(report_dir, "solid_summary.json")
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_file)), exist_ok=True)
+    manifest = {} if force else load_manifest(manifest_file)
+
+    # Reports made with different options are never considered up to date
+    options = {"inspect": inspect, "format": fmt, "bbox_mode": bbox_mode, "tolerance": tolerance}
+
+    start = time.perf_counter()
+    results = []
+    pending = []
+    txt_files = report_paths(files, output_dir, suffix)
+    for input_file, _ in files:
+        txt_file = txt_files[input_file]
+        if output_dir:
+            os.makedirs(os.path.dirname(txt_file), exist_ok=True)
+        if is_up_to_date(manifest.get(input_file), input_file, txt_file, options):
+            results.append({"input": input_file, "output": txt_file, "status": "skipped",
+                            "error": None, "seconds": 0.0})
+        else:
+            pending.append((input_file, txt_file))
+
+    def record(manifest_out, result):
+        # Worker measurements feed this process's metrics registry
+        replay(result.pop("trace", []))
+        results.append(result)
+        if result["status"] == "done":
+            # The worker already recorded the input's mtime, size and hash
+            entry = dict(result, options=options)
+            manifest_out.write(json.dumps(entry) + "\n")
+            manifest_out.flush()
+        print(f"[{len(results)}/{len(files)}] {result['status']}: {result['input']} ({result['seconds']:.2f}s)")
+
+    with open(manifest_file, "a") as manifest_out:
+        # Root-level parallelism already uses every core, so run files one by one
+        if parallel or workers <= 1:
+            for input_file, txt_file in pending:
+                record(manifest_out, process_file(input_file, txt_file, inspect, parallel, fmt, bbox_mode, tolerance))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(process_file, input_file, txt_file, inspect, False, fmt, bbox_mode, tolerance)
+                           for input_file, txt_file in pending]
+                for future in as_completed(futures):
+                    record(manifest_out, future.result())
+
+    summary = {
+        "total": len(results),
+        "done": sum(1 for result in results if result["status"] == "done"),
+        "skipped": sum(1 for result in results if result["status"] == "skipped"),
+        "failed": sum(1 for result in results if result["status"] == "failed"),
+        "seconds": time.perf_counter() - start,
+        "files": sorted(results, key=lambda result: result["input"])
+    }
+    with open(summary_file, "w") as f:
+        json.dump(summary, f, indent=2)
+    if table_file:
+        save_solids_table(summary["files"], table_file)
+    if metrics_file:
+        # Prometheus text format, e.g. for the node exporter's textfile collector
+        with open(metrics_file, "w") as f:
+            f.write(registry.render())
+    print(f"Processed {summary['done']}, skipped {summary['skipped']}, failed {summary['failed']} "
+          f"in {summary['seconds']:.2f}s; summary saved to {summary_file}")
+    return summary
 
-    # Calculate overall bounding box
-    overall_bbox = calculate_overall_bounding_box(shape)
+def save_solids_table(results, table_file):
+    """
+    Combine the solids of every finished per-file JSON report into a single
+    CSV or Parquet table, chosen by the table file's extension.
+    """
+    tables = []
+    for result in results:
+        if result["status"] not in ("done", "skipped"):
+            continue
+        with open(result["output"]) as f:
+            report = json.load(f)
+        tables.append(SolidTable.from_dicts(report["solids"]).columns(result["input"], report.get("bbox_mode")))
 
-    # Calculate individual bounding boxes for solids
-    solid_boxes = calculate_individual_solid_bounding_boxes(shape)
+    columns = concat_columns(tables)
+    if table_file.lower().endswith(".parquet"):
+        write_parquet(table_file, columns)
+    else:
+        write_csv(table_file, columns)
+    print(f"Combined table of {len(columns.get('solid', []))} solids saved to {table_file}")
 
-    # Count the number of solids
-    solid_count = count_solids(shape)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract solid bounding boxes from STEP, IGES and BREP files.")
+    parser.add_argument("inputs", nargs="*", default=["stepfile.stp"],
+                        help="STEP (plain or gzip), IGES or BREP files, directories or glob patterns (default: stepfile.stp)")
+    parser.add_argument("-o", "--output-dir", help="write reports here instead of next to each input")
+    parser.add_argument("-j", "--jobs", type=int, default=BATCH_WORKERS, help="number of worker processes")
+    parser.add_argument("--manifest", help="manifest of finished files (default: <output-dir>/solid_manifest.ndjson)")
+    parser.add_argument("--summary", help="summary JSON file (default: <output-dir>/solid_summary.json)")
+    parser.add_argument("--force", action="store_true", help="reprocess files even if their report is up to date")
+    parser.add_argument("--inspect", action="store_true", help="only scan headers and entity counts, no geometry")
+    parser.add_argument("--parallel", action="store_true", help="transfer the roots of each file in parallel")
+    parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default="txt", help="per-file report format")
+    parser.add_argument("--bbox-mode", choices=BBOX_MODES, default="fast",
+                        help="fast (axis-aligned), tight (AddOptimal) or oriented (OBB) solid boxes")
+    parser.add_argument("--tolerance", type=float, default=0.0,
+                        help="gap added on every side of every bounding box, oriented ones included")
+    parser.add_argument("--metrics", help="write per-stage metrics in Prometheus text format to this file")
+    parser.add_argument("--table", help="also combine all solids into one .csv or .parquet table (needs --format json)")
+    args = parser.parse_args(argv)
 
-    # Save details to a single file
-    save_to_single_file(input_file, overall_bbox, solid_boxes, solid_count)
+    files = find_step_files(args.inputs)
+    try:
+        summary = run_batch(files, args.output_dir, args.jobs, args.manifest, args.summary,
+                            force=args.force, inspect=args.inspect, parallel=args.parallel,
+                            fmt=args.format, table_file=args.table, bbox_mode=args.bbox_mode,
+                            tolerance=args.tolerance, metrics_file=args.metrics)
+    except ValueError as e:
+        parser.error(str(e))
+    return 1 if summary["failed"] else 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import numpy as np
+
+# Boxes swept per vectorised step when collecting overlapping pairs
+PAIR_BLOCK_SIZE = 4096
+
+
+class SolidIndex:
+    """
+    Sweep-and-prune index over axis-aligned solid boxes.
+
+    Boxes are kept in an (n, 6) float64 array (X_min, Y_min, Z_min, X_max,
+    Y_max, Z_max) plus a copy sorted by X_min, so every query first narrows
+    the candidates by binary search along X and then tests the remaining
+    axes with vectorised comparisons. Solids are referred to by their 0-based
+    position in the solids list; touching boxes count as overlapping.
+    """
+
+    def __init__(self, boxes):
+        self.boxes = np.ascontiguousarray(boxes, dtype=np.float64).reshape(-1, 6)
+        self.order = np.argsort(self.boxes[:, 0], kind='stable')
+        self.sorted_boxes = self.boxes[self.order]
+
+    @classmethod
+    def from_solids(cls, solids):
+        # solids is a SolidTable; its box array is used as is
+        return cls(solids.boxes)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def intersecting(self, box):
+        """
+        Return the positions of the solids whose boxes overlap box, ascending.
+        """
+        box = np.asarray(box, dtype=np.float64)
+        # Only boxes starting before the query ends along X can overlap it
+        end = np.searchsorted(self.sorted_boxes[:, 0], box[3], side='right')
+        candidates = self.sorted_boxes[:end]
+        mask = np.all(candidates[:, 3:] >= box[:3], axis=1) & np.all(candidates[:, :3] <= box[3:], axis=1)
+        return np.sort(self.order[:end][mask])
+
+    def nearest(self, box, k=1):
+        """
+        Return (positions, distances) of the k solids closest to box, nearest
+        first and equally distant ones by position. The distance is the gap
+        between the boxes, 0 when they overlap; pass a point as a box whose
+        min and max corners coincide.
+        """
+        box = np.asarray(box, dtype=np.float64)
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        gaps = np.maximum(0.0, np.maximum(self.boxes[:, :3] - box[3:], box[:3] - self.boxes[:, 3:]))
+        distances = np.sqrt(np.einsum('ij,ij->i', gaps, gaps))
+        if k < len(self):
+            # Keep every solid tied with the k-th so ties go to the lowest positions
+            kth = distances[np.argpartition(distances, k - 1)[k - 1]]
+            positions = np.flatnonzero(distances <= kth)
+        else:
+            positions = np.arange(len(self))
+        positions = positions[np.lexsort((positions, distances[positions]))][:k]
+        return positions, distances[positions]
+
+    def overlapping_pairs(self):
+        """
+        Return an (m, 2) array of the positions (i < j) of every pair of solids
+        whose boxes overlap, sorted by i then j.
+
+        The sweep runs along whichever axis yields the fewest candidate pairs,
+        so parts stacked along X are not compared all-against-all.
+        """
+        order, ends = self._sweep_axis()
+        sorted_boxes = self.boxes[order]
+        blocks = []
+        for start in range(0, len(self), PAIR_BLOCK_SIZE):
+            first = np.arange(start, min(start + PAIR_BLOCK_SIZE, len(self)))
+            counts = np.maximum(ends[first] - first - 1, 0)
+            total = int(counts.sum())
+            if not total:
+                continue
+            left = np.repeat(first, counts)
+            right = left + 1 + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            a, b = sorted_boxes[left], sorted_boxes[right]
+            mask = np.all(a[:, :3] <= b[:, 3:], axis=1) & np.all(b[:, :3] <= a[:, 3:], axis=1)
+            blocks.append(np.stack((order[left[mask]], order[right[mask]]), axis=1))
+
+        if not blocks:
+            return np.empty((0, 2), dtype=np.int64)
+        pairs = np.sort(np.concatenate(blocks), axis=1)
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+    def _sweep_axis(self):
+        """
+        Return (order, ends) for the axis with the fewest candidate pairs:
+        order sorts the boxes by their minimum along that axis, and sorted
+        boxes i+1 .. ends[i]-1 start before sorted box i ends along it.
+        """
+        best = None
+        positions = np.arange(len(self))
+        for axis in range(3):
+            order = self.order if axis == 0 else np.argsort(self.boxes[:, axis], kind='stable')
+            ends = np.searchsorted(self.boxes[order, axis], self.boxes[order, axis + 3], side='right')
+            candidates = int(np.maximum(ends - positions - 1, 0).sum())
+            if best is None or candidates < best[0]:
+                best = (candidates, order, ends)
+        return best[1], best[2]
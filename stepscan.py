@@ -0,0 +1,540 @@
+import gzip
+import hashlib
+import re
+from collections import Counter, deque
+
+# Read STEP files in chunks of this size so memory stays constant
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+# Every ISO-10303-21 file starts with this keyword
+STEP_MAGIC = b'ISO-10303-21'
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Strings and comments may contain ';', so they are matched as whole tokens.
+# The unterminated variants only match at the end of the buffer and tell the
+# scanner to wait for the next chunk.
+_TOKEN = re.compile(
+    rb"'(?:[^']|'')*'"
+    rb"|/\*.*?\*/"
+    rb"|;"
+    rb"|'(?:[^']|'')*\Z"
+    rb"|/\*.*\Z",
+    re.S,
+)
+_SIMPLE_ENTITY = re.compile(rb"\s*#\d+\s*=\s*([A-Za-z_][A-Za-z0-9_]*)")
+_COMPLEX_ENTITY = re.compile(rb"\s*#\d+\s*=\s*\(")
+_KEYWORD = re.compile(rb"\s*([A-Za-z_][A-Za-z0-9_\-]*)")
+_ENTITY_ID = re.compile(rb"\s*#(\d+)\s*=\s*")
+_LEADING_COMMENTS = re.compile(rb"(?:\s|/\*.*?\*/)*", re.S)
+_STRING = re.compile(rb"'(?:[^']|'')*'")
+_REF = re.compile(rb"#(\d+)")
+_PARAM_TOKEN = re.compile(
+    r"\s*(?:"
+    r"(?P<string>'(?:[^']|'')*')"
+    r"|(?P<open>\()|(?P<close>\))|(?P<comma>,)"
+    r"|(?P<unset>[$*])"
+    r"|(?P<enum>\.[A-Za-z_][A-Za-z0-9_]*\.)"
+    r"|(?P<ref>#\d+)"
+    r"|(?P<number>[+-]?\d+(?:\.\d*)?(?:[Ee][+-]?\d+)?)"
+    r"|(?P<keyword>[A-Za-z_][A-Za-z0-9_]*)"
+    r")"
+)
+
+# Entity types that point back at the product definition, shape or
+# representation they belong to
+LINK_TYPES = ("PRODUCT_DEFINITION_SHAPE", "SHAPE_DEFINITION_REPRESENTATION",
+              "NEXT_ASSEMBLY_USAGE_OCCURRENCE", "CONTEXT_DEPENDENT_SHAPE_REPRESENTATION")
+
+HEADER_FIELDS = {
+    "FILE_DESCRIPTION": ("description", "implementation_level"),
+    "FILE_NAME": ("name", "time_stamp", "author", "organization",
+                  "preprocessor_version", "originating_system", "authorisation"),
+    "FILE_SCHEMA": ("schema_identifiers",),
+}
+
+
+def _strip_comments(statement):
+    return re.sub(rb"/\*.*?\*/", b" ", statement, flags=re.S)
+
+
+def _strip_leading_comments(statement):
+    # An entity may follow a comment, as in '/* c */ #3=QUX(#1,#2);'
+    return statement[_LEADING_COMMENTS.match(statement).end():]
+
+
+def _parse_parameters(text):
+    """
+    Parse a parenthesised ISO-10303-21 parameter list into Python values:
+    strings, numbers, lists, None for '$'/'*' and enum names.
+    """
+    stack = [[]]
+    pos = 0
+    while pos < len(text):
+        match = _PARAM_TOKEN.match(text, pos)
+        if not match:
+            break
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'open':
+            stack.append([])
+        elif kind == 'close':
+            closed = stack.pop()
+            if len(stack) == 1:
+                return closed
+            stack[-1].append(closed)
+        elif kind == 'string':
+            stack[-1].append(value[1:-1].replace("''", "'"))
+        elif kind == 'unset':
+            stack[-1].append(None)
+        elif kind == 'enum':
+            stack[-1].append(value.strip('.'))
+        elif kind == 'number':
+            stack[-1].append(float(value) if any(c in value for c in '.eE') else int(value))
+        elif kind in ('ref', 'keyword'):
+            stack[-1].append(value)
+    return stack[0]
+
+
+def _parse_header_statement(statement):
+    text = _strip_comments(statement).decode('utf-8', errors='replace').strip()
+    paren = text.find('(')
+    if paren < 0:
+        return None, None
+    name = text[:paren].strip().upper()
+    values = _parse_parameters(text[paren:])
+    fields = HEADER_FIELDS.get(name)
+    if fields is None:
+        return name, values
+    return name, dict(zip(fields, values))
+
+
+def _complex_entity_types(statement):
+    # Complex instances look like #1=(A(...)B(...)); list the types at depth one
+    body = _strip_comments(statement)
+    body = re.sub(rb"'(?:[^']|'')*'", b"''", body)
+    start = body.index(b'(', body.index(b'=')) + 1
+    types = []
+    depth = 0
+    pos = start
+    while pos < len(body):
+        char = body[pos:pos + 1]
+        if char == b'(':
+            depth += 1
+        elif char == b')':
+            if depth == 0:
+                break
+            depth -= 1
+        elif depth == 0:
+            match = _KEYWORD.match(body, pos)
+            if match and match.group(1).strip():
+                types.append(match.group(1).upper().decode('ascii'))
+                pos = match.end()
+                continue
+        pos += 1
+    return types
+
+
+def iter_statements(file_obj, chunk_size=SCAN_CHUNK_SIZE):
+    """
+    Yield every ';'-terminated statement of an ISO-10303-21 file as bytes,
+    reading the file in fixed-size chunks.
+    """
+    buffer = b''
+    eof = False
+    while not eof:
+        chunk = file_obj.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+
+        start = 0
+        pos = 0
+        while True:
+            match = _TOKEN.search(buffer, pos)
+            if not match:
+                break
+            if match.group() != b';':
+                if match.end() == len(buffer) and not eof:
+                    # Token may continue in the next chunk
+                    break
+                pos = match.end()
+                continue
+            yield buffer[start:match.start()]
+            start = pos = match.end()
+        buffer = buffer[start:]
+
+    if buffer.strip():
+        yield buffer
+
+
+def is_gzip(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def open_step(file_path):
+    """
+    Open a STEP file for binary reading, decompressing gzip-compressed files
+    (.stpz, .stp.gz) on the fly.
+    """
+    return gzip.open(file_path, 'rb') if is_gzip(file_path) else open(file_path, 'rb')
+
+
+def is_step_head(head):
+    # True when the first bytes of a (decompressed) file start like an ISO-10303-21 file
+    return head.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(STEP_MAGIC)
+
+
+def prescan_step_file(file_path, chunk_size=SCAN_CHUNK_SIZE, size_limit=None, entity_limit=None, max_size=None):
+    """
+    Take a cheap first look at a file before any parsing: its size, whether
+    it starts like an ISO-10303-21 file and an estimate of its entity count
+    from the lines that start with '#'. Runs at raw read speed; the size of
+    a gzip-compressed file is its decompressed size.
+
+    Reading stops early once the file is known to exceed both size_limit
+    and entity_limit, or to exceed max_size, so a compressed file is never
+    decompressed further than the caller's decision needs. 'complete' is
+    False when it stopped early; size and entity_estimate are then lower bounds.
+    """
+    size = 0
+    entity_estimate = 0
+    complete = True
+    last = b'\n'
+    with open_step(file_path) as f:
+        chunk = f.read(max(chunk_size, 256))
+        is_step = is_step_head(chunk[:256])
+        while chunk:
+            size += len(chunk)
+            entity_estimate += chunk.count(b'\n#') + (last == b'\n' and chunk.startswith(b'#'))
+            last = chunk[-1:]
+            if ((size_limit is not None and entity_limit is not None
+                 and size > size_limit and entity_estimate > entity_limit)
+                    or (max_size is not None and size > max_size)):
+                complete = False
+                break
+            chunk = f.read(chunk_size)
+    return {"size": size, "is_step": is_step, "entity_estimate": entity_estimate, "complete": complete}
+
+
+def scan_step_file(file_path, chunk_size=SCAN_CHUNK_SIZE):
+    """
+    Scan a STEP file without transferring any geometry.
+
+    Parses the HEADER section and tallies DATA-section entity types in a
+    single streaming pass, so memory use does not grow with file size.
+    Gzip-compressed files are decompressed as they are scanned.
+    """
+    header = {}
+    entity_types = Counter()
+    entity_count = 0
+    section = None
+
+    with open_step(file_path) as f:
+        for statement in iter_statements(f, chunk_size):
+            if section == 'DATA':
+                entity = _strip_leading_comments(statement)
+                match = _SIMPLE_ENTITY.match(entity)
+                if match:
+                    entity_count += 1
+                    entity_types[match.group(1).upper().decode('ascii')] += 1
+                    continue
+                if _COMPLEX_ENTITY.match(entity):
+                    entity_count += 1
+                    entity_types.update(_complex_entity_types(entity))
+                    continue
+
+            keyword = _KEYWORD.match(_strip_comments(statement))
+            keyword = keyword.group(1).upper() if keyword else b''
+            if keyword == b'HEADER':
+                section = 'HEADER'
+            elif keyword == b'DATA':
+                section = 'DATA'
+            elif keyword in (b'ENDSEC', b'END-ISO-10303-21'):
+                section = None
+            elif section == 'HEADER':
+                name, values = _parse_header_statement(statement)
+                if name:
+                    header[name.lower()] = values
+
+    return {
+        "header": header,
+        "schema": (header.get("file_schema") or {}).get("schema_identifiers"),
+        "entity_count": entity_count,
+        "entity_types": dict(entity_types.most_common()),
+        "solid_count": entity_types.get("MANIFOLD_SOLID_BREP", 0)
+    }
+
+
+def _split_references(body):
+    """
+    Replace the entity references outside string literals with '#' and drop
+    the whitespace there. Returns (normalised body, referenced ids in order).
+    """
+    refs = []
+    parts = []
+    pos = 0
+    for match in _STRING.finditer(body):
+        refs.extend(int(ref) for ref in _REF.findall(body, pos, match.start()))
+        parts.append(_REF.sub(b'#', b''.join(body[pos:match.start()].split())))
+        parts.append(match.group())
+        pos = match.end()
+    refs.extend(int(ref) for ref in _REF.findall(body, pos))
+    parts.append(_REF.sub(b'#', b''.join(body[pos:].split())))
+    return b''.join(parts), refs
+
+
+def read_entity_graph(file_path, chunk_size=SCAN_CHUNK_SIZE):
+    """
+    Read the DATA section into {entity id: (body, refs)}, where body is the
+    entity text after '=' with references blanked out and refs lists the
+    referenced ids in order. Comments are dropped.
+    """
+    graph = {}
+    section = None
+    with open_step(file_path) as f:
+        for statement in iter_statements(f, chunk_size):
+            if section == 'DATA':
+                entity = _strip_leading_comments(statement)
+                match = _ENTITY_ID.match(entity)
+                if match:
+                    graph[int(match.group(1))] = _split_references(_strip_comments(entity[match.end():]))
+                    continue
+
+            keyword = _KEYWORD.match(_strip_comments(statement))
+            keyword = keyword.group(1).upper() if keyword else b''
+            if keyword == b'DATA':
+                section = 'DATA'
+            elif keyword in (b'ENDSEC', b'END-ISO-10303-21'):
+                section = None
+    return graph
+
+
+def fingerprint_entities(graph, roots):
+    """
+    Hash the subgraph below each root entity. An entity's digest covers its
+    own body and the digests of the entities it references, but not any
+    entity ids, so renumbering a revision leaves unchanged parts with the
+    same fingerprint. Returns {root id: hex digest}.
+    """
+    digests = {}
+    visiting = set()
+    for root in roots:
+        stack = [(root, False)]
+        while stack:
+            entity, expanded = stack.pop()
+            if entity in digests:
+                continue
+            if entity not in graph:
+                digests[entity] = hashlib.sha256(b'missing').digest()
+                continue
+            body, refs = graph[entity]
+            if not expanded:
+                if entity in visiting:
+                    # Reference cycle; the placeholder below stands in for it
+                    continue
+                visiting.add(entity)
+                stack.append((entity, True))
+                stack.extend((ref, False) for ref in refs if ref not in digests)
+                continue
+            digest = hashlib.sha256(body)
+            for ref in refs:
+                digest.update(digests.get(ref, b'cycle'))
+            digests[entity] = digest.digest()
+            visiting.discard(entity)
+    return {root: digests[root].hex() for root in roots}
+
+
+def entity_types(body):
+    """
+    Upper-case type names of an entity body as stored in the entity graph;
+    complex instances list every type they combine.
+    """
+    if body.startswith(b'('):
+        return _complex_entity_types(b'=' + body)
+    match = _KEYWORD.match(body)
+    return [match.group(1).upper().decode('ascii')] if match else []
+
+
+def _product_links(graph):
+    """
+    Index the entities that tie geometry and components to a product
+    definition by the entity they point back to: {target id: [(type, id)]}.
+    Only the first reference of each link is indexed, except for
+    representation relationships, which are indexed under both
+    representations.
+    """
+    links = {}
+    for entity, (body, refs) in graph.items():
+        if not refs:
+            continue
+        types = entity_types(body)
+        if 'REPRESENTATION_RELATIONSHIP' in types or 'SHAPE_REPRESENTATION_RELATIONSHIP' in types:
+            if 'REPRESENTATION_RELATIONSHIP_WITH_TRANSFORMATION' in types:
+                # Places a component in its assembly; reached through the CDSR instead
+                continue
+            kind, targets = 'SHAPE_REPRESENTATION_RELATIONSHIP', refs[:2]
+        elif types and types[0] in LINK_TYPES:
+            kind, targets = types[0], refs[-1:] if types[0] == 'CONTEXT_DEPENDENT_SHAPE_REPRESENTATION' else refs[:1]
+        else:
+            continue
+        for target in targets:
+            links.setdefault(target, []).append((kind, entity))
+    return links
+
+
+def _linked(links, entity, kind):
+    return [linked for linked_kind, linked in links.get(entity, ()) if linked_kind == kind]
+
+
+def _product_anchors(graph, links, product, with_components=True, seen=None):
+    """
+    Collect the entities whose forward closures together hold a product
+    definition: its shapes, their representations and every representation
+    related to them, plus, with_components, each component occurrence and
+    its placement. Returns (anchors, representations of the product itself).
+    """
+    seen = set() if seen is None else seen
+    seen.add(product)
+    anchors = [product]
+    representations = []
+    for shape in _linked(links, product, 'PRODUCT_DEFINITION_SHAPE'):
+        anchors.append(shape)
+        for definition in _linked(links, shape, 'SHAPE_DEFINITION_REPRESENTATION'):
+            anchors.append(definition)
+            representations.extend(graph[definition][1][1:2])
+
+    # Follow shape representation relationships in both directions, e.g. to the B-rep
+    queue = deque(representations)
+    reached = set(representations)
+    while queue:
+        for relationship in _linked(links, queue.popleft(), 'SHAPE_REPRESENTATION_RELATIONSHIP'):
+            if relationship in reached:
+                continue
+            reached.add(relationship)
+            anchors.append(relationship)
+            for representation in graph[relationship][1][:2]:
+                if representation not in reached:
+                    reached.add(representation)
+                    representations.append(representation)
+                    queue.append(representation)
+
+    if with_components:
+        for occurrence in _linked(links, product, 'NEXT_ASSEMBLY_USAGE_OCCURRENCE'):
+            anchors.extend(_occurrence_anchors(graph, links, occurrence, seen))
+    return anchors, representations
+
+
+def _occurrence_anchors(graph, links, occurrence, seen):
+    # A component occurrence, its placement in the assembly and the component product with its own components
+    anchors = [occurrence]
+    for shape in _linked(links, occurrence, 'PRODUCT_DEFINITION_SHAPE'):
+        anchors.append(shape)
+        anchors.extend(_linked(links, shape, 'CONTEXT_DEPENDENT_SHAPE_REPRESENTATION'))
+    refs = graph[occurrence][1]
+    if len(refs) > 1 and refs[1] not in seen:
+        anchors.extend(_product_anchors(graph, links, refs[1], seen=seen)[0])
+    return anchors
+
+
+def _has_own_geometry(graph, representations):
+    # True when a representation holds more than the placements an assembly positions its components with
+    for representation in representations:
+        body, refs = graph.get(representation, (b'', ()))
+        if entity_types(body) != ['SHAPE_REPRESENTATION']:
+            return True
+        # SHAPE_REPRESENTATION(name, items, context): every reference but the last is an item
+        if any(entity_types(graph.get(item, (b'', ()))[0]) != ['AXIS2_PLACEMENT_3D'] for item in refs[:-1]):
+            return True
+    return False
+
+
+def _root_product(graph, root):
+    # The product definition a transfer root stands for, through its shape definition if need be
+    body, refs = graph.get(root, (b'', ()))
+    types = entity_types(body)
+    if types == ['PRODUCT_DEFINITION']:
+        return root
+    if types == ['SHAPE_DEFINITION_REPRESENTATION'] and refs:
+        shape = graph.get(refs[0], (b'', ()))
+        if entity_types(shape[0]) == ['PRODUCT_DEFINITION_SHAPE'] and shape[1]:
+            if entity_types(graph.get(shape[1][0], (b'', ()))[0]) == ['PRODUCT_DEFINITION']:
+                return shape[1][0]
+    return None
+
+
+def split_components(graph, roots):
+    """
+    Split each transfer root into the components it is transferred as.
+
+    A root whose product is an assembly with no geometry of its own is split
+    into its NEXT_ASSEMBLY_USAGE_OCCURRENCE children, each covering its
+    placement and the component product with everything below it; any other
+    root is one component. Returns {root id: [(component entity id, product
+    definition id or None, anchors)]}, where the component entity is the
+    root itself or the occurrence and anchors are the entities whose forward
+    closures hold the component.
+    """
+    links = _product_links(graph)
+    units = {}
+    for root in roots:
+        product = _root_product(graph, root)
+        if product is None:
+            units[root] = [(root, None, [root])]
+            continue
+        own, representations = _product_anchors(graph, links, product, with_components=False)
+        occurrences = _linked(links, product, 'NEXT_ASSEMBLY_USAGE_OCCURRENCE')
+        if not occurrences or _has_own_geometry(graph, representations):
+            units[root] = [(root, product, _product_anchors(graph, links, product)[0] if occurrences else own)]
+            continue
+        units[root] = [(occurrence, graph[occurrence][1][1], _occurrence_anchors(graph, links, occurrence, {product}))
+                       for occurrence in occurrences]
+    return units
+
+
+def fingerprint_components(graph, roots):
+    """
+    Fingerprint every component of split_components from the entities that
+    hold it. A product's fingerprint follows the links that point back at it
+    (shape, shape definition representation and shape representation
+    relationships) so it covers the geometry, not only the entities the root
+    references. Entity ids do not enter any fingerprint.
+
+    Returns {root id: [(component entity id, product definition id or None,
+    hex digest)]}.
+    """
+    units = split_components(graph, roots)
+    anchors = list(dict.fromkeys(anchor for components in units.values()
+                                 for _, _, component_anchors in components for anchor in component_anchors))
+    digests = fingerprint_entities(graph, anchors)
+    fingerprints = {}
+    for root, components in units.items():
+        fingerprints[root] = []
+        for entity, product, component_anchors in components:
+            # The anchors form a set; sorting their digests keeps renumbering out of the result
+            digest = hashlib.sha256()
+            for anchor_digest in sorted(digests[anchor] for anchor in set(component_anchors)):
+                digest.update(anchor_digest.encode('ascii'))
+            fingerprints[root].append((entity, product, digest.hexdigest()))
+    return fingerprints
+
+
+def product_name(graph, root):
+    """
+    Name of the PRODUCT closest to a root entity, or None when there is none.
+    """
+    queue = deque([root])
+    seen = {root}
+    while queue:
+        entity = queue.popleft()
+        body, refs = graph.get(entity, (b'', ()))
+        if body.upper().startswith(b'PRODUCT('):
+            # PRODUCT(id, name, description, contexts): prefer the name, fall back to the id
+            strings = [value[1:-1].replace(b"''", b"'").decode('utf-8', errors='replace')
+                       for value in _STRING.findall(body)[:2]]
+            return next((value for value in reversed(strings) if value), None)
+        for ref in refs:
+            if ref not in seen:
+                seen.add(ref)
+                queue.append(ref)
+    return None
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+# Uploads are streamed into spool files with this prefix, next to nothing else
+SPOOL_PREFIX = 'spool-'
+SPOOL_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = 512 * 1024 * 1024  # 512 MB
+
+# Defaults for the background janitor
+JANITOR_INTERVAL = 10 * 60  # seconds between sweeps
+SPOOL_MAX_AGE = 60 * 60  # stale spool files no job owns any more
+DOWNLOAD_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB of generated reports
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def spool_upload(stream, folder, suffix='', max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Stream an upload into a temporary spool file, hashing it on the way.
+    Returns (spool_path, sha256_hex, size); the caller removes the file.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, spool_path = tempfile.mkstemp(prefix=SPOOL_PREFIX, suffix=suffix, dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(SPOOL_CHUNK_SIZE), b''):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds the limit of {max_bytes} bytes.")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        remove_file(spool_path)
+        raise
+    return spool_path, digest.hexdigest(), size
+
+
+class SpoolFile:
+    """
+    Spool file that hashes everything written to it, for parsers that write
+    an upload themselves (the multipart parser) rather than hand over a
+    stream for spool_upload. Reads, seeks and close go to the open file.
+    """
+
+    def __init__(self, folder, suffix='', max_bytes=MAX_UPLOAD_BYTES):
+        fd, self.path = tempfile.mkstemp(prefix=SPOOL_PREFIX, suffix=suffix, dir=folder)
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.claimed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise UploadTooLarge(f"Upload exceeds the limit of {self.max_bytes} bytes.")
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def claim(self):
+        """
+        Close the spool file and hand it over; the caller removes it from now on.
+        Returns (spool_path, sha256_hex, size) like spool_upload.
+        """
+        self._file.close()
+        self.claimed = True
+        return self.path, self._digest.hexdigest(), self.size
+
+    def discard(self):
+        # Close the file and remove it unless it was claimed
+        self._file.close()
+        if not self.claimed:
+            remove_file(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def enforce_quota(folder, max_bytes=None, max_age=None, prefix='', suffix='', keep=()):
+    """
+    Delete files in folder matching prefix/suffix that are older than max_age
+    seconds, then the least recently modified ones until the rest fit within
+    max_bytes. Files in keep, e.g. those of queued jobs, are never deleted
+    but still count towards max_bytes. Returns the number of files removed.
+    """
+    now = time.time()
+    keep = {os.path.abspath(path) for path in keep}
+    entries = []
+    total_size = 0
+    removed = 0
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return 0
+
+    for name in names:
+        if not (name.startswith(prefix) and name.endswith(suffix)):
+            continue
+        path = os.path.join(folder, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if not os.path.isfile(path):
+            continue
+        if os.path.abspath(path) in keep:
+            total_size += stat.st_size
+            continue
+        if max_age is not None and now - stat.st_mtime > max_age:
+            remove_file(path)
+            removed += 1
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total_size += stat.st_size
+
+    if max_bytes is None:
+        return removed
+
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= max_bytes:
+            break
+        remove_file(path)
+        total_size -= size
+        removed += 1
+    return removed
+
+
+class Janitor:
+    """
+    Background thread that periodically applies enforce_quota to a set of
+    folders, each given as a dict of enforce_quota keyword arguments. A
+    callable keep is called on every sweep for the current set of files.
+    """
+
+    def __init__(self, rules, interval=JANITOR_INTERVAL):
+        self.rules = rules
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def sweep(self):
+        for folder, rule in self.rules.items():
+            if callable(rule.get('keep')):
+                rule = dict(rule, keep=rule['keep']())
+            removed = enforce_quota(folder, **rule)
+            if removed:
+                print(f"Janitor removed {removed} file(s) from {folder}")
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error during janitor sweep: {e}")
+            self._stop.wait(self.interval)
@@ -1,199 +1,223 @@
-from flask import Flask, render_template, request, send_from_directory, jsonify
-import os
-from werkzeug.utils import secure_filename
-from OCC.Core.STEPControl import STEPControl_Reader
-from OCC.Core.TopExp import TopExp_Explorer
-from OCC.Core.TopAbs import TopAbs_FACE, TopAbs_EDGE
-from OCC.Core.BRep import BRep_Tool
-from OCC.Core.BRepBndLib import brepbndlib
-from OCC.Core.Bnd import Bnd_Box
-from OCC.Core.Geom import Geom_Plane, Geom_RectangularTrimmedSurface
-
-app = Flask(__name__)
-
-# Path to store uploaded files and temporary converted files
-UPLOAD_FOLDER = 'uploads'
-CONVERTED_FOLDER = 'converted'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(CONVERTED_FOLDER, exist_ok=True)
-
-# Configure the app
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['CONVERTED_FOLDER'] = CONVERTED_FOLDER
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    if 'file' not in request.files:
-        return jsonify({'success': False, 'error': 'No file part'})
-
-    file = request.files['file']
-    filename = file.filename
-
-    if not filename:
-        return jsonify({'success': False, 'error': 'No selected file'})
-
-    # Validate file extension
-    if not filename.lower().endswith('.stp'):
-        return jsonify({'success': False, 'error': 'Invalid file extension. Please upload a .stp file.'})
-
-    # Save the uploaded file
-    safe_filename = secure_filename(filename)
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], safe_filename)
-    file.save(file_path)
-
-    # Convert the .stp file to .txt
-    txt_filename = convert_to_txt(file_path, safe_filename)
-    if txt_filename:
-        return jsonify({'success': True, 'filename': txt_filename})
-
-    return jsonify({'success': False, 'error': 'Conversion failed. Please try again.'})
-
-# def extract_bounded_surfaces(shape):
-#     explorer = TopExp_Explorer(shape, TopAbs_FACE)
-#     surfaces = []
-#
-#     while explorer.More():
-#         face = explorer.Current()
-#         surface = BRep_Tool.Surface(face)
-#         area = None
-#         surface_type = surface.DynamicType().Name()
-#
-#         if isinstance(surface, Geom_RectangularTrimmedSurface):
-#             u_min, u_max, v_min, v_max = surface.Bounds()
-#             if u_min != u_max and v_min != v_max:
-#                 area = (u_max - u_min) * (v_max - v_min)
-#             else:
-#                 area = "Invalid bounds"
-#         elif isinstance(surface, Geom_Plane):
-#             area = "Infinite"
-#
-#         edge_explorer = TopExp_Explorer(face, TopAbs_EDGE)
-#         edge_count = 0
-#         while edge_explorer.More():
-#             edge_explorer.Next()
-#             edge_count += 1
-#
-#         surfaces.append({
-#             "Type": surface_type,
-#             "Area": area if area is not None else "Infinite",
-#             "EdgeCount": edge_count,
-#             "Bounds": surface.Bounds()
-#         })
-#
-#         explorer.Next()
-#
-#     return surfaces
+import math
+from array import array
+import numpy as np
+from OCC.Core.BRepAdaptor import BRepAdaptor_Surface
+from OCC.Core.BRepGProp import brepgprop
+from OCC.Core.BRepLProp import BRepLProp_SLProps
+from OCC.Core.BRepTools import breptools
+from OCC.Core.GProp import GProp_GProps
+from OCC.Core.TopAbs import TopAbs_REVERSED
+from OCC.Core.TopTools import TopTools_IndexedMapOfShape
+from OCC.Core.TopoDS import topods
+from formats import save_surfaces, table_rows
+from metrics import stage
+from topology import count_edges, iter_faces, walk_shape
+
+# GeomAbs_SurfaceType values in enum order; TypeCode indexes into this tuple
+SURFACE_TYPES = ('Plane', 'Cylinder', 'Cone', 'Sphere', 'Torus', 'BezierSurface', 'BSplineSurface',
+                 'SurfaceOfRevolution', 'SurfaceOfExtrusion', 'OffsetSurface', 'OtherSurface')
+
+def measure_face(face, adaptor):
+    """
+    Measure one face: area and centroid with BRepGProp, the outward normal at
+    the middle of its UV domain with BRepLProp, and the UV domain itself.
+    Values are returned in SurfaceCollector.FLOAT_COLUMNS order.
+    """
+    props = GProp_GProps()
+    brepgprop.SurfaceProperties(face, props)
+    centroid = props.CentreOfMass()
+
+    u_min, u_max, v_min, v_max = breptools.UVBounds(face)
+    normal = (math.nan, math.nan, math.nan)
+    local_props = BRepLProp_SLProps(adaptor, (u_min + u_max) / 2, (v_min + v_max) / 2, 1, 1e-6)
+    if local_props.IsNormalDefined():
+        direction = local_props.Normal()
+        # Report the outward normal of the face, not of the underlying surface
+        sign = -1.0 if face.Orientation() == TopAbs_REVERSED else 1.0
+        normal = (sign * direction.X(), sign * direction.Y(), sign * direction.Z())
+
+    return (props.Mass(), centroid.X(), centroid.Y(), centroid.Z(), *normal, u_min, u_max, v_min, v_max)
+
+class SurfaceCollector:
+    """
+    Face visitor for walk_shape that measures every face with BRepGProp
+    (area, centroid) and BRepLProp (normal at the middle of its UV domain),
+    storing the results column-wise in compact arrays rather than one dict
+    per face. table() returns them as NumPy arrays without copying.
+    """
+    FLOAT_COLUMNS = ('Area', 'Centroid_X', 'Centroid_Y', 'Centroid_Z', 'Normal_X', 'Normal_Y', 'Normal_Z',
+                     'U_min', 'U_max', 'V_min', 'V_max')
+    INT_COLUMNS = ('TypeCode', 'EdgeCount', 'Solid')
+
+    def __init__(self):
+        self._floats = {name: array('d') for name in self.FLOAT_COLUMNS}
+        self._ints = {name: array('q') for name in self.INT_COLUMNS}
+
+    def __call__(self, face, edge_count, solid_index):
+        adaptor = BRepAdaptor_Surface(face, True)
+        for name, value in zip(self.FLOAT_COLUMNS, measure_face(face, adaptor)):
+            self._floats[name].append(value)
+        for name, value in zip(self.INT_COLUMNS, (int(adaptor.GetType()), edge_count, solid_index)):
+            self._ints[name].append(value)
+
+    def __len__(self):
+        return len(self._floats['Area'])
+
+    def table(self):
+        columns = {'surface': np.arange(1, len(self) + 1, dtype=np.int64)}
+        type_codes = np.frombuffer(self._ints['TypeCode'], dtype=np.int64)
+        columns['Type'] = np.array(SURFACE_TYPES, dtype=object)[type_codes]
+        for name in self.INT_COLUMNS:
+            columns[name] = np.frombuffer(self._ints[name], dtype=np.int64)
+        for name in self.FLOAT_COLUMNS:
+            columns[name] = np.frombuffer(self._floats[name], dtype=np.float64)
+        return columns
+
+def surface_stats_per_solid(table, solid_count):
+    """
+    Aggregate the surface table per solid: face count, total area and area
+    per surface type. Faces outside any solid are reported as solid 0.
+    """
+    type_count = len(SURFACE_TYPES)
+    # Free faces (solid index -1) go into an extra bucket after the solids
+    buckets = np.where(table['Solid'] >= 0, table['Solid'], solid_count)
+    face_counts = np.bincount(buckets, minlength=solid_count + 1)
+    total_area = np.bincount(buckets, weights=table['Area'], minlength=solid_count + 1)
+    area_by_type = np.bincount(buckets * type_count + table['TypeCode'], weights=table['Area'],
+                               minlength=(solid_count + 1) * type_count).reshape(solid_count + 1, type_count)
+
+    rows = solid_count + (1 if face_counts[solid_count] else 0)
+    stats = {
+        'solid': np.append(np.arange(1, solid_count + 1, dtype=np.int64), 0)[:rows],
+        'FaceCount': face_counts[:rows],
+        'TotalArea': total_area[:rows]
+    }
+    for code, name in enumerate(SURFACE_TYPES):
+        if area_by_type[:, code].any():
+            stats[f'Area_{name}'] = area_by_type[:rows, code]
+    return stats
 
 def extract_bounded_surfaces(shape):
-    explorer = TopExp_Explorer(shape, TopAbs_FACE)
-    surfaces = []
-
-    while explorer.More():
-        face = explorer.Current()
-        surface = BRep_Tool.Surface(face)
-        area = None
-        surface_type = surface.DynamicType().Name()
-
-        if isinstance(surface, Geom_RectangularTrimmedSurface):
-            # Get actual trimmed surface using Surface.TrimmedSurface()
-            trimmed_surface = surface.TrimmedSurface()
-            if trimmed_surface:
-                u_min, u_max, v_min, v_max = trimmed_surface.Bounds()
-                if u_min != u_max and v_min != v_max:
-                    area = (u_max - u_min) * (v_max - v_min)
-                else:
-                    area = "Invalid bounds"
-            else:
-                area = "Not a valid trimmed surface"
-        elif isinstance(surface, Geom_Plane):
-            area = "Infinite"
-
-        edge_explorer = TopExp_Explorer(face, TopAbs_EDGE)
-        edge_count = 0
-        while edge_explorer.More():
-            edge_explorer.Next()
-            edge_count += 1
-
-        surfaces.append({
-            "Type": surface_type,
-            "Area": area if area is not None else "Infinite",
-            "EdgeCount": edge_count,
-            "Bounds": surface.Bounds()
-        })
-
-        explorer.Next()
-
-    return surfaces
-
-def extract_dimensions(shape):
-    """ Extracts the dimensions (bounding box) of the shape. """
-    bbox = Bnd_Box()
-    brepbndlib.Add(shape, bbox)
-
-    # Get the min and max bounds of the shape
-    xmin, ymin, zmin, xmax, ymax, zmax = bbox.Get()
-
-    # Return the dimensions (width, height, depth)
-    return {
-        "Width": xmax - xmin,
-        "Height": ymax - ymin,
-        "Depth": zmax - zmin
-    }
+    """ Returns the surface table (column name -> NumPy array) of every face in the shape. """
+    collector = SurfaceCollector()
+    walk_shape(shape, solid_boxes=False, face_visitor=collector)
+    return collector.table()
 
-def convert_to_txt(stp_path, original_filename):
+class FaceIndex:
+    """
+    Every face of a shape, numbered like the surface table, for direct
+    access by surface number. Distinct faces are kept once in a
+    TopTools_IndexedMapOfShape; per surface number, NumPy arrays hold the
+    face's map index, its orientation and its owning solid index. Surface
+    types are looked up once, on the first query that filters by type.
+    """
+    __slots__ = ('faces', 'keys', 'orientations', 'solids', '_type_codes')
+
+    def __init__(self, shape):
+        self.faces = TopTools_IndexedMapOfShape()
+        keys, orientations, solids = array('q'), array('q'), array('q')
+        for face, solid_index in iter_faces(shape):
+            keys.append(self.faces.Add(face))
+            orientations.append(int(face.Orientation()))
+            solids.append(solid_index)
+        self.keys = np.frombuffer(keys, dtype=np.int64)
+        self.orientations = np.frombuffer(orientations, dtype=np.int64)
+        self.solids = np.frombuffer(solids, dtype=np.int64)
+        self._type_codes = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def face(self, position):
+        # The face at a 0-based position, with the orientation it has there;
+        # the map only keeps the first orientation a face was seen with
+        face = self.faces.FindKey(int(self.keys[position]))
+        return topods.Face(face.Oriented(int(self.orientations[position])))
+
+    @property
+    def type_codes(self):
+        # GeomAbs_SurfaceType per surface number, as indexes into SURFACE_TYPES
+        if self._type_codes is None:
+            by_key = np.array([int(BRepAdaptor_Surface(topods.Face(self.faces.FindKey(key)), False).GetType())
+                               for key in range(1, self.faces.Size() + 1)], dtype=np.int64)
+            self._type_codes = by_key[self.keys - 1]
+        return self._type_codes
+
+def iter_surfaces(faces, types=None, after=0):
+    """
+    Lazily yield one surface row per face of a FaceIndex, numbered like the
+    surface table. Rows resume directly after surface number after, and
+    faces whose type is not in types are skipped without being measured, so
+    memory stays flat for any face count.
+    """
+    positions = np.arange(after, len(faces))
+    if types:
+        codes = [SURFACE_TYPES.index(name) for name in types]
+        positions = positions[np.isin(faces.type_codes[after:], codes)]
+
+    for position in positions:
+        position = int(position)
+        face = faces.face(position)
+        adaptor = BRepAdaptor_Surface(face, True)
+        type_code = int(adaptor.GetType())
+        row = {'surface': position + 1, 'Type': SURFACE_TYPES[type_code], 'TypeCode': type_code,
+               'EdgeCount': count_edges(face), 'Solid': int(faces.solids[position])}
+        for name, value in zip(SurfaceCollector.FLOAT_COLUMNS, measure_face(face, adaptor)):
+            row[name] = None if math.isnan(value) else value
+        yield row
+
+def save_surface_report(shape, file_path, fmt='txt'):
     """
-    Converts an .stp file to a .txt file by extracting information about solids, dimensions, and surfaces.
+    Writes the overall dimensions, every surface and the per-solid surface statistics of a shape
+    as a .txt report, or in any other entry of OUTPUT_FORMATS.
     """
-    try:
-        # Strip the .stp extension and create the .txt file name
-        txt_filename = original_filename.rsplit('.', 1)[0] + '.txt'
-
-        # Define the output .txt file path in the converted folder
-        output_txt = os.path.join(app.config['CONVERTED_FOLDER'], txt_filename)
-
-        # Initialize STEP reader and load the file
-        step_reader = STEPControl_Reader()
-        status = step_reader.ReadFile(stp_path)
-        if status != 1:
-            return None
-
-        step_reader.TransferRoots()
-        shape = step_reader.Shape()
-
-        # Extract information about solids, dimensions, and surfaces
-        with open(output_txt, 'w') as txt_file:
-            # Write the dimensions of the solid (bounding box)
-            dimensions = extract_dimensions(shape)
-            txt_file.write("Solid Dimensions (Bounding Box):\n")
-            txt_file.write(f"  Width: {dimensions['Width']}\n")
-            txt_file.write(f"  Height: {dimensions['Height']}\n")
-            txt_file.write(f"  Depth: {dimensions['Depth']}\n")
-
-            # Surface information
-            txt_file.write("\nSurface Information:\n")
-            for idx, surface in enumerate(extract_bounded_surfaces(shape)):
-                txt_file.write(f"\nSurface {idx + 1}:\n")
-                txt_file.write(f"  Type: {surface['Type']}\n")
-                txt_file.write(f"  Area: {surface['Area']}\n")
-                txt_file.write(f"  Edge Count: {surface['EdgeCount']}\n")
-                txt_file.write(f"  Bounds: {surface['Bounds']}\n")
-
-        return txt_filename
-
-    except Exception as e:
-        print(f"Error during conversion: {e}")
-        return None
-
-@app.route('/download/<filename>')
-def download_file(filename):
-    file_path = os.path.join(app.config['CONVERTED_FOLDER'], filename)
-    if os.path.exists(file_path):
-        return send_from_directory(app.config['CONVERTED_FOLDER'], filename, as_attachment=True)
-    return jsonify({'success': False, 'error': 'File not found'}), 404
-
-if __name__ == '__main__':
-    app.run(debug=True)
+    # Walk the shape once for the overall box and every face
+    with stage('surfaces', 'walk') as timer:
+        collector = SurfaceCollector()
+        walk = walk_shape(shape, face_visitor=collector)
+        table = collector.table()
+        stats = surface_stats_per_solid(table, walk.solid_count)
+        timer.add('solids', walk.solid_count)
+        timer.add('faces', walk.face_count)
+    dimensions = walk.overall_bbox
+
+    if fmt != 'txt':
+        with stage('surfaces', 'write'):
+            save_surfaces(dimensions, table, stats, file_path, fmt)
+        return
+
+    # Write the dimensions of the solid (bounding box)
+    lines = [
+        "Solid Dimensions (Bounding Box):\n",
+        f"  Width: {dimensions['Width']}\n",
+        f"  Height: {dimensions['Height']}\n",
+        f"  Depth: {dimensions['Depth']}\n",
+        "\nSurface Information:\n"
+    ]
+
+    # Surface information
+    for surface in table_rows(table):
+        lines.append(
+            f"\nSurface {surface['surface']}:\n"
+            f"  Type: {surface['Type']}\n"
+            f"  Area: {surface['Area']}\n"
+            f"  Centroid: ({surface['Centroid_X']}, {surface['Centroid_Y']}, {surface['Centroid_Z']})\n"
+            f"  Normal: ({surface['Normal_X']}, {surface['Normal_Y']}, {surface['Normal_Z']})\n"
+            f"  Edge Count: {surface['EdgeCount']}\n"
+            f"  Bounds: ({surface['U_min']}, {surface['U_max']}, {surface['V_min']}, {surface['V_max']})\n"
+            f"  Solid: {surface['Solid'] + 1 if surface['Solid'] >= 0 else 'None'}\n"
+        )
+
+    # Aggregate statistics per solid
+    lines.append("\nSolid Surface Statistics:\n")
+    for solid in table_rows(stats):
+        by_type = ", ".join(f"{name[5:]}: {value}" for name, value in solid.items() if name.startswith('Area_'))
+        lines.append(
+            f"\n{'Solid ' + str(solid['solid']) if solid['solid'] else 'Faces outside solids'}:\n"
+            f"  Face Count: {solid['FaceCount']}\n"
+            f"  Total Area: {solid['TotalArea']}\n"
+            f"  Area by Type: {by_type}\n"
+        )
+
+    with stage('surfaces', 'write'), open(file_path, 'w') as txt_file:
+        txt_file.write("".join(lines))
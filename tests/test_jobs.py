@@ -0,0 +1,148 @@
+import json
+import os
+import time
+
+import pytest
+
+from jobs import (ERROR_CRASHED, ERROR_EXCEPTION, ERROR_MEMORY, ERROR_TIMEOUT, JOB_DONE, JOB_FAILED, JOB_QUEUED,
+                  JOB_RUNNING, JobQueue, QueueFullError)
+
+
+# Job functions must be module-level so they can be sent to a worker
+
+def worker_pid(delay=0.0):
+    time.sleep(delay)
+    return os.getpid()
+
+
+def fail():
+    raise ValueError('bad input')
+
+
+def crash():
+    os._exit(1)
+
+
+def hold_memory(megabytes, seconds):
+    block = bytearray(megabytes * 1024 * 1024)
+    block[::4096] = b'x' * len(block[::4096])
+    time.sleep(seconds)
+    return len(block)
+
+
+@pytest.fixture
+def make_queue():
+    queues = []
+
+    def make(**options):
+        options.setdefault('workers', 1)
+        options.setdefault('max_rss', 0)
+        job_queue = JobQueue(**options)
+        queues.append(job_queue)
+        return job_queue
+
+    yield make
+    for job_queue in queues:
+        job_queue.shutdown()
+
+
+def wait_for_status(job_queue, job_id, status, timeout=10):
+    deadline = time.monotonic() + timeout
+    snapshot = job_queue.get(job_id)
+    while snapshot['status'] != status and time.monotonic() < deadline:
+        snapshot = job_queue.wait(job_id, snapshot['status'], timeout=0.1)
+    return snapshot
+
+
+def test_result_and_exception(make_queue):
+    job_queue = make_queue()
+    assert job_queue.run(worker_pid)['result'] != os.getpid()
+
+    job = job_queue.run(fail)
+    assert job['status'] == JOB_FAILED
+    assert job['error_code'] == ERROR_EXCEPTION
+    assert 'bad input' in job['error']
+
+
+def test_timeout_kills_the_worker(make_queue):
+    job_queue = make_queue(timeout=1)
+    started = time.monotonic()
+    job = job_queue.run(worker_pid, 30)
+    assert job['status'] == JOB_FAILED
+    assert job['error_code'] == ERROR_TIMEOUT
+    assert time.monotonic() - started < 10
+    # The slot starts a fresh worker for the next job
+    assert job_queue.run(worker_pid)['status'] == JOB_DONE
+
+
+def test_memory_limit_kills_the_worker(make_queue):
+    job_queue = make_queue(max_rss=300 * 1024 * 1024)
+    job = job_queue.run(hold_memory, 600, 30)
+    assert job['status'] == JOB_FAILED
+    assert job['error_code'] == ERROR_MEMORY
+    assert job_queue.run(hold_memory, 1, 0)['status'] == JOB_DONE
+
+
+def test_crashed_worker_is_replaced(make_queue):
+    job_queue = make_queue()
+    job = job_queue.run(crash)
+    assert job['status'] == JOB_FAILED
+    assert job['error_code'] == ERROR_CRASHED
+    assert job_queue.run(worker_pid)['status'] == JOB_DONE
+
+
+def test_workers_are_recycled_after_max_tasks(make_queue):
+    job_queue = make_queue(max_tasks_per_worker=2)
+    pids = [job_queue.run(worker_pid)['result'] for _ in range(4)]
+    assert pids[0] == pids[1]
+    assert pids[2] == pids[3]
+    assert pids[1] != pids[2]
+
+
+def test_full_queue_refuses_jobs(make_queue):
+    job_queue = make_queue(max_queue=1)
+    running = job_queue.submit(worker_pid, 1.0)
+    wait_for_status(job_queue, running, JOB_RUNNING)
+    job_queue.submit(worker_pid)
+    assert job_queue.depth() == 1
+    with pytest.raises(QueueFullError):
+        job_queue.submit(worker_pid)
+
+
+@pytest.mark.parametrize('func, status', [(worker_pid, JOB_DONE), (fail, JOB_FAILED), (crash, JOB_FAILED)])
+def test_owned_files_are_removed_however_the_job_ends(make_queue, tmp_path, func, status):
+    job_queue = make_queue()
+    blocker = job_queue.submit(worker_pid, 0.5)
+    owned = tmp_path / 'spool.stp'
+    owned.write_bytes(b'data')
+
+    job_id = job_queue.submit(func, owned_files=(str(owned),))
+    assert str(owned) in job_queue.active_files()
+    job = wait_for_status(job_queue, job_id, status)
+    assert job['status'] == status
+    assert not owned.exists()
+    assert job_queue.active_files() == set()
+    assert job_queue.get(blocker)['status'] == JOB_DONE
+
+
+def test_events_follow_the_job(make_queue):
+    job_queue = make_queue()
+    job_queue.submit(worker_pid, 0.5)
+    job_id = job_queue.submit(worker_pid, 0.5)
+
+    events = list(job_queue.events(job_id))
+    snapshots = [json.loads(event[len('data: '):]) for event in events if event.startswith('data: ')]
+    assert [snapshot['status'] for snapshot in snapshots] == [JOB_QUEUED, JOB_RUNNING, JOB_DONE]
+    assert snapshots[-1]['result'] is not None
+    assert all(event.endswith('\n\n') for event in events)
+
+
+def test_events_of_an_unknown_job(make_queue):
+    events = list(make_queue().events('missing'))
+    assert json.loads(events[0][len('data: '):]) == {'job_id': 'missing', 'status': 'unknown'}
+
+
+def test_jobs_with_one_affinity_share_a_worker(make_queue):
+    job_queue = make_queue(workers=3)
+    pids = {job_queue.run(worker_pid, affinity='part')['result'] for _ in range(6)}
+    assert len(pids) == 1
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from spatial import SolidIndex
+
+
+def random_boxes(rng, count, spread=20):
+    # Integer corners so touching boxes and equal distances come up often
+    corners = rng.integers(0, spread, size=(count, 3)).astype(np.float64)
+    sizes = rng.integers(0, 5, size=(count, 3)).astype(np.float64)
+    return np.hstack((corners, corners + sizes))
+
+
+def stacked_on_x(count):
+    # Every box spans the same X range, so sweeping along X compares all pairs
+    layers = np.arange(count, dtype=np.float64)
+    return np.stack((np.zeros(count), layers, layers % 3, np.full(count, 10.0), layers + 0.5, layers % 3 + 1),
+                    axis=1)
+
+
+def overlaps(a, b):
+    return bool(np.all(a[:3] <= b[3:]) and np.all(b[:3] <= a[3:]))
+
+
+def reference_pairs(boxes):
+    return [[i, j] for i in range(len(boxes)) for j in range(i + 1, len(boxes)) if overlaps(boxes[i], boxes[j])]
+
+
+def reference_distance(a, b):
+    gaps = np.maximum(0.0, np.maximum(a[:3] - b[3:], b[:3] - a[3:]))
+    return float(np.sqrt(np.sum(gaps * gaps)))
+
+
+CASES = [
+    pytest.param(lambda rng: random_boxes(rng, 200), id='random'),
+    pytest.param(lambda rng: random_boxes(rng, 300, spread=5), id='dense'),
+    pytest.param(lambda rng: stacked_on_x(120), id='stacked-on-x'),
+    pytest.param(lambda rng: random_boxes(rng, 1), id='single'),
+    pytest.param(lambda rng: np.empty((0, 6)), id='empty'),
+]
+
+
+@pytest.mark.parametrize('make_boxes', CASES)
+def test_overlapping_pairs_match_reference(make_boxes):
+    boxes = make_boxes(np.random.default_rng(1))
+    pairs = SolidIndex(boxes).overlapping_pairs()
+    assert pairs.shape[1] == 2
+    assert pairs.tolist() == reference_pairs(boxes)
+
+
+@pytest.mark.parametrize('make_boxes', CASES)
+def test_intersecting_matches_reference(make_boxes):
+    rng = np.random.default_rng(2)
+    boxes = make_boxes(rng)
+    index = SolidIndex(boxes)
+    for query in random_boxes(rng, 50):
+        expected = [i for i in range(len(boxes)) if overlaps(boxes[i], query)]
+        assert index.intersecting(query).tolist() == expected
+
+
+@pytest.mark.parametrize('make_boxes', CASES)
+def test_nearest_matches_reference(make_boxes):
+    rng = np.random.default_rng(3)
+    boxes = make_boxes(rng)
+    index = SolidIndex(boxes)
+    points = rng.integers(-5, 25, size=(30, 3)).astype(np.float64)
+    for query in np.hstack((points, points)):
+        distances = [reference_distance(box, query) for box in boxes]
+        # Equally distant solids come in position order
+        expected = sorted(range(len(boxes)), key=lambda i: (distances[i], i))
+        for k in (1, 5, len(boxes) + 1):
+            positions, found = index.nearest(query, k)
+            assert positions.tolist() == expected[:k]
+            assert found.tolist() == pytest.approx([distances[i] for i in expected[:k]])
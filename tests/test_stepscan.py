@@ -0,0 +1,181 @@
+import gzip
+
+import pytest
+
+from stepscan import fingerprint_components, prescan_step_file, read_entity_graph, scan_step_file
+
+PART = """\
+#{pd}=PRODUCT_DEFINITION('design','',#{pdf},#900);
+#{pdf}=PRODUCT_DEFINITION_FORMATION('','',#{product});
+#{product}=PRODUCT('{name}','{name}','',(#901));
+#{pds}=PRODUCT_DEFINITION_SHAPE('','',#{pd});
+#{sdr}=SHAPE_DEFINITION_REPRESENTATION(#{pds},#{sr});
+#{sr}=SHAPE_REPRESENTATION('',(#{axis}),#902);
+#{axis}=AXIS2_PLACEMENT_3D('',#903,$,$);
+#{srr}=SHAPE_REPRESENTATION_RELATIONSHIP('','',#{sr},#{brep_rep});
+#{brep_rep}=ADVANCED_BREP_SHAPE_REPRESENTATION('',(#{axis},#{solid}),#902);
+#{solid}=MANIFOLD_SOLID_BREP('',#{point});
+#{point}=CARTESIAN_POINT('',({x},0.,0.));
+"""
+
+OCCURRENCE = """\
+#{nauo}=NEXT_ASSEMBLY_USAGE_OCCURRENCE('{name}','','',#1,#{child},$);
+#{pds}=PRODUCT_DEFINITION_SHAPE('','',#{nauo});
+#{cdsr}=CONTEXT_DEPENDENT_SHAPE_REPRESENTATION(#{rel},#{pds});
+#{rel}=(REPRESENTATION_RELATIONSHIP('','',#13,#{child_sr})REPRESENTATION_RELATIONSHIP_WITH_TRANSFORMATION(#{transform})SHAPE_REPRESENTATION_RELATIONSHIP());
+#{transform}=ITEM_DEFINED_TRANSFORMATION('','',#14,#{axis});
+#{axis}=AXIS2_PLACEMENT_3D('',#{point},$,$);
+#{point}=CARTESIAN_POINT('',({offset},0.,0.));
+"""
+
+SHARED = """\
+#900=PRODUCT_DEFINITION_CONTEXT('part definition',#904,'design');
+#901=PRODUCT_CONTEXT('',#904,'mechanical');
+#902=GEOMETRIC_REPRESENTATION_CONTEXT(3);
+#903=CARTESIAN_POINT('',(0.,0.,0.));
+#904=APPLICATION_CONTEXT('automotive design');
+"""
+
+ASSEMBLY = """\
+#1=PRODUCT_DEFINITION('design','',#10,#900);
+#10=PRODUCT_DEFINITION_FORMATION('','',#11);
+#11=PRODUCT('assembly','assembly','',(#901));
+#12=PRODUCT_DEFINITION_SHAPE('','',#1);
+#15=SHAPE_DEFINITION_REPRESENTATION(#12,#13);
+#13=SHAPE_REPRESENTATION('',(#14),#902);
+#14=AXIS2_PLACEMENT_3D('',#903,$,$);
+"""
+
+
+def part(base, name, x):
+    fields = ('pd', 'pdf', 'product', 'pds', 'sdr', 'sr', 'axis', 'srr', 'brep_rep', 'solid', 'point')
+    ids = {field: base + offset for offset, field in enumerate(fields)}
+    return PART.format(name=name, x=x, **ids), ids
+
+
+def occurrence(base, name, child, offset):
+    fields = ('nauo', 'pds', 'cdsr', 'rel', 'transform', 'axis', 'point')
+    ids = {field: base + position for position, field in enumerate(fields)}
+    return OCCURRENCE.format(name=name, child=child['pd'], child_sr=child['sr'], offset=offset, **ids), ids
+
+
+def write_step(path, data):
+    path.write_text("ISO-10303-21;\nHEADER;\nFILE_SCHEMA(('AUTOMOTIVE_DESIGN'));\nENDSEC;\nDATA;\n"
+                    + data + "ENDSEC;\nEND-ISO-10303-21;\n")
+    return read_entity_graph(str(path))
+
+
+def single_part(tmp_path, x, base=100):
+    data, ids = part(base, 'bracket', x)
+    return write_step(tmp_path / 'part.stp', data + SHARED), ids['pd']
+
+
+def assembly(tmp_path, bolt_x=1.0, nut_x=2.0, nut_offset=50.0):
+    bolt, bolt_ids = part(100, 'bolt', bolt_x)
+    nut, nut_ids = part(200, 'nut', nut_x)
+    bolt_use, _ = occurrence(300, 'bolt', bolt_ids, 0.0)
+    nut_use, _ = occurrence(400, 'nut', nut_ids, nut_offset)
+    return write_step(tmp_path / 'assembly.stp', ASSEMBLY + bolt + nut + bolt_use + nut_use + SHARED)
+
+
+def fingerprints(graph, root):
+    return [fingerprint for _, _, fingerprint in fingerprint_components(graph, [root])[root]]
+
+
+def test_geometry_edit_changes_part_fingerprint(tmp_path):
+    graph, root = single_part(tmp_path, 1.0)
+    before = fingerprints(graph, root)
+    graph, root = single_part(tmp_path, 1.5)
+    assert fingerprints(graph, root) != before
+
+
+def test_renumbering_keeps_part_fingerprint(tmp_path):
+    graph, root = single_part(tmp_path, 1.0)
+    before = fingerprints(graph, root)
+    graph, root = single_part(tmp_path, 1.0, base=5000)
+    assert fingerprints(graph, root) == before
+
+
+def test_assembly_root_splits_into_occurrences(tmp_path):
+    graph = assembly(tmp_path)
+    components = fingerprint_components(graph, [1])[1]
+    assert [(entity, product) for entity, product, _ in components] == [(300, 100), (400, 200)]
+
+
+def test_component_edit_changes_only_that_component(tmp_path):
+    bolt, nut = fingerprints(assembly(tmp_path), 1)
+
+    edited_bolt, edited_nut = fingerprints(assembly(tmp_path, nut_x=2.5), 1)
+    assert edited_bolt == bolt
+    assert edited_nut != nut
+
+    moved_bolt, moved_nut = fingerprints(assembly(tmp_path, nut_offset=60.0), 1)
+    assert moved_bolt == bolt
+    assert moved_nut != nut
+
+
+SCANNER_DATA = """\
+#1=CARTESIAN_POINT('',(0.,0.,0.));
+/* leading; comment */#2=DIRECTION('',(0.,0.,1.));
+/* c; */#3 = QUX(#1,#2);
+#4=PRODUCT('a;b','it''s; quoted','',(#5));
+#5=(GEOMETRIC_REPRESENTATION_CONTEXT(3)/* inner; */GLOBAL_UNIT_ASSIGNED_CONTEXT((#6))REPRESENTATION_CONTEXT('x;','y'));
+  /* several */ /* comments */
+#6=(LENGTH_UNIT()NAMED_UNIT(*)SI_UNIT(.MILLI.,.METRE.));
+"""
+
+
+def scanner_file(tmp_path):
+    path = tmp_path / 'scanner.stp'
+    path.write_text("ISO-10303-21;\nHEADER;\n/* header; comment */FILE_SCHEMA(('AUTOMOTIVE_DESIGN'));\nENDSEC;\n"
+                    "DATA;\n" + SCANNER_DATA + "ENDSEC;\nEND-ISO-10303-21;\n")
+    return str(path)
+
+
+def test_entities_after_comments_are_scanned(tmp_path):
+    scan = scan_step_file(scanner_file(tmp_path))
+    assert scan['entity_count'] == 6
+    assert scan['entity_types']['QUX'] == 1
+    assert scan['entity_types']['DIRECTION'] == 1
+    assert scan['schema'] == ['AUTOMOTIVE_DESIGN']
+
+
+def test_entity_graph_keeps_entities_after_comments(tmp_path):
+    graph = read_entity_graph(scanner_file(tmp_path))
+    assert sorted(graph) == [1, 2, 3, 4, 5, 6]
+    assert graph[3] == (b'QUX(#,#)', [1, 2])
+
+
+def test_complex_instances_list_every_type(tmp_path):
+    types = scan_step_file(scanner_file(tmp_path))['entity_types']
+    for name in ('GEOMETRIC_REPRESENTATION_CONTEXT', 'GLOBAL_UNIT_ASSIGNED_CONTEXT', 'REPRESENTATION_CONTEXT',
+                 'LENGTH_UNIT', 'NAMED_UNIT', 'SI_UNIT'):
+        assert types[name] == 1
+
+
+def test_quoted_semicolons_stay_in_the_statement(tmp_path):
+    graph = read_entity_graph(scanner_file(tmp_path))
+    assert graph[4] == (b"PRODUCT('a;b','it''s; quoted','',(#))", [5])
+
+
+@pytest.mark.parametrize('chunk_size', range(1, 8))
+def test_chunk_boundaries_do_not_change_the_scan(tmp_path, chunk_size):
+    path = scanner_file(tmp_path)
+    assert scan_step_file(path, chunk_size) == scan_step_file(path)
+    assert read_entity_graph(path, chunk_size) == read_entity_graph(path)
+
+
+def test_prescan_stops_once_both_limits_are_exceeded(tmp_path):
+    path = tmp_path / 'many.stp.gz'
+    with gzip.open(path, 'wb') as f:
+        f.write(b"ISO-10303-21;\nHEADER;\nENDSEC;\nDATA;\n" + b"#1=FOO();\n" * 100000)
+
+    full = prescan_step_file(str(path), chunk_size=4096)
+    assert full['complete'] and full['entity_estimate'] == 100000
+
+    partial = prescan_step_file(str(path), chunk_size=4096, size_limit=8192, entity_limit=1000)
+    assert not partial['complete']
+    assert partial['size'] > 8192 and 1000 < partial['entity_estimate'] < 100000
+
+    capped = prescan_step_file(str(path), chunk_size=4096, max_size=10000)
+    assert not capped['complete'] and 10000 < capped['size'] < full['size']
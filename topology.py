@@ -0,0 +1,191 @@
+from OCC.Core.TopExp import TopExp_Explorer, topexp
+from OCC.Core.TopAbs import TopAbs_SOLID, TopAbs_FACE, TopAbs_EDGE
+from OCC.Core.TopTools import TopTools_IndexedMapOfShape
+from OCC.Core.Bnd import Bnd_Box, Bnd_OBB
+from OCC.Core.BRepBndLib import brepbndlib
+from results import SolidsResult, SolidTable, SolidTableBuilder, extents_to_dict
+
+# Bounding box modes, from cheapest to most precise:
+#   fast     - axis-aligned, from the geometry without triangulation; like
+#              brepbndlib.Add it includes the shape's own tolerances
+#   tight    - axis-aligned via AddOptimal, exact on curved and B-spline faces
+#   oriented - oriented box (OBB) per solid, plus its axis-aligned hull
+# tight and oriented boxes follow the geometry alone. In every mode the
+# tolerance option only adds a gap of that size on every side of each box.
+BBOX_MODES = ('fast', 'tight', 'oriented')
+
+
+def bbox_to_dict(bbox):
+    """
+    Convert a Bnd_Box into the bounding box dict used in all reports.
+    """
+    return extents_to_dict(*bbox.Get())
+
+
+def calculate_overall_bounding_box(shape, bbox_mode='fast', tolerance=0.0):
+    """
+    Calculate the bounding box for the entire shape (not just individual solids).
+    """
+    bbox, _ = bound_shape(shape, bbox_mode, tolerance)
+    return bbox_to_dict(bbox)
+
+
+def bound_shape(shape, bbox_mode='fast', tolerance=0.0):
+    """
+    Bound a shape in the given mode. Returns (Bnd_Box, oriented) where
+    oriented describes the OBB in 'oriented' mode and is None otherwise.
+    A positive tolerance enlarges the box, and the OBB, by that gap on
+    every side; it does not change how the geometry itself is bounded.
+    """
+    bbox = Bnd_Box()
+    oriented = None
+    if bbox_mode == 'fast':
+        brepbndlib.Add(shape, bbox, False)
+    elif bbox_mode == 'tight':
+        brepbndlib.AddOptimal(shape, bbox, False, False)
+    elif bbox_mode == 'oriented':
+        obb = Bnd_OBB()
+        brepbndlib.AddOBB(shape, obb, False, True, False)
+        if tolerance > 0:
+            obb.Enlarge(tolerance)
+        oriented = obb_to_dict(obb)
+        # Keep the axis-aligned hull of the OBB for unions and the text reports;
+        # it already includes the gap
+        for corner in obb_corners(oriented):
+            bbox.Update(*corner)
+        return bbox, oriented
+    else:
+        raise ValueError(f"Unknown bounding box mode: {bbox_mode}")
+
+    if tolerance > 0:
+        bbox.Enlarge(tolerance)
+    return bbox, oriented
+
+
+def obb_to_dict(obb):
+    axes = (obb.XDirection(), obb.YDirection(), obb.ZDirection())
+    center = obb.Center()
+    return {
+        "Center": [center.X(), center.Y(), center.Z()],
+        "Axes": [[axis.X(), axis.Y(), axis.Z()] for axis in axes],
+        "HalfSizes": [obb.XHSize(), obb.YHSize(), obb.ZHSize()]
+    }
+
+
+def obb_corners(oriented):
+    center = oriented["Center"]
+    axes = oriented["Axes"]
+    half_sizes = oriented["HalfSizes"]
+    corners = []
+    for sx in (-1, 1):
+        for sy in (-1, 1):
+            for sz in (-1, 1):
+                signs = (sx, sy, sz)
+                corners.append(tuple(
+                    center[i] + sum(signs[k] * half_sizes[k] * axes[k][i] for k in range(3))
+                    for i in range(3)
+                ))
+    return corners
+
+
+def count_edges(shape):
+    # Count distinct edges; an indexed map collapses shared and seam edges
+    edge_map = TopTools_IndexedMapOfShape()
+    topexp.MapShapes(shape, TopAbs_EDGE, edge_map)
+    return edge_map.Size()
+
+
+def walk_shape(shape, solid_boxes=True, face_visitor=None, bbox_mode='fast', tolerance=0.0):
+    """
+    Visit the solids and faces of a shape once each and compute every metric
+    the reports need in that pass, returned as a SolidsResult.
+
+    Per-solid boxes are unioned into the overall box, so the whole shape is
+    only bounded separately when it contains no solids. When face_visitor is
+    given it is called as face_visitor(face, edge_count, solid_index) for
+    every face, where solid_index is the 0-based index of the owning solid
+    or -1 for faces outside any solid; return values other than None are
+    collected in surfaces. bbox_mode picks one of BBOX_MODES for the
+    per-solid boxes and is recorded in the result.
+    """
+    result = SolidsResult(bbox_mode)
+    boxes = SolidTableBuilder()
+
+    def visit_faces(explorer, solid_index):
+        while explorer.More():
+            face = explorer.Current()
+            result.face_count += 1
+            surface = face_visitor(face, count_edges(face), solid_index)
+            if surface is not None:
+                result.surfaces.append(surface)
+            explorer.Next()
+
+    overall = Bnd_Box()
+    explorer = TopExp_Explorer(shape, TopAbs_SOLID)
+    while explorer.More():
+        solid = explorer.Current()
+        result.solid_count += 1
+        if face_visitor is not None:
+            visit_faces(TopExp_Explorer(solid, TopAbs_FACE), result.solid_count - 1)
+        if solid_boxes:
+            bbox, oriented = bound_shape(solid, bbox_mode, tolerance)
+            overall.Add(bbox)
+            boxes.add(bbox.Get(), oriented)
+        explorer.Next()
+    result.solids = boxes.table()
+
+    if face_visitor is not None:
+        # Faces of shells and free faces that do not belong to any solid
+        visit_faces(TopExp_Explorer(shape, TopAbs_FACE, TopAbs_SOLID), -1)
+
+    if overall.IsVoid():
+        # Surface-only models have no solids to union, so bound the shape itself
+        overall, _ = bound_shape(shape, bbox_mode, tolerance)
+    result.overall = overall.Get()
+
+    return result
+
+
+def iter_faces(shape):
+    """
+    Lazily yield (face, solid_index) for every face of a shape, in the same
+    order walk_shape visits them: the faces of each solid, then the faces
+    outside any solid with solid_index -1.
+    """
+    solid_index = 0
+    solids = TopExp_Explorer(shape, TopAbs_SOLID)
+    while solids.More():
+        faces = TopExp_Explorer(solids.Current(), TopAbs_FACE)
+        while faces.More():
+            yield faces.Current(), solid_index
+            faces.Next()
+        solid_index += 1
+        solids.Next()
+
+    faces = TopExp_Explorer(shape, TopAbs_FACE, TopAbs_SOLID)
+    while faces.More():
+        yield faces.Current(), -1
+        faces.Next()
+
+
+def merge_walk_results(walks, bbox_mode='fast'):
+    """
+    Merge walk_shape results of separate parts, in the given order, into one
+    result whose overall box is the union of the parts' boxes.
+    """
+    merged = SolidsResult(bbox_mode)
+    tables = []
+    boxes = []
+    for walk in walks:
+        merged.solid_count += walk.solid_count
+        tables.append(walk.solids)
+        merged.face_count += walk.face_count
+        merged.surfaces.extend(walk.surfaces)
+        if walk.overall is not None:
+            boxes.append(walk.overall)
+    merged.solids = SolidTable.concat(tables)
+
+    if boxes:
+        merged.overall = (*(min(box[i] for box in boxes) for i in range(3)),
+                          *(max(box[i] for box in boxes) for i in range(3, 6)))
+    return merged